@@ -3,20 +3,31 @@
 # $ git clone my-font
 # $ cd my-font
 # $ python3 documentation/image1.py --output documentation/image1.png
+#
+# It can also animate the font across its axes. For example, 120 frames
+# sweeping wght and wdth, saved as a GIF:
+# $ python3 documentation/image1.py --frames 120 --axis wght=100:1000 --axis wdth=25:151 --output documentation/image1.gif
 
 # Import moduels from external python packages: https://pypi.org/
 from drawbot_skia.drawbot import *
 from fontTools.ttLib import TTFont
 from fontTools.misc.fixedTools import floatToFixedToStr
+from PIL import Image
 
 # Import moduels from the Python Standard Library: https://docs.python.org/3/library/
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import math
+import os
+import shutil
 import subprocess
 import sys
 import argparse
 
 # Constants, these are the main "settings" for the image
 WIDTH, HEIGHT, MARGIN, FRAMES = 2048, 2048, 128, 1
-FONT_PATH = "fonts/ttf/Rubik-Regular.ttf"
+FONT_PATH = "fonts/variable/RobotoFlex[GRAD,XOPQ,XTRA,YOPQ,YTAS,YTDE,YTFI,YTLC,YTUC,opsz,slnt,wdth,wght].ttf"
 FONT_LICENSE = "OFL v1.1"
 AUXILIARY_FONT = "Helvetica"
 AUXILIARY_FONT_SIZE = 48
@@ -25,23 +36,8 @@ BIG_TEXT_FONT_SIZE = 1024
 BIG_TEXT_SIDE_MARGIN = MARGIN * 3.1
 BIG_TEXT_BOTTOM_MARGIN = MARGIN * 5.5
 GRID_VIEW = False # Change this to "True" for a grid overlay
-
-# Handel the "--output" flag
-# For example: $ python3 documentation/image1.py --output documentation/image1.png
-parser = argparse.ArgumentParser()
-parser.add_argument("--output", metavar="PNG", help="where to write the PNG file")
-args = parser.parse_args()
-
-# Load the font with the parts of fonttools that are imported with the line:
-# from fontTools.ttLib import TTFont
-# Docs Link: https://fonttools.readthedocs.io/en/latest/ttLib/ttFont.html
-ttFont = TTFont(FONT_PATH)
-
-# Constants that are worked out dynamically
-MY_URL = subprocess.check_output("git remote get-url origin", shell=True).decode()
-MY_HASH = subprocess.check_output("git rev-parse --short HEAD", shell=True).decode()
-FONT_NAME = ttFont["name"].getDebugName(4)
-FONT_VERSION = "v%s" % floatToFixedToStr(ttFont["head"].fontRevision, 16)
+FRAME_DURATION = 1 / 30 # Seconds per frame of an animated GIF
+CACHE_DIR = ".cache/frames" # Rendered frames, reused while nothing in them changes
 
 
 # Draws a grid
@@ -71,6 +67,20 @@ def remap(value, inputMin, inputMax, outputMin, outputMax):
     return outputMin + (valueScaled * outputSpan)
 
 
+# Work out the axis location of every frame. Each axis goes from its
+# minimum to its maximum and back along a cosine wave, so the animation
+# loops smoothly. (E.g. "wght=100:1000" with 4 frames: 100, 550, 1000, 550)
+def frame_locations(axes, frames):
+    locations = []
+    for frame in range(frames):
+        wave = -math.cos(2 * math.pi * frame / frames)
+        location = {}
+        for tag, (axisMin, axisMax) in axes.items():
+            location[tag] = round(remap(wave, -1, 1, axisMin, axisMax), 2)
+        locations.append(location)
+    return locations
+
+
 # Draw the page/frame and a grid if "GRID_VIEW" is set to "True"
 def draw_background():
     newPage(WIDTH, HEIGHT)
@@ -82,12 +92,14 @@ def draw_background():
         pass
 
 
-# Draw main text
-def draw_main_text():
+# Draw main text, at the axis location of the frame
+def draw_main_text(location):
     fill(1)
     stroke(None)
     font(FONT_PATH)
     fontSize(BIG_TEXT_FONT_SIZE)
+    if location:
+        fontVariations(**location)
     # Adjust this line to center main text manually.
     # TODO: This should be done automatically when drawbot-skia
     # has support for textBox() and FormattedString
@@ -106,7 +118,7 @@ def draw_divider_lines():
 
 
 # Draw text describing the font and it's git status & repo URL
-def draw_auxiliary_text():
+def draw_auxiliary_text(info):
     # Setup
     font(AUXILIARY_FONT)
     fontSize(AUXILIARY_FONT_SIZE)
@@ -114,22 +126,110 @@ def draw_auxiliary_text():
     POS_TOP_RIGHT = (WIDTH - MARGIN, HEIGHT - MARGIN * 1.5)
     POS_BOTTOM_LEFT = (MARGIN, MARGIN)
     POS_BOTTOM_RIGHT = (WIDTH - MARGIN * 0.95, MARGIN)
-    URL_AND_HASH = MY_URL + "at commit " + MY_HASH
+    URL_AND_HASH = info["url"] + "at commit " + info["hash"]
     URL_AND_HASH = URL_AND_HASH.replace("\n", " ")
     # Draw Text
-    text(FONT_NAME, POS_TOP_LEFT, align="left")
-    text(FONT_VERSION, POS_TOP_RIGHT, align="right")
+    text(info["name"], POS_TOP_LEFT, align="left")
+    text(info["version"], POS_TOP_RIGHT, align="right")
     text(URL_AND_HASH, POS_BOTTOM_LEFT, align="left")
     text(FONT_LICENSE, POS_BOTTOM_RIGHT, align="right")
 
 
-# Build and save the image
-if __name__ == "__main__":
+# Draw one frame and save it as a PNG. This runs in a worker process,
+# one frame per call, so it gets everything it needs as arguments.
+# The PNG is moved into place once it is complete, so an interrupted run
+# never leaves half a frame in the cache.
+def render_frame(frame_path, location, info):
+    newDrawing()
     draw_background()
-    draw_main_text()
+    draw_main_text(location)
     draw_divider_lines()
-    draw_auxiliary_text()
+    draw_auxiliary_text(info)
+    saveImage(frame_path + ".tmp.png")
+    endDrawing()
+    os.replace(frame_path + ".tmp.png", frame_path)
+    return frame_path
+
+
+# Name a frame after everything that is drawn in it: the font file, this
+# script (its settings and drawing code), the texts and the axis location.
+# If none of those changed, the frame already in CACHE_DIR is reused.
+def frame_path(font_hash, script_hash, location, info):
+    key = json.dumps([font_hash, script_hash, BIG_TEXT, info, location], sort_keys=True)
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Save the frames: one PNG for a single frame, an animated GIF for a
+# .gif output, or else numbered PNGs named like drawbot-skia names pages
+# (image1_0.png, image1_1.png...)
+def save_frames(paths, output):
+    if len(paths) == 1:
+        shutil.copyfile(paths[0], output)
+    elif output.lower().endswith(".gif"):
+        images = [Image.open(path) for path in paths]
+        images[0].save(
+            output,
+            save_all=True,
+            append_images=images[1:],
+            duration=round(FRAME_DURATION * 1000),
+            loop=0,
+        )
+    else:
+        stem, ext = os.path.splitext(output)
+        for index, path in enumerate(paths):
+            shutil.copyfile(path, f"{stem}_{index}{ext}")
+
+
+# Build and save the image
+if __name__ == "__main__":
+    # Handel the "--output" flag
+    # For example: $ python3 documentation/image1.py --output documentation/image1.png
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", metavar="PNG", help="where to write the PNG file, or the GIF for an animation")
+    parser.add_argument("--frames", type=int, default=FRAMES, help="number of frames to render")
+    parser.add_argument("--axis", action="append", default=[], metavar="TAG=MIN:MAX", help="axis to sweep across the frames, can be repeated")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes, defaults to the number of cpus")
+    args = parser.parse_args()
+    if args.frames < 1:
+        parser.error("--frames must be at least 1")
+
+    # Load the font with the parts of fonttools that are imported with the line:
+    # from fontTools.ttLib import TTFont
+    # Docs Link: https://fonttools.readthedocs.io/en/latest/ttLib/ttFont.html
+    ttFont = TTFont(FONT_PATH)
+
+    # Things that are worked out dynamically, once for all the frames
+    info = {
+        "url": subprocess.check_output("git remote get-url origin", shell=True).decode(),
+        "hash": subprocess.check_output("git rev-parse --short HEAD", shell=True).decode(),
+        "name": ttFont["name"].getDebugName(4),
+        "version": "v%s" % floatToFixedToStr(ttFont["head"].fontRevision, 16),
+    }
+
+    # Work out where each frame is in the designspace
+    axes = {}
+    for axis in args.axis:
+        tag, values = axis.split("=")
+        axisMin, axisMax = values.split(":")
+        axes[tag] = (float(axisMin), float(axisMax))
+    locations = frame_locations(axes, args.frames)
+
+    # Render the frames which are not in the cache yet, in parallel
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    font_hash = file_hash(FONT_PATH)
+    script_hash = file_hash(__file__)
+    paths = [frame_path(font_hash, script_hash, location, info) for location in locations]
+    todo = {path: location for path, location in zip(paths, locations) if not os.path.exists(path)}
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        list(pool.map(render_frame, todo.keys(), todo.values(), [info] * len(todo)))
+    print(f"DrawBot: Rendered {len(todo)} frames, {len(set(paths)) - len(todo)} were cached")
+
     # Save output, using the "--output" flag location
-    saveImage(args.output)
+    save_frames(paths, args.output)
     # Print done in the terminal
     print("DrawBot: Done")
@@ -2,44 +2,142 @@
 # Yes, this is a Bad YAML Parser, but at this stage we are not in the
 # venv and do not know what modules the user has available, so for
 # maximum compatibility, we are just assuming a plain Python distribution.
+#
+# --make writes the config values as a Makefile include, and --deps
+# writes a .d file of every ufo file the build reads, so make knows when
+# a .glif changed without running any Python. Each ufo gets a stamp in
+# .cache/deps depending on its files, as make is slow with thousands of
+# prerequisites on one target. The stamps also depend on the ufo and
+# layer directories, which change when a glyph is added, removed or
+# renamed, and so does the .d file, so make writes it again then.
 import argparse
+import os
+import plistlib
 import re
 import sys
-import os
+import xml.etree.ElementTree as ET
+
+# Files of a ufo the build reads, besides its layers
+UFO_FILES = [
+	"metainfo.plist",
+	"fontinfo.plist",
+	"groups.plist",
+	"kerning.plist",
+	"lib.plist",
+	"features.fea",
+	"layercontents.plist",
+]
+
+STAMP_DIR = os.path.join(".cache", "deps")
 
 parser = argparse.ArgumentParser()
 group = parser.add_mutually_exclusive_group(required=True)
 group.add_argument('--sources',action='store_true')
 group.add_argument('--family',action='store_true')
+group.add_argument('--make',metavar='PATH',help='write the family and sources as a Makefile include')
+group.add_argument('--deps',metavar='PATH',help='write the ufo files the build depends on as a .d file')
 args = parser.parse_args()
 
 with open(os.path.join("sources", "config.yaml")) as config:
 	data = config.read()
 
-if args.family:
+
+def read_family():
 	m = re.search(r"(?m)^familyName: (.*)", data)
 	if m:
-		print(m[1])
-		sys.exit(0)
-	else:
-		print("Could not determine family name from config file!")
-		sys.exit(1)
+		return m[1]
+	print("Could not determine family name from config file!")
+	sys.exit(1)
 
-toggle = False
-sources = []
-for line in data.splitlines():
-	if re.match("^sources:", line):
-		toggle = True
-		continue
-	if toggle:
-		m = re.match(r"^\s+-\s*(.*)", line)
-		if m:
-			sources.append("sources/"+m[1])
-		else:
-			toggle = False
-if sources:
-	print(" ".join(sources))
-	sys.exit(0)
-else:
+
+def read_sources():
+	toggle = False
+	sources = []
+	for line in data.splitlines():
+		if re.match("^sources:", line):
+			toggle = True
+			continue
+		if toggle:
+			m = re.match(r"^\s+-\s*(.*)", line)
+			if m:
+				sources.append("sources/"+m[1])
+			else:
+				toggle = False
+	if sources:
+		return sources
 	print("Could not determine sources from config file!")
 	sys.exit(1)
+
+
+def escape(path):
+	"""Escape a path for a make rule"""
+	if re.search(r"[:;%*?\[\]\\\n]", path):
+		print(f"Can not write {path} in a make rule!")
+		sys.exit(1)
+	return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def ufo_layers(designspace):
+	"""Get {ufo path: set of layer names} of a designspace's sources,
+	None being the default layer"""
+	root = ET.parse(designspace).getroot()
+	res = {}
+	for source in root.iter("source"):
+		path = os.path.normpath(os.path.join(os.path.dirname(designspace), source.get("filename")))
+		res.setdefault(path, set()).add(source.get("layer"))
+	return res
+
+
+def layer_files(ufo, layer):
+	"""Get the directory and files of a ufo layer"""
+	with open(os.path.join(ufo, "layercontents.plist"), "rb") as f:
+		layers = plistlib.load(f)
+	name = layer or layers[0][0]
+	directory = os.path.join(ufo, dict(layers)[name])
+	with open(os.path.join(directory, "contents.plist"), "rb") as f:
+		glifs = plistlib.load(f)
+	files = ["contents.plist", "layerinfo.plist"] + sorted(glifs.values())
+	return directory, [os.path.join(directory, fn) for fn in files if os.path.exists(os.path.join(directory, fn))]
+
+
+def write(path, text):
+	os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+	with open(path + ".tmp", "w") as f:
+		f.write(text)
+	os.replace(path + ".tmp", path)
+
+
+header = "# Written by scripts/read-config.py from sources/config.yaml, do not edit\n"
+
+if args.family:
+	print(read_family())
+elif args.sources:
+	print(" ".join(read_sources()))
+elif args.make:
+	write(args.make, header + f"FAMILY := {read_family()}\nSOURCES := {' '.join(map(escape, read_sources()))}\n")
+else:
+	ufos = {}
+	for source in read_sources():
+		if source.endswith(".designspace"):
+			ufos.update(ufo_layers(source))
+	rules, stamps, dirs = [], [], set()
+	count = 0
+	for ufo, layers in ufos.items():
+		files = [os.path.join(ufo, fn) for fn in UFO_FILES if os.path.exists(os.path.join(ufo, fn))]
+		ufo_dirs = [ufo]
+		for layer in sorted(layers, key=str):
+			directory, glifs = layer_files(ufo, layer)
+			ufo_dirs.append(directory)
+			files += glifs
+		stamp = os.path.join(STAMP_DIR, re.sub(r"[^A-Za-z0-9._-]", "_", os.path.relpath(ufo, "sources")) + ".stamp")
+		stamps.append(stamp)
+		rules.append(f"{stamp}:" + "".join(f" \\\n {escape(f)}" for f in ufo_dirs + files) + "\n\n")
+		dirs.update(ufo_dirs + [os.path.dirname(ufo)])
+		count += len(files)
+	lines = [header]
+	lines.append(f"DESIGNSPACE_DEPS := {' '.join(escape(d) for d in sorted({os.path.dirname(u) for u in ufos}))}\n")
+	lines.append(f"UFO_STAMPS := {' '.join(stamps)}\n\n")
+	lines += rules
+	lines.append(f"{args.deps}:" + "".join(f" \\\n {escape(d)}" for d in sorted(dirs)) + "\n")
+	write(args.deps, "".join(lines))
+	print(f"Wrote {args.deps}: {count} files of {len(ufos)} ufos")
@@ -2,9 +2,13 @@
 build designspace
 """
 from fontTools.designspaceLib import DesignSpaceDocument, SourceDescriptor, InstanceDescriptor, AxisDescriptor, RuleDescriptor
-from defcon import Font
-import shutil
-from distutils.dir_util import copy_tree
+from fontTools.fontBuilder import FontBuilder
+from fontTools.varLib.featureVars import addFeatureVariations
+from fontTools.varLib.models import normalizeValue
+from concurrent.futures import ThreadPoolExecutor
+from build_trace import span
+import plistlib
+import json
 import os
 from glob import glob
 
@@ -15,6 +19,8 @@ IGNORE_UFOS = [
 
 SRC_DIR = "1A-drawings"
 
+CACHE_PATH = os.path.join(".cache", "designspace.json")
+
 SRC_SUB_DIRS = [
     "Duovars",
     "Mains",
@@ -54,11 +60,42 @@ def get_ufos(fp):
     """Get ufo paths"""
     ufo_fps = []
     for dir_ in SRC_SUB_DIRS:
-        ufos = glob(os.path.join(SRC_DIR, dir_, "*.ufo"))
+        ufos = sorted(glob(os.path.join(SRC_DIR, dir_, "*.ufo")))
         ufo_fps += ufos
     return ufo_fps
 
 
+def read_ufo_info(ufo_path):
+    """Read the metainfo.plist and fontinfo.plist of a ufo.
+
+    The glyph set is never touched, so this is cheap even for the
+    Mains which have ~939 glyphs each.
+    """
+    with open(os.path.join(ufo_path, "metainfo.plist"), "rb") as f:
+        meta = plistlib.load(f)
+    with open(os.path.join(ufo_path, "fontinfo.plist"), "rb") as f:
+        info = plistlib.load(f)
+    return {
+        "formatVersion": meta["formatVersion"],
+        "familyName": info.get("familyName"),
+        "unitsPerEm": info.get("unitsPerEm"),
+    }
+
+
+def scan_ufos(fp, workers=None):
+    """Get ufo paths and their info, without loading any glyphs.
+
+    The SRC_SUB_DIRS globs and plist reads run in a thread pool. Paths
+    keep the same order as get_ufos, sorted within each directory, so the
+    designspace is the same whatever order the file system lists them in.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        globs = pool.map(lambda d: sorted(glob(os.path.join(fp, d, "*.ufo"))), SRC_SUB_DIRS)
+        ufo_fps = [ufo for ufos in globs for ufo in ufos]
+        infos = pool.map(read_ufo_info, ufo_fps)
+        return dict(zip(ufo_fps, infos))
+
+
 def parse_axis_vals(filename):
     """Extract axis values from a ufo filename.
     
@@ -144,18 +181,194 @@ def build_designspace(ufo_paths):
         }
         r2 = RuleDescriptor(**wdth_rule)
         doc.addRule(r2)
+    doc.rules = merge_rules(doc.rules)
     return doc
 
 
+def condition_box(condition_set):
+    """[{name, minimum, maximum}, ...] --> ((name, minimum, maximum), ...)"""
+    return tuple(sorted(
+        (c["name"], c.get("minimum"), c.get("maximum")) for c in condition_set
+    ))
+
+
+def box_contains(outer, inner):
+    """Whether every location in the inner box is in the outer one"""
+    inner = {name: (lo, hi) for name, lo, hi in inner}
+    for name, lo, hi in outer:
+        if name not in inner:
+            return False
+        in_lo, in_hi = inner[name]
+        if lo is not None and (in_lo is None or in_lo < lo):
+            return False
+        if hi is not None and (in_hi is None or in_hi > hi):
+            return False
+    return True
+
+
+def minimal_boxes(boxes):
+    """Drop duplicate boxes and boxes inside another one"""
+    boxes = sorted(set(boxes))
+    return tuple(
+        box for box in boxes
+        if not any(other != box and box_contains(other, box) for other in boxes)
+    )
+
+
+def merge_rules(rules):
+    """Merge rules into as few rules and condition boxes as possible.
+
+    Rules with the same region are merged into one with all their subs,
+    then rules with the same subs into one covering all their regions, so
+    varLib has fewer regions to overlay into FeatureVariations records.
+    """
+    regions = {}
+    for rule in rules:
+        region = minimal_boxes(condition_box(cs) for cs in rule.conditionSets)
+        subs = regions.setdefault(region, {})
+        for glyph, replacement in rule.subs:
+            if subs.setdefault(glyph, replacement) != replacement:
+                raise ValueError(f"{glyph} is substituted by both {subs[glyph]} and {replacement}")
+    by_subs = {}
+    for region, subs in regions.items():
+        by_subs.setdefault(tuple(subs.items()), []).extend(region)
+    merged = []
+    for subs, boxes in by_subs.items():
+        condition_sets = [
+            [{"name": name, "minimum": lo, "maximum": hi} for name, lo, hi in box]
+            for box in minimal_boxes(boxes)
+        ]
+        merged.append(RuleDescriptor(conditionSets=condition_sets, subs=list(subs)))
+    return merged
+
+
+def compile_rules(ds):
+    """Compile the rules into the GSUB of a stub font, returning the
+    number of FeatureVariations records and the GSUB size in bytes"""
+    axes = {a.name: a for a in ds.axes}
+    glyphs = {".notdef"}
+    regions = []
+    for rule in ds.rules:
+        region = []
+        for cs in rule.conditionSets:
+            box = {}
+            for c in cs:
+                axis = axes[c["name"]]
+                triple = [axis.map_forward(v) for v in (axis.minimum, axis.default, axis.maximum)]
+                lo = triple[0] if c.get("minimum") is None else c["minimum"]
+                hi = triple[2] if c.get("maximum") is None else c["maximum"]
+                box[axis.tag] = (normalizeValue(lo, triple), normalizeValue(hi, triple))
+            region.append(box)
+        regions.append((region, dict(rule.subs)))
+        glyphs.update(g for sub in rule.subs for g in sub)
+
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder(sorted(glyphs))
+    fb.setupNameTable({})
+    fb.setupFvar([(a.tag, a.minimum, a.default, a.maximum, a.name) for a in ds.axes], [])
+    addFeatureVariations(fb.font, regions)
+    gsub = fb.font["GSUB"].table
+    return gsub.FeatureVariations.FeatureVariationCount, len(fb.font.getTableData("GSUB"))
+
+
+def fingerprint(ds, ufo_paths):
+    """Everything the designspace is derived from, as plain json data"""
+    return {
+        "document": {
+            "formatVersion": ds.formatVersion,
+            "rulesProcessingLast": ds.rulesProcessingLast,
+            "familyNames": sorted({s.familyName for s in ds.sources}),
+        },
+        "axes": [
+            {"tag": a.tag, "name": a.name, "minimum": a.minimum, "default": a.default,
+             "maximum": a.maximum, "map": [list(m) for m in a.map], "hidden": a.hidden}
+            for a in ds.axes
+        ],
+        "ufos": list(ufo_paths),
+        "locations": {s.filename: s.location for s in ds.sources},
+        "ignore": list(IGNORE_UFOS),
+        "rules": [
+            {"conditionSets": r.conditionSets, "subs": [list(s) for s in r.subs]}
+            for r in ds.rules
+        ],
+    }
+
+
+def load_fingerprint(path=CACHE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as doc:
+        return json.load(doc)
+
+
+def save_fingerprint(fp, path=CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as doc:
+        json.dump(fp, doc, indent=2)
+
+
+def diff_sources(old, new):
+    """Report which sources were added, removed or moved.
+
+    A source has moved if its ufo changed directory or its parsed
+    location changed.
+    """
+    old_locs = {os.path.basename(k): (k, v) for k, v in old["locations"].items()}
+    new_locs = {os.path.basename(k): (k, v) for k, v in new["locations"].items()}
+    for name in sorted(new_locs.keys() - old_locs.keys()):
+        print(f"Added {new_locs[name][0]}")
+    for name in sorted(old_locs.keys() - new_locs.keys()):
+        print(f"Removed {old_locs[name][0]}")
+    for name in sorted(old_locs.keys() & new_locs.keys()):
+        (old_fp, old_loc), (new_fp, new_loc) = old_locs[name], new_locs[name]
+        if old_fp != new_fp:
+            print(f"Moved {old_fp} -> {new_fp}")
+        elif old_loc != new_loc:
+            print(f"Moved {new_fp} in the designspace")
+    if old.get("document") != new["document"]:
+        print("Document attributes changed")
+    if old.get("axes") != new["axes"]:
+        print("Axes changed")
+    if old["ignore"] != new["ignore"]:
+        print(f"IGNORE_UFOS changed: {old['ignore']} -> {new['ignore']}")
+    if old["rules"] != new["rules"]:
+        print("Rules changed")
+
+
 def main():
     # write designspace
-    ufo_paths = get_ufos(SRC_DIR)
+    with span("scan ufos"):
+        ufos = scan_ufos(SRC_DIR)
+    ufo_paths = list(ufos)
     assert len(ufo_paths) == 72, "There should be 72 ufos!"
-    ds = build_designspace(ufo_paths)
+    upms = {info["unitsPerEm"] for info in ufos.values()}
+    assert len(upms) == 1, f"Sources disagree on unitsPerEm: {upms}"
+    with span("build designspace"):
+        ds = build_designspace(ufo_paths)
     ds_path = "RobotoFlex.designspace"
+
+    # Only touch the designspace if what it would be written as differs
+    # from the file, so the Makefile does not rebuild the fonts on no-op
+    # edits. The fingerprint only reports what changed.
+    new_fp = fingerprint(ds, ufo_paths)
+    old_fp = load_fingerprint()
+    unchanged = False
+    if os.path.exists(ds_path):
+        with open(ds_path, "rb") as doc:
+            unchanged = doc.read() == ds.tostring(encoding="utf-8")
+    if unchanged:
+        save_fingerprint(new_fp)
+        print(f"{ds_path} is up to date")
+        return
+    if old_fp is not None:
+        diff_sources(old_fp, new_fp)
+    with span("compile rules"):
+        records, size = compile_rules(ds)
+    print(f"{len(ds.rules)} rules, {records} FeatureVariations records, GSUB {size} bytes")
     ds.write(ds_path)
+    save_fingerprint(new_fp)
     print(f"Saving {ds_path}")
-    
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
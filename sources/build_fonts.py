@@ -0,0 +1,231 @@
+"""
+build the fonts with the variable font masters compiled in parallel
+
+Wraps `gftools builder`. The only step of compiling the masters that
+needs all of them at once is the compatible cubic to quadratic
+conversion, so the variable font is built in three stages:
+
+1. cu2qu runs over chunks of glyphs, each chunk reading that glyph from
+   every master. All interpolation errors are collected in one pass.
+2. Each master is compiled to a TTF (outlines, metrics, features) in its
+   own process, using the converted glyphs and the kerning of every
+   master compiled together by compile_kerning.py.
+3. The master TTFs are merged with varLib, like fontmake does, and
+   optimize_variations.py drops the tuples varLib keeps without deltas.
+
+Everything else (STAT, fixes, static fonts) is left to gftools. Each
+step, and each gftools step, is a span in the build trace of
+build_trace.py.
+
+Usage:
+    python3 sources/build_fonts.py sources/config.yaml
+"""
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools.ttLib import TTFont
+from fontTools.ufoLib import UFOReader
+from fontTools import varLib
+from concurrent.futures import ProcessPoolExecutor
+from cu2qu.ufo import glyphs_to_quadratic, DEFAULT_MAX_ERR
+from cu2qu.errors import IncompatibleGlyphsError
+from gftools.builder import GFBuilder
+from build_designspace import read_ufo_info
+from build_trace import span, traced
+from compile_kerning import compile_kerning
+from glyph_hashes import glif_paths
+from optimize_variations import optimize_font
+from source_cache import read_font_data
+from ufo2ft.filters.flattenComponents import FlattenComponentsFilter
+from ufo2ft.filters.decomposeTransformedComponents import DecomposeTransformedComponentsFilter
+from ufo2ft.postProcessor import PostProcessor
+import argparse
+import os
+import tempfile
+import time
+import ufo2ft
+import ufoLib2
+
+
+def read_glyph(glyph_set, name):
+    glyph = ufoLib2.objects.Glyph(name)
+    glyph_set.readGlyph(name, glyph, glyph.getPointPen(), validate=False)
+    return glyph
+
+
+def convert_glyphs(ufo_paths, glyph_names, max_errs):
+    """Convert a chunk of glyphs to quadratic, compatibly across masters.
+
+    Returns a {glyph name: glyph} dict per master and the list of
+    interpolation errors found.
+    """
+    glyph_sets = [UFOReader(p, validate=False).getGlyphSet(validateRead=False) for p in ufo_paths]
+    converted = [{} for _ in ufo_paths]
+    errors = []
+    with span("convert chunk", glyphs=len(glyph_names)):
+        for name in glyph_names:
+            masters = [i for i, gs in enumerate(glyph_sets) if name in gs]
+            glyphs = [read_glyph(glyph_sets[i], name) for i in masters]
+            try:
+                glyphs_to_quadratic(
+                    glyphs, max_err=[max_errs[i] for i in masters], reverse_direction=True
+                )
+            except IncompatibleGlyphsError as e:
+                errors.append(str(e))
+                continue
+            for i, glyph in zip(masters, glyphs):
+                converted[i][name] = glyph
+    return converted, errors
+
+
+def read_kerning(ufo_path):
+    font = read_font_data(ufo_path)
+    return {"groups": font["groups"], "kerning": {(l, r): v for l, r, v in font["kerning"]}}
+
+
+def compile_master(ufo_path, glyphs, ttf_path, notdef, filters=None, kerning=None):
+    """Compile a master with its already quadratic glyphs to ttf_path,
+    replacing its groups and kerning with kerning's if given"""
+    start = time.time()
+    with span("compile master", master=os.path.basename(ufo_path)):
+        ufo = ufoLib2.Font.open(ufo_path, lazy=True)
+        layer = ufo.layers.defaultLayer
+        for name, glyph in glyphs.items():
+            layer.insertGlyph(glyph, name=name, overwrite=True, copy=False)
+        if kerning is not None:
+            ufo.groups.clear()
+            ufo.groups.update(kerning["groups"])
+            ufo.kerning.clear()
+            ufo.kerning.update(kerning["kerning"])
+        ttf = ufo2ft.compileTTF(
+            ufo,
+            convertCubics=False,
+            useProductionNames=False,
+            postProcessorClass=None,
+            notdefGlyph=notdef,
+            filters=filters,
+            inplace=True,
+        )
+        ttf.save(ttf_path)
+    return time.time() - start
+
+
+def chunks(items, count):
+    size = -(-len(items) // count)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def build_variable_font(ds_path, output_path, jobs=None, filters=None):
+    """Build the variable font for a designspace, one process per master"""
+    with span("read designspace"):
+        ds = DesignSpaceDocument.fromfile(ds_path)
+        ufo_paths = [s.path for s in ds.sources]
+        jobs = jobs or os.cpu_count()
+        default = ds.findDefault()
+
+        glyph_names = list(glif_paths(default.path))
+        for path in ufo_paths:
+            seen = set(glyph_names)
+            glyph_names += [g for g in glif_paths(path) if g not in seen]
+        upms = [read_ufo_info(p)["unitsPerEm"] or 1000 for p in ufo_paths]
+        default_reader = UFOReader(default.path, validate=False).getGlyphSet(validateRead=False)
+        notdef = read_glyph(default_reader, ".notdef") if ".notdef" in default_reader else None
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        start = time.time()
+        with span("convert to quadratic", glyphs=len(glyph_names)):
+            converted = [{} for _ in ufo_paths]
+            errors = []
+            max_errs = [DEFAULT_MAX_ERR * upm for upm in upms]
+            futures = [
+                pool.submit(convert_glyphs, ufo_paths, chunk, max_errs)
+                for chunk in chunks(glyph_names, jobs * 4)
+            ]
+            for future in futures:
+                chunk, chunk_errors = future.result()
+                for master, glyphs in zip(converted, chunk):
+                    master.update(glyphs)
+                errors += chunk_errors
+        if errors:
+            raise ValueError("Incompatible masters:\n" + "\n".join(errors))
+        print(f"Converted {len(glyph_names)} glyphs to quadratic in {time.time() - start:.1f}s")
+
+        with span("compile kerning"):
+            kerning, summary = compile_kerning(list(pool.map(read_kerning, ufo_paths)))
+        print(f"Compiled kerning: {summary}")
+
+        start = time.time()
+        with tempfile.TemporaryDirectory() as tmp:
+            ttf_paths = [os.path.join(tmp, f"master{i}.ttf") for i in range(len(ufo_paths))]
+            with span("compile masters", masters=len(ufo_paths)):
+                timings = list(pool.map(
+                    compile_master,
+                    ufo_paths,
+                    converted,
+                    ttf_paths,
+                    [notdef] * len(ufo_paths),
+                    [filters] * len(ufo_paths),
+                    kerning,
+                ))
+            for source, seconds in sorted(zip(ds.sources, timings), key=lambda t: -t[1]):
+                print(f"{seconds:6.1f}s  {source.filename}")
+            print(f"Compiled {len(ufo_paths)} masters in {time.time() - start:.1f}s")
+
+            start = time.time()
+            with span("merge masters"):
+                for source, ttf_path in zip(ds.sources, ttf_paths):
+                    source.font = TTFont(ttf_path)
+                vf, _, _ = varLib.build(ds)
+            with span("post process"):
+                vf = PostProcessor(vf, ufoLib2.Font.open(default.path, lazy=True)).process()
+            with span("optimize variations"):
+                print(f"Optimized variations: {optimize_font(vf)}")
+            with span("save variable font"):
+                vf.save(output_path)
+    print(f"Merged variable font in {time.time() - start:.1f}s")
+    return output_path
+
+
+class ParallelBuilder(GFBuilder):
+    """GFBuilder which builds variable fonts from designspaces itself"""
+
+    def __init__(self, configfile=None, config=None, jobs=None):
+        self.jobs = jobs
+        super().__init__(configfile=configfile, config=config)
+
+    def run_fontmake(self, source, args):
+        if args.get("output") != ["variable"] or not source.endswith(".designspace"):
+            return super().run_fontmake(source, args)
+        # Same filters as GFBuilder.run_fontmake adds
+        filters = []
+        if self.config["flattenComponents"]:
+            filters.append(FlattenComponentsFilter(pre=True))
+        if self.config["decomposeTransformedComponents"]:
+            filters.append(DecomposeTransformedComponentsFilter(pre=True))
+        return [build_variable_font(source, args["output_path"], self.jobs, filters or None)]
+
+
+# gftools steps recorded in the build trace. post_process_ttf autohints,
+# fixes and compresses the WOFF2 of each static font, move_webfont moves
+# the WOFF2 to the web fonts directory.
+TRACED_STEPS = {
+    "build_variable": "gftools variable fonts",
+    "build_static": "gftools static fonts",
+    "gen_stat": "gftools STAT",
+    "post_process": "gftools post process",
+    "post_process_ttf": "gftools post process ttf",
+    "move_webfont": "gftools move web font",
+}
+
+for method, name in TRACED_STEPS.items():
+    setattr(ParallelBuilder, method, traced(name)(getattr(GFBuilder, method)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gftools builder with parallel master compilation")
+    parser.add_argument("config", help="gftools builder config.yaml")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes, defaults to the number of cpus")
+    args = parser.parse_args()
+    ParallelBuilder(configfile=args.config, jobs=args.jobs).build()
+
+
+if __name__ == "__main__":
+    main()
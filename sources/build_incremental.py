@@ -0,0 +1,293 @@
+"""
+incremental variable font build
+
+Hashes every .glif of every designspace source and compares the hashes
+to the ones recorded by the previous build. Glyphs whose outlines or
+advances changed, plus the composites that use them, are compiled from a
+subset of each master and merged into the existing variable font: their
+glyf, hmtx and gvar entries are replaced and HVAR is rebuilt from the
+per glyph advance deltas already in the font.
+
+Anything else (added or removed glyphs, anchors, kerning, font info, the
+designspace or config) falls back to a full build_fonts.py run. The
+static fonts are only rebuilt by a full build.
+
+Usage:
+    cd sources
+    python3 build_incremental.py             # patch the variable font
+    python3 build_incremental.py --snapshot  # record state after a full build
+"""
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools.ttLib import TTFont
+from fontTools.varLib import build as build_vf
+from fontTools.varLib.builder import buildVarIdxMap
+from fontTools.varLib.varStore import OnlineVarStoreBuilder
+from concurrent.futures import ThreadPoolExecutor
+from build_trace import span
+from glyph_hashes import COMPONENT_RE, read_glifs, hash_bytes, hash_file, hash_font_files
+from optimize_variations import prune_tuples
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+import ufo2ft
+import ufoLib2
+
+
+DS_PATH = "RobotoFlex.designspace"
+
+CONFIG_PATH = "config.yaml"
+
+FONTS_DIR = os.path.join("..", "fonts")
+
+CACHE_PATH = os.path.join(".cache", "incremental.json")
+
+ANCHOR_RE = re.compile(rb"<anchor\s[^>]*>")
+
+
+def scan_ufo(ufo_path):
+    """Hash a ufo's glyphs and font files and collect component bases.
+
+    Each glyph gets a hash of its whole .glif and one of its anchors, since
+    anchor edits change GPOS and can't be patched glyph by glyph.
+    """
+    glyphs, components = {}, {}
+    for name, data in read_glifs(ufo_path):
+        anchors = b"".join(ANCHOR_RE.findall(data))
+        glyphs[name] = [hash_bytes(data), hash_bytes(anchors)]
+        components[name] = {b.decode("utf-8") for b in COMPONENT_RE.findall(data)}
+    return hash_font_files(ufo_path), glyphs, components
+
+
+def scan_sources(ds, workers=None):
+    """Scan all sources, returning their hashes and the component graph"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        scans = list(pool.map(scan_ufo, [s.path for s in ds.sources]))
+    state = {}
+    components = {}
+    for source, (info, glyphs, comps) in zip(ds.sources, scans):
+        state[source.filename] = {"info": info, "glyphs": glyphs}
+        for name, bases in comps.items():
+            components.setdefault(name, set()).update(bases)
+    return state, components
+
+
+def find_font(ds):
+    """Get the path of the variable font built by gftools builder"""
+    filename = "RobotoFlex[%s].ttf" % ",".join(sorted(a.tag for a in ds.axes))
+    for path in (
+        os.path.join(FONTS_DIR, "variable", filename),
+        os.path.join(FONTS_DIR, filename),
+    ):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def dirty_glyphs(old, new):
+    """Get the glyphs whose .glif changed in any master.
+
+    Returns None if the sources changed in a way that can't be patched
+    into the existing font.
+    """
+    if old.keys() != new.keys():
+        return None
+    dirty = set()
+    for filename, src in new.items():
+        prev = old[filename]
+        if prev["info"] != src["info"] or prev["glyphs"].keys() != src["glyphs"].keys():
+            return None
+        for name, (glif, anchors) in src["glyphs"].items():
+            prev_glif, prev_anchors = prev["glyphs"][name]
+            if prev_anchors != anchors:
+                return None
+            if prev_glif != glif:
+                dirty.add(name)
+    return dirty
+
+
+def expand_glyphs(dirty, components):
+    """Add the composites using dirty glyphs, and the bases they all need.
+
+    Composites are recompiled too because ufo2ft decomposes glyphs that mix
+    contours and components, and their bounding boxes change with the base.
+    """
+    users = {}
+    for name, bases in components.items():
+        for base in bases:
+            users.setdefault(base, set()).add(name)
+    affected = set(dirty)
+    todo = list(dirty)
+    while todo:
+        for user in users.get(todo.pop(), ()):
+            if user not in affected:
+                affected.add(user)
+                todo.append(user)
+    needed = set(affected)
+    todo = list(affected)
+    while todo:
+        for base in components.get(todo.pop(), ()):
+            if base not in needed:
+                needed.add(base)
+                todo.append(base)
+    return needed
+
+
+def subset_ufo(ufo_path, glyph_names):
+    """Load a ufo's info and lib plus only the given glyphs"""
+    src = ufoLib2.Font.open(ufo_path, lazy=True)
+    ufo = ufoLib2.Font(info=src.info, lib=src.lib)
+    for name in glyph_names:
+        if name in src:
+            ufo.layers.defaultLayer.insertGlyph(src[name], name=name)
+    return ufo
+
+
+def compile_glyphs(glyph_names, workers=None):
+    """Build a variable font from the designspace with only glyph_names"""
+    ds = DesignSpaceDocument.fromfile(DS_PATH)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ufos = pool.map(lambda s: subset_ufo(s.path, glyph_names), ds.sources)
+        for source, ufo in zip(ds.sources, ufos):
+            source.font = ufo
+    ds = ufo2ft.compileInterpolatableTTFsFromDS(
+        ds, useProductionNames=True, featureWriters=[]
+    )
+    vf, _, _ = build_vf(ds, exclude=["STAT", "MVAR", "GDEF", "GPOS", "GSUB", "cvar"])
+    prune_tuples(vf)
+    return vf
+
+
+def advance_deltas(font):
+    """Map each glyph to its {region: delta} advance width variations"""
+    hvar = font["HVAR"].table
+    store = hvar.VarStore
+    axis_tags = [a.axisTag for a in font["fvar"].axes]
+    regions = []
+    for region in store.VarRegionList.Region:
+        regions.append(tuple(
+            (tag, (ra.StartCoord, ra.PeakCoord, ra.EndCoord))
+            for tag, ra in zip(axis_tags, region.VarRegionAxis)
+            if ra.PeakCoord != 0
+        ))
+    glyph_order = font.getGlyphOrder()
+    if hvar.AdvWidthMap:
+        mapping = hvar.AdvWidthMap.mapping
+    else:
+        mapping = {g: i for i, g in enumerate(glyph_order)}
+    res = {}
+    for glyph in glyph_order:
+        var_idx = mapping[glyph]
+        data = store.VarData[var_idx >> 16]
+        row = data.Item[var_idx & 0xFFFF]
+        res[glyph] = {regions[ri]: d for ri, d in zip(data.VarRegionIndex, row) if d}
+    return res
+
+
+def build_hvar(font, deltas):
+    """Rebuild HVAR from the per glyph advance deltas"""
+    axis_tags = [a.axisTag for a in font["fvar"].axes]
+    glyph_order = font.getGlyphOrder()
+    regions = sorted({r for d in deltas.values() for r in d})
+    builder = OnlineVarStoreBuilder(axis_tags)
+    builder.setSupports([dict(r) for r in regions])
+    var_idxs = {}
+    for glyph in glyph_order:
+        var_idxs[glyph] = builder.storeDeltas([deltas[glyph].get(r, 0) for r in regions])
+    store = builder.finish()
+    var_idx_map = store.optimize()
+    hvar = font["HVAR"].table
+    hvar.VarStore = store
+    hvar.AdvWidthMap = buildVarIdxMap(
+        [var_idx_map[var_idxs[g]] for g in glyph_order], glyph_order
+    )
+
+
+def merge_glyphs(font, vf, glyph_names):
+    """Replace the glyf, hmtx, gvar and HVAR data of glyph_names in font"""
+    deltas = advance_deltas(font)
+    new_deltas = advance_deltas(vf)
+    for name in glyph_names:
+        font["glyf"][name] = vf["glyf"][name]
+        font["hmtx"][name] = vf["hmtx"][name]
+        font["gvar"].variations[name] = vf["gvar"].variations.get(name, [])
+        deltas[name] = new_deltas[name]
+    build_hvar(font, deltas)
+
+
+def full_build():
+    """Same as the Makefile's build.stamp recipe"""
+    shutil.rmtree(FONTS_DIR, ignore_errors=True)
+    subprocess.run([sys.executable, "build_fonts.py", CONFIG_PATH], check=True)
+
+
+def load_cache(path=CACHE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path) as doc:
+        return json.load(doc)
+
+
+def save_cache(cache, path=CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as doc:
+        json.dump(cache, doc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild only the changed glyphs of the variable font")
+    parser.add_argument("--snapshot", action="store_true", help="record the sources and font of a full build")
+    parser.add_argument("--font", help="variable font to patch, defaults to the one in fonts/")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker threads")
+    args = parser.parse_args()
+
+    start = time.time()
+    ds = DesignSpaceDocument.fromfile(DS_PATH)
+    with span("scan sources"):
+        state, components = scan_sources(ds, args.workers)
+    build = {"designspace": hash_file(DS_PATH), "config": hash_file(CONFIG_PATH)}
+    font_path = args.font or find_font(ds)
+    cache = load_cache()
+
+    dirty = None
+    if args.snapshot:
+        dirty = set()
+        print(f"Recording {font_path}")
+    elif cache and font_path and cache["build"] == build and cache["font"] == hash_file(font_path):
+        dirty = dirty_glyphs(cache["sources"], state)
+
+    if dirty:
+        glyph_names = expand_glyphs(dirty, components)
+        print(f"Rebuilding {len(dirty)} changed glyphs ({len(glyph_names)} with dependencies): {' '.join(sorted(dirty))}")
+        with span("compile changed glyphs", glyphs=len(glyph_names)):
+            vf = compile_glyphs(glyph_names, args.workers)
+        merged = [g for g in vf.getGlyphOrder() if g != ".notdef" or ".notdef" in glyph_names]
+        font = TTFont(font_path)
+        missing = set(merged) - set(font.getGlyphOrder())
+        if missing:
+            print(f"Glyphs missing from {font_path}: {' '.join(sorted(missing))}")
+            dirty = None
+        else:
+            with span("merge changed glyphs"):
+                merge_glyphs(font, vf, merged)
+                font.save(font_path + ".tmp")
+                os.replace(font_path + ".tmp", font_path)
+            print(f"Saving {font_path}")
+    elif dirty is not None and not args.snapshot:
+        print(f"{font_path} is up to date")
+
+    if dirty is None:
+        print("Sources changed beyond glyph outlines, running a full build")
+        full_build()
+        font_path = args.font or find_font(ds)
+
+    save_cache({"build": build, "font": hash_file(font_path), "sources": state})
+    print(f"Done in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+trace where the build spends time and memory
+
+Every Makefile stage runs through `build_trace.py stage`, and our own
+Python stages mark their steps with span(). Each records its wall time,
+CPU time and peak RSS as a Chrome trace event, appended to the file
+BUILD_TRACE names, which the Makefile sets once per make run. Worker
+processes inherit it, so per master steps show up as their own rows.
+After each stage the run is written to out/trace/<run>.json, which
+chrome://tracing or https://ui.perfetto.dev open, and the stage is
+compared to the last run which had it.
+
+A stage's CPU time and peak RSS are those of the command and every
+process it waited for, the peak being the largest single process. A
+span's peak RSS is that of its process so far.
+
+Only the standard library is used, as the Makefile runs it outside of
+the venv, and nothing is recorded when BUILD_TRACE isn't set.
+
+Usage:
+    python3 sources/build_trace.py stage fontbakery -- fontbakery check-googlefonts fonts/variable/*.ttf
+    python3 sources/build_trace.py stage check-sources -C sources -- python3 check_compatibility.py
+    python3 sources/build_trace.py summary
+"""
+from contextlib import contextmanager
+import argparse
+import functools
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+
+EVENTS_DIR = os.path.join(".cache", "trace")
+
+TRACE_DIR = os.path.join("out", "trace")
+
+KEEP_RUNS = 20
+
+_named_processes = set()
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Peak resident memory in MB, ru_maxrss being in KB on Linux and in
+    bytes on macOS"""
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def cpu_time(who=resource.RUSAGE_SELF):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def write_events(events, path=None):
+    """Append events to the trace of this run, if there is one"""
+    path = path or os.environ.get("BUILD_TRACE")
+    if not path:
+        return
+    pid = os.getpid()
+    if pid not in _named_processes:
+        _named_processes.add(pid)
+        name = os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else "python"
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"{name} ({pid})"}}] + events
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write("".join(json.dumps(e) + "\n" for e in events))
+
+
+def event(name, category, start, wall, cpu, rss, **args):
+    return {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": round(start * 1e6),
+        "dur": round(wall * 1e6),
+        "pid": os.getpid(),
+        "tid": 0,
+        "args": dict(args, wall_s=round(wall, 3), cpu_s=round(cpu, 3), peak_rss_mb=round(rss, 1)),
+    }
+
+
+@contextmanager
+def span(name, **args):
+    """Record the time and memory a block of code takes"""
+    if not os.environ.get("BUILD_TRACE"):
+        yield
+        return
+    start, start_cpu = time.time(), cpu_time()
+    try:
+        yield
+    finally:
+        write_events([event(
+            name, "step", start, time.time() - start, cpu_time() - start_cpu, peak_rss(), **args
+        )])
+
+
+def traced(name):
+    """Decorator form of span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_paths(events_dir=EVENTS_DIR):
+    return sorted(glob.glob(os.path.join(events_dir, "*.jsonl")))
+
+
+def totals(events, category=None):
+    """Get {name: [count, wall, cpu, peak rss]} of the events of a run"""
+    res = {}
+    for e in events:
+        if e["ph"] != "X" or (category and e["cat"] != category):
+            continue
+        total = res.setdefault(e["name"], [0, 0, 0, 0])
+        total[0] += 1
+        total[1] += e["args"]["wall_s"]
+        total[2] += e["args"]["cpu_s"]
+        total[3] = max(total[3], e["args"]["peak_rss_mb"])
+    return res
+
+
+def previous_totals(path, stages):
+    """Get the totals of the last run before path which had any of the
+    stages"""
+    runs = run_paths(os.path.dirname(path))
+    earlier = runs[:runs.index(path)] if path in runs else runs
+    for run in reversed(earlier):
+        res = totals(read_events(run))
+        if any(name in res for name in stages):
+            return os.path.basename(run), res
+    return None, {}
+
+
+def format_change(new, old):
+    if not old:
+        return ""
+    return f" ({new / old - 1:+.0%})"
+
+
+def write_chrome_trace(path):
+    run = os.path.splitext(os.path.basename(path))[0]
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    out_path = os.path.join(TRACE_DIR, run + ".json")
+    with open(out_path + ".tmp", "w") as doc:
+        json.dump({"traceEvents": read_events(path), "displayTimeUnit": "ms"}, doc)
+    os.replace(out_path + ".tmp", out_path)
+    return out_path
+
+
+def prune_runs(events_dir, keep=KEEP_RUNS):
+    for path in run_paths(events_dir)[:-keep]:
+        os.remove(path)
+        trace = os.path.join(TRACE_DIR, os.path.splitext(os.path.basename(path))[0] + ".json")
+        if os.path.exists(trace):
+            os.remove(trace)
+
+
+def run_stage(name, command, cwd=None):
+    """Run a stage's command, recording it in the trace. Returns the
+    command's exit status."""
+    path = os.environ.get("BUILD_TRACE")
+    start, start_cpu = time.time(), cpu_time(resource.RUSAGE_CHILDREN)
+    status = subprocess.call(command, cwd=cwd)
+    wall = time.time() - start
+    cpu = cpu_time(resource.RUSAGE_CHILDREN) - start_cpu
+    rss = peak_rss(resource.RUSAGE_CHILDREN)
+    if not path:
+        return status
+    write_events([event(name, "stage", start, wall, cpu, rss, command=" ".join(command), status=status)], path)
+    write_chrome_trace(path)
+    prune_runs(os.path.dirname(path))
+
+    run, previous = previous_totals(path, [name])
+    line = f"[trace] {name}: {wall:.1f}s wall, {cpu:.1f}s cpu, {rss:.0f} MB peak"
+    if name in previous:
+        _, old_wall, old_cpu, old_rss = previous[name]
+        line += f", previously {old_wall:.1f}s{format_change(wall, old_wall)} and {old_rss:.0f} MB in {run}"
+    print(line, file=sys.stderr)
+    return status
+
+
+def print_summary(path):
+    """Print the stages and steps of a run, compared to the run before"""
+    events = read_events(path)
+    run, previous = previous_totals(path, totals(events, "stage"))
+    print(f"{os.path.basename(path)} compared to {run or 'nothing'}")
+    for category in ("stage", "step"):
+        print(f"{category.capitalize()}s:")
+        for name, (count, wall, cpu, rss) in sorted(totals(events, category).items(), key=lambda t: -t[1][1]):
+            old = previous.get(name)
+            change = f"  was {old[1]:.1f}s{format_change(wall, old[1])}" if old else ""
+            times = f" x{count}" if count > 1 else ""
+            print(f"    {wall:8.1f}s {cpu:8.1f}s cpu {rss:7.0f} MB  {name}{times}{change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trace the time and memory of the build stages")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stage = subparsers.add_parser("stage", help="run and record a build stage, given after --")
+    stage.add_argument("name", help="name of the stage in the trace")
+    stage.add_argument("-C", "--directory", help="directory to run the command in")
+    summary = subparsers.add_parser("summary", help="compare a run with the run before")
+    summary.add_argument("run", nargs="?", help="events of the run, defaults to the latest in .cache/trace")
+    argv = sys.argv[1:]
+    command = []
+    if "--" in argv:
+        command = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    args = parser.parse_args(argv)
+
+    if args.command == "stage":
+        if not command:
+            parser.error("no command given after --")
+        sys.exit(run_stage(args.name, command, args.directory))
+
+    runs = run_paths()
+    if not args.run and not runs:
+        parser.error("no traced runs in .cache/trace")
+    print_summary(args.run or runs[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+check the designspace sources are interpolation compatible
+
+Reads every glyph of every source build_designspace.py registers and
+compares, against the default master, each glyph's contour count, point
+counts and types, components and anchor names. Each of those is interned
+to an integer, so the comparison is one (glyphs x masters) array per
+property and every mismatch is reported in a single run.
+
+.glif files are parsed with regexes, one process per master, and the
+result is cached by .glif hash. The hashes and each layer's
+contents.plist are cached by file mtime and size, so a warm run only
+stats the files.
+
+Usage:
+    cd sources
+    python3 check_compatibility.py
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from build_designspace import SRC_DIR, scan_ufos, build_designspace
+from glyph_hashes import COMPONENT_RE, glif_paths, hash_glifs
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+
+
+CACHE_PATH = os.path.join(".cache", "compatibility.json")
+
+CONTOUR_RE = re.compile(rb"<contour\b[^>]*?(?:/>|>.*?</contour>)", re.S)
+
+POINT_TYPE_RE = re.compile(rb"<point\s[^>]*?(?:type=\"(\w+)\"[^>]*)?/?>")
+
+ANCHOR_RE = re.compile(rb'<anchor\s[^>]*name="([^"]*)"')
+
+POINT_TYPES = {b"": "o", b"line": "l", b"curve": "c", b"qcurve": "q", b"move": "m"}
+
+PROPERTIES = ["contours", "points", "components", "anchors"]
+
+
+def glyph_signature(data):
+    """Get the properties of a .glif which must match across masters"""
+    contours = [
+        "".join(POINT_TYPES.get(t, "?") for t in POINT_TYPE_RE.findall(c))
+        for c in CONTOUR_RE.findall(data)
+    ]
+    return {
+        "contours": len(contours),
+        "points": " ".join(contours),
+        "components": " ".join(b.decode("utf-8") for b in COMPONENT_RE.findall(data)),
+        "anchors": " ".join(sorted(a.decode("utf-8") for a in ANCHOR_RE.findall(data))),
+    }
+
+
+def read_signatures(ufo_path, glyph_names):
+    """Parse the given glyphs of a ufo, returning {glyph: signature}"""
+    paths = glif_paths(ufo_path)
+    res = {}
+    for name in glyph_names:
+        with open(paths[name], "rb") as f:
+            res[name] = glyph_signature(f.read())
+    return res
+
+
+def load_cache(path=CACHE_PATH):
+    if not os.path.exists(path):
+        return {"ufos": {}, "signatures": {}}
+    with open(path) as doc:
+        return json.load(doc)
+
+
+def save_cache(cache, path=CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as doc:
+        doc.write(json.dumps(cache))
+
+
+def signatures(ufo_paths, workers=None):
+    """Get the glyph signatures and {ufo path: {glyph: sha1}}, parsing
+    only the .glifs whose hash isn't cached"""
+    cache = load_cache()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ufos = dict(zip(ufo_paths, pool.map(
+            lambda p: hash_glifs(p, cache["ufos"].get(p)), ufo_paths
+        )))
+    hashes = {
+        path: {name: rec[2] for name, rec in ufo["glyphs"].items()}
+        for path, ufo in ufos.items()
+    }
+    sigs = cache["signatures"]
+
+    todo = {}
+    for path, glyphs in hashes.items():
+        missing = [name for name, sha in glyphs.items() if sha not in sigs]
+        if missing:
+            todo[path] = missing
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = pool.map(read_signatures, todo.keys(), todo.values())
+            for path, glyph_sigs in zip(todo, parsed):
+                for name, sig in glyph_sigs.items():
+                    sigs[hashes[path][name]] = sig
+
+    used = {sha for glyphs in hashes.values() for sha in glyphs.values()}
+    if todo or ufos != cache["ufos"] or len(used) != len(sigs):
+        sigs = {sha: sig for sha, sig in sigs.items() if sha in used}
+        save_cache({"ufos": ufos, "signatures": sigs})
+    return sigs, hashes
+
+
+def pack(sigs, hashes, ufo_paths, glyph_names):
+    """Intern each property to a (glyphs x masters) int array, -1 if missing"""
+    shas = list(sigs)
+    sha_ids = {sha: i for i, sha in enumerate(shas)}
+    glyph_ids = {name: i for i, name in enumerate(glyph_names)}
+    index = np.full((len(glyph_names), len(ufo_paths)), -1, dtype=np.int64)
+    for j, path in enumerate(ufo_paths):
+        for name, sha in hashes[path].items():
+            index[glyph_ids[name], j] = sha_ids[sha]
+    arrays = {}
+    for prop in PROPERTIES:
+        ids = {}
+        prop_ids = np.array([ids.setdefault(sigs[sha][prop], len(ids)) for sha in shas] + [-1])
+        arrays[prop] = prop_ids[index]
+    return arrays
+
+
+def find_mismatches(arrays, reference):
+    """Get {property: (glyph index, master index) pairs} that differ from
+    the reference master, or from the first master having the glyph"""
+    res = {}
+    for prop, array in arrays.items():
+        present = array >= 0
+        first = np.argmax(present, axis=1)
+        ref = np.where(present[:, reference], array[:, reference], array[np.arange(len(array)), first])
+        bad = present & (array != ref[:, None])
+        res[prop] = np.argwhere(bad)
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the sources are interpolation compatible")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    args = parser.parse_args()
+
+    start = time.time()
+    ds = build_designspace(list(scan_ufos(SRC_DIR)))
+    ufo_paths = [s.filename for s in ds.sources]
+    reference = ufo_paths.index(ds.findDefault().filename)
+    sigs, hashes = signatures(ufo_paths, args.workers)
+    glyph_names = sorted({name for glyphs in hashes.values() for name in glyphs})
+    arrays = pack(sigs, hashes, ufo_paths, glyph_names)
+
+    errors = 0
+    for prop, pairs in find_mismatches(arrays, reference).items():
+        for i, j in pairs:
+            name, path = glyph_names[i], ufo_paths[j]
+            ref = next(p for p in [ufo_paths[reference]] + ufo_paths if name in hashes[p])
+            print(f"{name}: {prop} differ in {path}")
+            print(f"    {sigs[hashes[path][name]][prop]!r}")
+            print(f"    {sigs[hashes[ref][name]][prop]!r} in {ref}")
+            errors += 1
+    print(f"Checked {len(glyph_names)} glyphs in {len(ufo_paths)} masters in {time.time() - start:.2f}s, {errors} mismatches")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""
+compile the kerning of every master into a smaller variable GPOS
+
+Loads the kerning of every master into one pair x master matrix: a row
+per pair kerned by any master, NaN where a master doesn't kern it. Each
+side of a pair is a glyph or a kerning group, and the value a master
+gives two glyphs follows the ufo precedence: glyph-glyph, glyph-group,
+group-glyph, group-group, else 0.
+
+ufo2ft writes group-group pairs as cells of a PairPos format 2 class
+matrix, but enumerates the others into format 1 records, one per pair
+of glyphs, each with its own variation deltas. So the kerning is
+rewritten, without changing the value of any two glyphs in any master:
+
+- a glyph outside of any group, kerned with more glyphs than a row or
+  column of the class matrix has cells, e.g. V or slash, gets a group of
+  its own.
+- the glyphs of each left group x right group block get the values most
+  of them have in every master as one class pair, and the others are
+  kept as glyph pairs, when that leaves fewer records.
+- flat pairs of one glyph with every member of a group, all at the same
+  values, become one glyph-group pair, e.g. F with a, aacute, abreve...
+  at -34. ufo2ft enumerates them again, but has less feature code to
+  write and compile.
+- pairs giving the same values as what they override in every master,
+  e.g. exceptions left behind when the group's value changed, or group
+  pairs which are 0 everywhere, are dropped.
+
+Masters without kerning are left as they are. build_fonts.py compiles
+the masters with the compiled kerning and groups.
+
+Run on its own, this reads the kerning from the source cache, checks
+every pair of glyphs keeps its values, then compiles a kerning only
+variable GPOS from the kerning before and after and compares their size
+and compile time.
+
+Usage:
+    cd sources
+    python3 compile_kerning.py
+    python3 compile_kerning.py --no-gpos
+"""
+from collections import Counter
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools import varLib
+from ufo2ft.featureWriters import KernFeatureWriter
+from build_designspace import SRC_DIR, scan_ufos, build_designspace
+from source_cache import update_cache
+import argparse
+import itertools
+import time
+import numpy as np
+import ufo2ft
+import ufoLib2
+
+
+LEFT_PREFIX = "public.kern1."
+
+RIGHT_PREFIX = "public.kern2."
+
+
+class KerningMatrix:
+    """The kerning of the masters with kerning, as {pair: (masters,)
+    values}, NaN where a master doesn't kern the pair"""
+
+    def __init__(self, fonts):
+        self.masters = [i for i, font in enumerate(fonts) if font["kerning"]]
+        self.size = len(fonts)
+        self.groups = dict(fonts[self.masters[0]]["groups"]) if self.masters else {}
+        # What a pair covers is only known with one set of groups
+        self.compilable = all(fonts[i]["groups"] == self.groups for i in self.masters)
+        self.side_groups = {}
+        for name in self.groups:
+            self.add_group(name, self.groups[name])
+        self.pairs = {}
+        for column, i in enumerate(self.masters):
+            for pair, value in fonts[i]["kerning"].items():
+                if pair not in self.pairs:
+                    self.pairs[pair] = np.full(len(self.masters), np.nan)
+                self.pairs[pair][column] = value
+
+    def add_group(self, name, members):
+        self.groups[name] = members
+        for prefix in (LEFT_PREFIX, RIGHT_PREFIX):
+            if name.startswith(prefix):
+                self.side_groups.setdefault(prefix, {}).update((g, name) for g in members)
+
+    def group(self, glyph, prefix):
+        return self.side_groups.get(prefix, {}).get(glyph)
+
+    def kern_groups(self, prefix):
+        return [g for g in self.groups if g.startswith(prefix)]
+
+    def value(self, left, right, skip=None):
+        """Get the (masters,) values of two glyphs, as if skip wasn't kerned"""
+        left_group, right_group = self.group(left, LEFT_PREFIX), self.group(right, RIGHT_PREFIX)
+        res = np.full(len(self.masters), np.nan)
+        for pair in ((left, right), (left, right_group), (left_group, right), (left_group, right_group)):
+            if pair != skip and pair in self.pairs:
+                res = np.where(np.isnan(res), self.pairs[pair], res)
+        return np.nan_to_num(res)
+
+    def glyphs(self, side, prefix):
+        """The glyphs one side of a pair covers"""
+        return self.groups.get(side, []) if side.startswith(prefix) else [side]
+
+    def covered(self, pair):
+        return itertools.product(self.glyphs(pair[0], LEFT_PREFIX), self.glyphs(pair[1], RIGHT_PREFIX))
+
+    def is_class_pair(self, pair):
+        return pair[0].startswith(LEFT_PREFIX) and pair[1].startswith(RIGHT_PREFIX)
+
+    def records(self):
+        """Count the format 1 records ufo2ft writes for each glyph of
+        either side, as {(prefix, glyph): count}"""
+        res = Counter()
+        for pair in self.pairs:
+            if not self.is_class_pair(pair):
+                for left, right in self.covered(pair):
+                    res[LEFT_PREFIX, left] += 1
+                    res[RIGHT_PREFIX, right] += 1
+        return res
+
+    def add_singletons(self):
+        """Give the ungrouped glyphs with more records than a class matrix
+        row or column has cells a group of their own. Kerning nothing yet,
+        the groups don't change any value. Returns the new groups."""
+        cells = {
+            LEFT_PREFIX: len(self.kern_groups(RIGHT_PREFIX)) + 1,
+            RIGHT_PREFIX: len(self.kern_groups(LEFT_PREFIX)) + 1,
+        }
+        added = []
+        for (prefix, glyph), count in self.records().items():
+            name = prefix + glyph
+            if count > cells[prefix] and not self.group(glyph, prefix) and name not in self.groups:
+                self.add_group(name, [glyph])
+                added.append(name)
+        return added
+
+    def promote_blocks(self):
+        """Give the glyphs of each left group x right group block the values
+        most of them have as one class pair, when fewer glyph pairs are left
+        as exceptions than ufo2ft writes records for the block. Returns the
+        number of records which went."""
+        saved = 0
+        for left_group, right_group in itertools.product(self.kern_groups(LEFT_PREFIX), self.kern_groups(RIGHT_PREFIX)):
+            lefts, rights = self.groups[left_group], self.groups[right_group]
+            flat = [
+                pair for pair in itertools.chain(
+                    itertools.product(lefts, rights + [right_group]),
+                    itertools.product([left_group], rights),
+                ) if pair in self.pairs
+            ]
+            records = sum(len(list(self.covered(pair))) for pair in flat)
+            if not records:
+                continue
+            values = {glyphs: self.value(*glyphs) for glyphs in itertools.product(lefts, rights)}
+            common = np.frombuffer(Counter(v.tobytes() for v in values.values()).most_common(1)[0][0])
+            exceptions = {glyphs: v for glyphs, v in values.items() if not np.array_equal(v, common)}
+            if len(exceptions) >= records:
+                continue
+            for pair in flat:
+                del self.pairs[pair]
+            self.pairs[left_group, right_group] = common
+            self.pairs.update(exceptions)
+            saved += records - len(exceptions)
+        return saved
+
+    def promote_flat(self):
+        """Turn flat pairs with every member of a group into one glyph-group
+        or group-glyph pair. ufo2ft enumerates the members of such a pair, so
+        with any member left out there would be more records. Returns the
+        number of pairs which went."""
+        removed = 0
+        for prefix in (RIGHT_PREFIX, LEFT_PREFIX):
+            candidates = {}
+            for left, right in self.pairs:
+                if left.startswith(LEFT_PREFIX) or right.startswith(RIGHT_PREFIX):
+                    continue
+                if prefix == RIGHT_PREFIX and self.group(right, prefix):
+                    candidates.setdefault((left, self.group(right, prefix)), []).append((left, right))
+                elif prefix == LEFT_PREFIX and self.group(left, prefix):
+                    candidates.setdefault((self.group(left, prefix), right), []).append((left, right))
+            for group_pair, flat_pairs in candidates.items():
+                glyph_pairs = list(self.covered(group_pair))
+                if len(flat_pairs) < max(2, len(glyph_pairs)):
+                    continue
+                values = [self.value(*glyphs) for glyphs in glyph_pairs]
+                if any(not np.array_equal(values[0], v) for v in values[1:]):
+                    continue
+                if prefix == LEFT_PREFIX:
+                    # A member's glyph-group pair would win over the group-glyph pair
+                    right_group = self.group(group_pair[1], RIGHT_PREFIX)
+                    if any((member, right_group) in self.pairs for member in self.groups[group_pair[0]]):
+                        continue
+                for pair in flat_pairs:
+                    del self.pairs[pair]
+                self.pairs[group_pair] = values[0]
+                removed += len(flat_pairs) - 1
+        return removed
+
+    def drop_redundant(self):
+        """Drop the pairs which don't change the value of any two glyphs in
+        any master. Returns the number of pairs dropped."""
+        dropped = 0
+        for pair in list(self.pairs):
+            if self.is_class_pair(pair):
+                redundant = not np.nan_to_num(self.pairs[pair]).any()
+            else:
+                redundant = all(
+                    np.array_equal(self.value(*glyphs), self.value(*glyphs, skip=pair))
+                    for glyphs in self.covered(pair)
+                )
+            if redundant:
+                del self.pairs[pair]
+                dropped += 1
+        return dropped
+
+    def drop_groups(self, names):
+        """Drop the groups of names which no pair uses"""
+        used = {side for pair in self.pairs for side in pair}
+        for name in names:
+            if name in used:
+                continue
+            members = self.groups.pop(name)
+            for prefix, side_groups in self.side_groups.items():
+                if name.startswith(prefix):
+                    for glyph in members:
+                        del side_groups[glyph]
+
+    def kerning(self):
+        """Get the {(left, right): value} kerning of every master"""
+        res = [{} for _ in range(self.size)]
+        for pair, values in self.pairs.items():
+            for column, value in enumerate(values.tolist()):
+                if not np.isnan(value):
+                    res[self.masters[column]][pair] = int(value) if value.is_integer() else value
+        return res
+
+    def rows(self):
+        """Count the pairs and their master values"""
+        values = np.array(list(self.pairs.values())).reshape(-1, len(self.masters))
+        return len(values), int(np.count_nonzero(~np.isnan(values)))
+
+
+def compile_kerning(fonts):
+    """Compile the kerning of fonts, a list of {"groups", "kerning"} dicts.
+    Returns the fonts with their compiled groups and kerning, and a
+    summary."""
+    matrix = KerningMatrix(fonts)
+    if not matrix.masters:
+        return fonts, "no kerning"
+    if not matrix.compilable:
+        return fonts, "kept as is, the masters have different groups"
+    pairs, values = matrix.rows()
+    records = sum(c for (prefix, _), c in matrix.records().items() if prefix == LEFT_PREFIX)
+    singletons = matrix.add_singletons()
+    blocks = matrix.promote_blocks()
+    flat = matrix.promote_flat()
+    dropped = matrix.drop_redundant()
+    matrix.drop_groups(singletons)
+    new_pairs, new_values = matrix.rows()
+    new_records = sum(c for (prefix, _), c in matrix.records().items() if prefix == LEFT_PREFIX)
+    res = list(fonts)
+    for i, kerning in enumerate(matrix.kerning()):
+        if i in matrix.masters:
+            res[i] = dict(fonts[i], groups=dict(matrix.groups), kerning=kerning)
+    summary = (
+        f"{pairs} -> {new_pairs} pairs, {values} -> {new_values} master values, {records} -> "
+        f"{new_records} enumerated glyph pairs: {len([g for g in singletons if g in matrix.groups])} "
+        f"glyphs got their own group, {blocks} enumerated pairs went into class pairs, {flat} flat "
+        f"pairs into glyph-group pairs, {dropped} redundant pairs dropped"
+    )
+    return res, summary
+
+
+def check_kerning(fonts, compiled):
+    """Get the pairs of glyphs whose values changed in any master"""
+    before, after = KerningMatrix(fonts), KerningMatrix(compiled)
+    glyph_pairs = {glyphs for m in (before, after) for pair in m.pairs for glyphs in m.covered(pair)}
+    return [glyphs for glyphs in glyph_pairs if not np.array_equal(before.value(*glyphs), after.value(*glyphs))]
+
+
+def kerning_ufo(font, glyphs):
+    """A ufo with only the glyphs' names and unicodes, and the kerning"""
+    ufo = ufoLib2.Font()
+    ufo.info.unitsPerEm = font["info"].get("unitsPerEm") or 1000
+    for name, unicodes in glyphs.items():
+        ufo.newGlyph(name).unicodes = unicodes
+    ufo.lib["public.glyphOrder"] = list(glyphs)
+    ufo.groups.update(font["groups"])
+    ufo.kerning.update(font["kerning"])
+    return ufo
+
+
+def compile_gpos(ds, fonts, glyphs):
+    """Build a variable font of the designspace with only the kerning.
+    Returns its GPOS and GDEF size, the time it took and gpos_pairs()."""
+    start = time.time()
+    ds = DesignSpaceDocument.fromstring(ds.tostring())
+    for source, font in zip(ds.sources, fonts):
+        source.font = kerning_ufo(font, glyphs)
+    ds = ufo2ft.compileInterpolatableTTFsFromDS(ds, featureWriters=[KernFeatureWriter])
+    vf, _, _ = varLib.build(ds, exclude=["STAT", "MVAR", "HVAR", "cvar"])
+    size = sum(len(vf[tag].compile(vf)) for tag in ("GPOS", "GDEF") if tag in vf)
+    return size, time.time() - start, gpos_pairs(vf)
+
+
+def gpos_pairs(font):
+    """Count the PairPos subtables, the format 1 pair records and the
+    format 2 class matrix cells"""
+    subtables, records, cells = 0, 0, 0
+    for lookup in font["GPOS"].table.LookupList.Lookup:
+        for subtable in lookup.SubTable:
+            if subtable.LookupType == 9:
+                subtable = subtable.ExtSubTable
+            if subtable.LookupType != 2:
+                continue
+            subtables += 1
+            if subtable.Format == 1:
+                records += sum(s.PairValueCount for s in subtable.PairSet)
+            else:
+                cells += subtable.Class1Count * subtable.Class2Count
+    return subtables, records, cells
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the kerning of the masters and compare the GPOS before and after")
+    parser.add_argument("--no-gpos", action="store_true", help="don't compile the GPOS")
+    parser.add_argument("-j", "--workers", type=int, help="number of processes updating the source cache")
+    args = parser.parse_args()
+
+    ufo_paths = list(scan_ufos(SRC_DIR))
+    ds = build_designspace(ufo_paths)
+    with update_cache(ufo_paths, workers=args.workers) as pack:
+        masters = [pack.master(s.filename) for s in ds.sources]
+        fonts = [{"info": m.info, "groups": m.groups, "kerning": m.kerning} for m in masters]
+        glyphs = {}
+        for m in masters:
+            for name in m:
+                if name not in glyphs:
+                    glyphs[name] = m[name].unicodes
+
+    start = time.time()
+    compiled, summary = compile_kerning(fonts)
+    print(f"Compiled the kerning of {len(fonts)} masters in {time.time() - start:.2f}s: {summary}")
+    changed = check_kerning(fonts, compiled)
+    if changed:
+        raise SystemExit(f"{len(changed)} pairs of glyphs changed, e.g. {' '.join(changed[0])}")
+    if args.no_gpos:
+        return
+
+    results = []
+    for label, masters in (("before", fonts), ("after", compiled)):
+        size, seconds, (subtables, records, cells) = compile_gpos(ds, masters, glyphs)
+        results.append((size, seconds))
+        print(
+            f"{label:6}  GPOS+GDEF {size} bytes, compiled in {seconds:.1f}s: {subtables} PairPos "
+            f"subtables, {records} pair records, {cells} class matrix cells"
+        )
+    (old, old_seconds), (new, new_seconds) = results
+    print(f"GPOS+GDEF {new / old - 1:+.1%}, compile time {new_seconds / old_seconds - 1:+.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+component dependency graph of all the ufo sources
+
+Records which components every glyph of every ufo in 1A-drawings uses,
+and indexes the reverse: for each base or mark, the composites using it
+directly and the ones depending on it through nested components, with
+the masters they do so in. The index is kept in .cache/components.json,
+so a query is a dict lookup.
+
+Updating reuses the .glif hashes by mtime and size like
+check_compatibility.py, and only parses the .glifs whose hash isn't
+known yet.
+
+Usage:
+    cd sources
+    python3 component_graph.py acutecomb gravecomb   # composites using them
+    python3 component_graph.py --direct acutecomb    # without nesting
+    python3 component_graph.py --recipes 1A-drawings/Mains/RobotoFlex_wght400.ufo
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from build_designspace import SRC_DIR, scan_ufos
+from glyph_hashes import COMPONENT_RE, hash_glifs
+import argparse
+import json
+import os
+import plistlib
+import time
+
+
+CACHE_PATH = os.path.join(".cache", "components.json")
+
+
+def read_components(glif_paths):
+    """Get the component base names of each .glif"""
+    res = []
+    for path in glif_paths:
+        with open(path, "rb") as f:
+            res.append([b.decode("utf-8") for b in COMPONENT_RE.findall(f.read())])
+    return res
+
+
+def build_index(masters, ufos, components):
+    """Get the direct and nested {base: {composite: [master index]}}"""
+    users = {}
+    dependents = {}
+    for i, path in enumerate(masters):
+        bases = {
+            name: components[rec[2]]
+            for name, rec in ufos[path]["glyphs"].items()
+            if components[rec[2]]
+        }
+        for name, glyph_bases in bases.items():
+            for base in glyph_bases:
+                users.setdefault(base, {}).setdefault(name, []).append(i)
+        closure = {}
+        for name in bases:
+            for base in nested_bases(name, bases, closure):
+                dependents.setdefault(base, {}).setdefault(name, []).append(i)
+    return users, dependents
+
+
+def nested_bases(name, bases, closure, seen=()):
+    """Get every glyph name uses through its components, at any depth"""
+    if name not in closure:
+        res = set()
+        for base in bases.get(name, ()):
+            res.add(base)
+            if base not in seen:
+                res.update(nested_bases(base, bases, closure, seen + (name,)))
+        closure[name] = res
+    return closure[name]
+
+
+class ComponentGraph:
+    """Reverse component dependencies across all the ufo sources"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.ufos = data.get("ufos", {})
+        self.components = data.get("components", {})
+        self.masters = data.get("masters", [])
+        self._users = data.get("users", {})
+        self._dependents = data.get("dependents", {})
+
+    @classmethod
+    def load(cls, path=CACHE_PATH):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as doc:
+            return cls(json.load(doc))
+
+    def save(self, path=CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as doc:
+            doc.write(json.dumps({
+                "ufos": self.ufos,
+                "components": self.components,
+                "masters": self.masters,
+                "users": self._users,
+                "dependents": self._dependents,
+            }))
+
+    def update(self, ufo_paths, workers=None):
+        """Rehash the ufos, parse the new .glifs and reindex if anything
+        changed. Returns whether it did."""
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            ufos = dict(zip(ufo_paths, pool.map(
+                lambda p: hash_glifs(p, self.ufos.get(p)), ufo_paths
+            )))
+        if ufos == self.ufos and self.masters == list(ufo_paths):
+            return False
+
+        todo = {}
+        for ufo in ufos.values():
+            for path, _, sha in ufo["glyphs"].values():
+                if sha not in self.components:
+                    todo.setdefault(sha, path)
+        if todo:
+            shas = list(todo)
+            chunks = [shas[i:i + 500] for i in range(0, len(shas), 500)]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parsed = pool.map(read_components, [[todo[sha] for sha in c] for c in chunks])
+                for chunk, bases in zip(chunks, parsed):
+                    self.components.update(zip(chunk, bases))
+
+        used = {rec[2] for ufo in ufos.values() for rec in ufo["glyphs"].values()}
+        self.components = {sha: b for sha, b in self.components.items() if sha in used}
+        self.ufos = ufos
+        self.masters = list(ufo_paths)
+        self._users, self._dependents = build_index(self.masters, self.ufos, self.components)
+        return True
+
+    def users(self, name):
+        """Get {composite: [ufo paths]} for the composites using name as
+        a component"""
+        return self._resolve(self._users.get(name, {}))
+
+    def dependents(self, name):
+        """Same as users, including composites using name through other
+        composites"""
+        return self._resolve(self._dependents.get(name, {}))
+
+    def bases(self, ufo_path, name):
+        """Get the component base names of a glyph in one ufo"""
+        return self.components[self.ufos[ufo_path]["glyphs"][name][2]]
+
+    def _resolve(self, composites):
+        return {name: [self.masters[i] for i in ids] for name, ids in composites.items()}
+
+
+def load_graph(ufo_paths=None, workers=None):
+    """Get the up to date graph of the given ufos, all of 1A-drawings
+    by default"""
+    if ufo_paths is None:
+        ufo_paths = sorted(scan_ufos(SRC_DIR, workers))
+    graph = ComponentGraph.load()
+    if graph.update(ufo_paths, workers):
+        graph.save()
+    return graph
+
+
+def glyph_order(ufo_path, graph):
+    with open(os.path.join(ufo_path, "lib.plist"), "rb") as f:
+        order = plistlib.load(f).get("public.glyphOrder", [])
+    glyphs = graph.ufos[ufo_path]["glyphs"]
+    return [n for n in order if n in glyphs] + sorted(set(glyphs) - set(order))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the composites depending on glyphs")
+    parser.add_argument("glyphs", nargs="*", help="base or mark glyph names")
+    parser.add_argument("--direct", action="store_true", help="only composites using the glyphs as components")
+    parser.add_argument("--recipes", metavar="UFO", help="print glyph=base+mark for every glyph of a ufo, like tools/getRecipe.py")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list the masters of each composite")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    args = parser.parse_args()
+
+    start = time.time()
+    graph = load_graph(workers=args.workers)
+    if args.recipes:
+        ufo_path = os.path.normpath(args.recipes)
+        if ufo_path not in graph.ufos:
+            parser.error(f"{ufo_path} is not in {SRC_DIR}")
+        for name in glyph_order(ufo_path, graph):
+            bases = graph.bases(ufo_path, name)
+            print(f"{name}={'+'.join(bases)}" if bases else name)
+        return
+
+    for glyph in args.glyphs:
+        composites = graph.users(glyph) if args.direct else graph.dependents(glyph)
+        print(f"{glyph}: {len(composites)} composites")
+        for name, masters in sorted(composites.items()):
+            print(f"    {name} ({len(masters)} masters)")
+            if args.verbose:
+                for path in masters:
+                    print(f"        {path}")
+    print(f"Queried {len(graph.masters)} masters in {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+hash the .glif files of the designspace sources
+
+Reads each ufo's contents.plist and the raw .glif bytes only, so hashing
+all 72 sources never parses a glyph. COMPONENT_RE finds the component
+bases of raw .glif bytes, for the tools which scan them the same way.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import plistlib
+import os
+import re
+
+
+FONT_FILES = [
+    "fontinfo.plist",
+    "groups.plist",
+    "kerning.plist",
+    "lib.plist",
+    "features.fea",
+    "layercontents.plist",
+]
+
+COMPONENT_RE = re.compile(rb'<component\s[^>]*base="([^"]+)"')
+
+
+def glif_paths(ufo_path, layer="glyphs"):
+    """Map glyph names to .glif paths using the layer's contents.plist"""
+    layer_dir = os.path.join(ufo_path, layer)
+    with open(os.path.join(layer_dir, "contents.plist"), "rb") as f:
+        contents = plistlib.load(f)
+    return {name: os.path.join(layer_dir, fn) for name, fn in contents.items()}
+
+
+def read_glifs(ufo_path, layer="glyphs"):
+    """Yield (glyph name, raw .glif bytes) for a ufo layer"""
+    for name, path in glif_paths(ufo_path, layer).items():
+        with open(path, "rb") as f:
+            yield name, f.read()
+
+
+def hash_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hash_bytes(f.read())
+
+
+def hash_font_files(ufo_path):
+    """Hash the non-glyph files of a ufo (info, kerning, features...)"""
+    h = hashlib.sha1()
+    for fn in FONT_FILES:
+        path = os.path.join(ufo_path, fn)
+        if os.path.exists(path):
+            h.update(fn.encode("utf-8"))
+            with open(path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+def hash_ufo(ufo_path, layer="glyphs"):
+    """Get {glyph name: sha1 of its .glif} for a ufo layer"""
+    return {name: hash_bytes(data) for name, data in read_glifs(ufo_path, layer)}
+
+
+def hash_sources(ufo_paths, workers=None):
+    """Hash every glyph of every ufo, one ufo per worker thread"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(ufo_paths, pool.map(hash_ufo, ufo_paths)))
+
+
+def stamp(path):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def hash_glifs(ufo_path, known=None):
+    """Hash a ufo's .glifs, reusing the hashes in known for files whose
+    mtime and size are unchanged.
+
+    Returns {"contents": stamp, "glyphs": {name: [path, stamp, sha1]}}.
+    """
+    known = known or {"contents": None, "glyphs": {}}
+    contents = stamp(os.path.join(ufo_path, "glyphs", "contents.plist"))
+    if contents == known["contents"]:
+        paths = {name: rec[0] for name, rec in known["glyphs"].items()}
+    else:
+        paths = glif_paths(ufo_path)
+    glyphs = {}
+    for name, path in paths.items():
+        st = stamp(path)
+        rec = known["glyphs"].get(name)
+        if rec and rec[0] == path and rec[1] == st:
+            glyphs[name] = rec
+        else:
+            glyphs[name] = [path, st, hash_file(path)]
+    return {"contents": contents, "glyphs": glyphs}
@@ -0,0 +1,308 @@
+"""
+interpolate the masters with numpy, without building a ttf
+
+Loads the points, component transforms and advance widths of every glyph
+of every designspace source into one contiguous float32 array per set of
+masters (the sparse masters only have some of the glyphs), reading them
+from the packed source cache of source_cache.py. Each set gets a
+fontTools VariationModel, which is turned into a single matrix mapping
+master values to deltas. Instancing many locations is then one
+(locations x masters) @ (masters x points) multiply per set.
+
+Each glyph is stored as rows of (x, y):
+    - its contour points, in .glif order (the curves stay cubic)
+    - three rows per component: (dx, dy), (xx, xy), (yx, yy)
+    - one row with (advance width, 0)
+
+Usage:
+    cd sources
+    python3 interpolation_model.py wght700-wdth50-opsz36 --glyphs a b
+    python3 interpolation_model.py --random 10000
+"""
+from fontTools.pens.recordingPen import RecordingPointPen
+from fontTools.ufoLib import UFOReader
+from fontTools.varLib.models import VariationModel
+from concurrent.futures import ProcessPoolExecutor
+from build_designspace import SRC_DIR, scan_ufos, build_designspace
+from source_cache import SEGMENT_TYPES, SMOOTH, update_cache
+import argparse
+import re
+import time
+import numpy as np
+
+
+LOCATION_RE = re.compile(r"([A-Za-z]{4})(-?\d+(?:\.\d+)?)")
+
+
+class _Glyph:
+    width = 0
+
+
+def read_master(ufo_path):
+    """Get {glyph name: (structure, rows)} for every glyph of a ufo.
+
+    structure holds the point types of each contour and the component
+    bases, which must match across masters for a glyph to interpolate.
+    """
+    glyph_set = UFOReader(ufo_path, validate=False).getGlyphSet(validateRead=False)
+    res = {}
+    for name in glyph_set.keys():
+        pen = RecordingPointPen()
+        glyph = _Glyph()
+        glyph_set.readGlyph(name, glyph, pen, validate=False)
+        contours, components, rows = [], [], []
+        for method, args, _ in pen.value:
+            if method == "beginPath":
+                contours.append([])
+            elif method == "addPoint":
+                pt, segment_type = args[0], args[1]
+                contours[-1].append(segment_type)
+                rows.append(pt)
+        for method, args, _ in pen.value:
+            if method == "addComponent":
+                base, (xx, xy, yx, yy, dx, dy) = args
+                components.append(base)
+                rows += [(dx, dy), (xx, xy), (yx, yy)]
+        rows.append((glyph.width, 0))
+        structure = (tuple(tuple(c) for c in contours), tuple(components))
+        res[name] = (structure, np.array(rows, dtype=np.float32))
+    return res
+
+
+def pack_master(master):
+    """Get the same as read_master from a master of the source cache"""
+    res = {}
+    for name in master:
+        glyph = master[name]
+        contours = tuple(
+            tuple(SEGMENT_TYPES[code & ~SMOOTH] for code in types.tolist())
+            for _, types in glyph.contours()
+        )
+        components = glyph.components()
+        rows = [glyph.points]
+        for _, (xx, xy, yx, yy, dx, dy) in components:
+            rows.append([(dx, dy), (xx, xy), (yx, yy)])
+        rows.append([(glyph.width, 0)])
+        structure = (contours, tuple(base for base, _ in components))
+        res[name] = (structure, np.concatenate(rows, dtype=np.float32))
+    return res
+
+
+def parse_location(s):
+    """wght700-wdth50-opsz36 --> {wght: 700, wdth: 50, opsz: 36}"""
+    return {tag: float(v) for tag, v in LOCATION_RE.findall(s)}
+
+
+def support_scalars(locations, lower, peak, upper):
+    """Vectorized fontTools.varLib.models.supportScalar.
+
+    locations is (n, axes) and the supports are (supports, axes) arrays,
+    returns the (n, supports) scalars.
+    """
+    v = locations[:, None, :]
+    ignore = (peak == 0) | (lower > peak) | (peak > upper) | ((lower < 0) & (upper > 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rising = (v - lower) / (peak - lower)
+        falling = (v - upper) / (peak - upper)
+    scalar = np.where(v < peak, rising, falling)
+    scalar = np.where((v <= lower) | (v >= upper), 0.0, scalar)
+    scalar = np.where((v == peak) | ignore, 1.0, scalar)
+    return scalar.prod(axis=2)
+
+
+class _MasterSet:
+    """The glyphs shared by one set of masters and their variation model"""
+
+    def __init__(self, model, axis_tags, points):
+        n = len(model.locations)
+        # Row i turns the master values into the delta of model.supports[i]
+        deltas = np.zeros((n, n))
+        for i, weights in enumerate(model.deltaWeights):
+            row = np.zeros(n)
+            row[model.reverseMapping[i]] = 1.0
+            for j, weight in weights.items():
+                row -= weight * deltas[j]
+            deltas[i] = row
+        self.deltas = deltas
+        supports = [[s.get(tag, (0.0, 0.0, 0.0)) for tag in axis_tags] for s in model.supports]
+        self.lower, self.peak, self.upper = np.array(supports, dtype=np.float64).transpose(2, 0, 1)
+        self.points = points
+
+    def weights(self, locations):
+        """Get the (n, masters) weights of normalized locations"""
+        scalars = support_scalars(locations, self.lower, self.peak, self.upper)
+        return (scalars @ self.deltas).astype(np.float32)
+
+
+class InterpolationModel:
+    """All glyphs of the designspace sources, ready to be instanced.
+
+    model = InterpolationModel.from_sources()
+    rows = model.instance([{"wght": 700}, {"wdth": 25, "opsz": 144}], ["a"])
+    rows["a"]  # (2 locations, rows, 2) array
+    """
+
+    def __init__(self, ds, workers=None, pack=None):
+        self.axes = ds.axes
+        self.axis_tags = [a.tag for a in ds.axes]
+        self.default_location = {a.tag: a.default for a in ds.axes}
+        if pack:
+            masters = [pack_master(pack.master(s.path)) for s in ds.sources]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                masters = list(pool.map(read_master, [s.path for s in ds.sources]))
+        master_locs = self.normalize_design(
+            [[s.location[tag] for tag in self.axis_tags] for s in ds.sources]
+        )
+        default = masters[ds.sources.index(ds.findDefault())]
+
+        groups = {}
+        self.incompatible = []
+        for name, (structure, _) in default.items():
+            used = tuple(i for i, m in enumerate(masters) if name in m)
+            if any(masters[i][name][0] != structure for i in used):
+                self.incompatible.append(name)
+                continue
+            groups.setdefault(used, []).append(name)
+
+        self.glyphs = {}
+        self.master_sets = []
+        for used, names in groups.items():
+            locs = [dict(zip(self.axis_tags, master_locs[i])) for i in used]
+            model = VariationModel(locs, axisOrder=self.axis_tags)
+            sizes = [len(default[name][1]) for name in names]
+            starts = np.cumsum([0] + sizes)
+            points = np.empty((len(used), starts[-1], 2), dtype=np.float32)
+            for row, i in enumerate(used):
+                points[row] = np.concatenate([masters[i][name][1] for name in names])
+            index = len(self.master_sets)
+            self.master_sets.append(_MasterSet(model, self.axis_tags, points))
+            for name, start, size in zip(names, starts, sizes):
+                self.glyphs[name] = (index, start, size, default[name][0])
+
+    @classmethod
+    def from_sources(cls, src_dir=SRC_DIR, workers=None):
+        """Load the sources the same way build_designspace.py finds them,
+        from the source cache"""
+        ufo_paths = list(scan_ufos(src_dir))
+        ds = build_designspace(ufo_paths)
+        for source in ds.sources:
+            source.path = source.filename
+        with update_cache(ufo_paths, workers=workers) as pack:
+            return cls(ds, workers, pack)
+
+    def normalize_design(self, values):
+        """Normalize (n, axes) design coordinates to -1..1"""
+        values = np.asarray(values, dtype=np.float64)
+        res = np.empty_like(values)
+        for i, axis in enumerate(self.axes):
+            lo, dflt, hi = (axis.map_forward(v) for v in (axis.minimum, axis.default, axis.maximum))
+            v = np.clip(values[:, i], lo, hi)
+            below = (v - dflt) / (dflt - lo) if dflt != lo else 0.0
+            above = (v - dflt) / (hi - dflt) if hi != dflt else 0.0
+            res[:, i] = np.where(v < dflt, below, above)
+        return res
+
+    def normalize(self, locations):
+        """Normalize user locations (dicts or an (n, axes) array) to -1..1
+
+        Missing axes are at their default.
+        """
+        if not isinstance(locations, np.ndarray):
+            locations = [
+                [loc.get(tag, self.default_location[tag]) for tag in self.axis_tags]
+                for loc in locations
+            ]
+        values = np.array(locations, dtype=np.float64)
+        for i, axis in enumerate(self.axes):
+            if axis.map:
+                user, design = zip(*sorted(axis.map))
+                values[:, i] = np.interp(values[:, i], user, design)
+        return self.normalize_design(values)
+
+    def instance(self, locations, glyph_names=None):
+        """Get {glyph name: (locations, rows, 2) array} at user locations.
+
+        Each set of masters is instanced with one matrix multiply, so ask
+        for many locations at once. Unlisted glyphs are never computed.
+        """
+        normalized = self.normalize(locations)
+        names = self.glyphs if glyph_names is None else glyph_names
+        wanted = {}
+        for name in names:
+            index, start, size, _ = self.glyphs[name]
+            wanted.setdefault(index, []).append((name, start, size))
+        res = {}
+        for index, glyphs in wanted.items():
+            master_set = self.master_sets[index]
+            weights = master_set.weights(normalized)
+            if len(glyphs) * 4 < len(self.glyphs):
+                cols = np.concatenate([np.arange(s, s + n) for _, s, n in glyphs])
+                points = master_set.points[:, cols]
+                offset = 0
+                spans = []
+                for name, _, size in glyphs:
+                    spans.append((name, offset, size))
+                    offset += size
+            else:
+                points = master_set.points
+                spans = glyphs
+            m, rows, _ = points.shape
+            out = (weights @ points.reshape(m, rows * 2)).reshape(-1, rows, 2)
+            for name, start, size in spans:
+                res[name] = out[:, start:start + size]
+        return res
+
+    def advances(self, locations, glyph_names=None):
+        """Get {glyph name: (locations,) advance widths}"""
+        return {name: rows[:, -1, 0] for name, rows in self.instance(locations, glyph_names).items()}
+
+    def draw(self, name, rows, pen):
+        """Draw one instanced glyph (rows for a single location) to a point pen"""
+        _, _, _, (contours, components) = self.glyphs[name]
+        i = 0
+        for segment_types in contours:
+            pen.beginPath()
+            for segment_type in segment_types:
+                pen.addPoint((float(rows[i][0]), float(rows[i][1])), segment_type)
+                i += 1
+            pen.endPath()
+        for base in components:
+            (dx, dy), (xx, xy), (yx, yy) = rows[i:i + 3].tolist()
+            pen.addComponent(base, (xx, xy, yx, yy, dx, dy))
+            i += 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Instance the designspace sources with numpy")
+    parser.add_argument("locations", nargs="*", help="e.g. wght700-wdth50-opsz36, missing axes are at default")
+    parser.add_argument("--glyphs", nargs="+", help="glyphs to report, defaults to all")
+    parser.add_argument("--random", type=int, help="time instancing this many random locations")
+    parser.add_argument("-j", "--workers", type=int, help="number of processes loading the masters")
+    args = parser.parse_args()
+
+    start = time.time()
+    model = InterpolationModel.from_sources(workers=args.workers)
+    print(f"Loaded {len(model.glyphs)} glyphs in {len(model.master_sets)} master sets in {time.time() - start:.1f}s")
+    if model.incompatible:
+        print(f"Skipped incompatible glyphs: {' '.join(model.incompatible)}")
+
+    if args.random:
+        rng = np.random.default_rng(0)
+        lo = [a.minimum for a in model.axes]
+        hi = [a.maximum for a in model.axes]
+        locations = rng.uniform(lo, hi, size=(args.random, len(lo)))
+        start = time.time()
+        model.instance(locations, args.glyphs)
+        elapsed = time.time() - start
+        print(f"Instanced {args.random} locations in {elapsed:.2f}s ({args.random / elapsed:.0f}/s)")
+
+    for s in args.locations:
+        advances = model.advances([parse_location(s)], args.glyphs)
+        print(s)
+        for name, width in advances.items():
+            print(f"    {name} {width[0]:.1f}")
+
+
+if __name__ == "__main__":
+    main()
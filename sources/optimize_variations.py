@@ -0,0 +1,293 @@
+"""
+shrink the gvar and HVAR tables of a variable font and report their cost
+
+Lists the glyphs, masters and glyph/master pairs taking the most gvar
+bytes, measured on the compiled table, then:
+
+- drops the tuples of a glyph whose deltas are all within --tolerance.
+  varLib already skips all zero tuples of simple glyphs but keeps them
+  for composites, which only need one tuple each to vary on macOS
+  (fonttools#1381), so composites keep at least one.
+- with --iup-tolerance, reruns the IUP optimization of simple glyphs at
+  that tolerance instead of varLib's 0.5 units. Lossy, off by default.
+- reoptimizes the HVAR variation store, if that makes it smaller and
+  leaves every advance the same.
+
+gvar picks its shared tuples when compiled, so they are recomputed for
+the tuples which are left. With the default tolerance of 0 the outlines
+don't change at all. build_fonts.py runs it on every variable font.
+
+Usage:
+    python3 sources/optimize_variations.py "fonts/variable/RobotoFlex[GRAD,XOPQ,XTRA,YOPQ,YTAS,YTDE,YTFI,YTLC,YTUC,opsz,slnt,wdth,wght].ttf" --dry-run
+    python3 sources/optimize_variations.py font.ttf --tolerance 1 -o smaller.ttf
+"""
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools.misc.fixedTools import otRound
+from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.tables.TupleVariation import TupleVariation
+from fontTools.ttLib.tables import otTables as ot
+from fontTools.varLib.iup import iup_delta, iup_delta_optimize
+from fontTools.varLib.models import normalizeLocation
+import fontTools.varLib.varStore  # adds VarStore.optimize
+import argparse
+import io
+import os
+import struct
+import time
+
+
+DS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "RobotoFlex.designspace")
+
+GVAR_HEADER = ">HHHHLHHL"
+
+EMBEDDED_PEAK_TUPLE = 0x8000
+
+INTERMEDIATE_REGION = 0x4000
+
+TUPLE_COUNT_MASK = 0x0FFF
+
+# Newer fontTools' VarStore.optimize() maps rows of zeros to this index
+NO_VARIATION_INDEX = 0xFFFFFFFF
+
+
+def gvar_costs(data):
+    """Get the bytes each glyph takes in compiled gvar data, as
+    (total, [bytes of each tuple in order]) per glyph id"""
+    (_, _, axis_count, _, _, glyph_count, flags, array_offset) = struct.unpack(
+        GVAR_HEADER, data[:struct.calcsize(GVAR_HEADER)]
+    )
+    pos = struct.calcsize(GVAR_HEADER)
+    if flags & 1:
+        offsets = struct.unpack(f">{glyph_count + 1}L", data[pos:pos + 4 * (glyph_count + 1)])
+    else:
+        offsets = [o * 2 for o in struct.unpack(f">{glyph_count + 1}H", data[pos:pos + 2 * (glyph_count + 1)])]
+
+    costs = []
+    for start, end in zip(offsets, offsets[1:]):
+        glyph = data[array_offset + start:array_offset + end]
+        tuples = []
+        if glyph:
+            count = struct.unpack(">H", glyph[:2])[0] & TUPLE_COUNT_MASK
+            pos = 4
+            for _ in range(count):
+                size, index = struct.unpack(">HH", glyph[pos:pos + 4])
+                header = 4
+                if index & EMBEDDED_PEAK_TUPLE:
+                    header += 2 * axis_count
+                if index & INTERMEDIATE_REGION:
+                    header += 4 * axis_count
+                tuples.append(header + size)
+                pos += header
+        costs.append((len(glyph), tuples))
+    return costs
+
+
+def region_key(axes):
+    """A tuple variation's {tag: (start, peak, end)} --> its peak as a
+    hashable key"""
+    return tuple(sorted((tag, round(peak, 2)) for tag, (_, peak, _) in axes.items() if peak))
+
+
+def master_names(ds_path=DS_PATH):
+    """Get {region key: source filename} for the designspace masters.
+    Source locations are design coordinates, so normalizing them gives
+    the peaks gvar stores, after avar."""
+    if not os.path.exists(ds_path):
+        return {}
+    ds = DesignSpaceDocument.fromfile(ds_path)
+    axes = {a.name: a for a in ds.axes}
+    triples = {
+        name: tuple(a.map_forward(v) for v in (a.minimum, a.default, a.maximum))
+        for name, a in axes.items()
+    }
+    names = {}
+    for source in ds.sources:
+        location = normalizeLocation(source.location, triples)
+        key = tuple(sorted((axes[name].tag, round(v, 2)) for name, v in location.items() if v))
+        names[key] = source.filename
+    return names
+
+
+def region_name(key, names):
+    return names.get(key) or " ".join(f"{tag}{peak:+g}" for tag, peak in key)
+
+
+def cost_report(font, data, top=20, ds_path=DS_PATH):
+    """Print the glyphs, masters and glyph/master pairs costing the most
+    gvar bytes"""
+    glyph_order = font.getGlyphOrder()
+    variations = font["gvar"].variations
+    names = master_names(ds_path)
+    by_glyph, by_master, pairs = [], {}, []
+    for glyph, (total, tuples) in zip(glyph_order, gvar_costs(data)):
+        by_glyph.append((total, glyph, len(tuples)))
+        for var, size in zip(variations.get(glyph, []), tuples):
+            key = region_key(var.axes)
+            count, nbytes = by_master.get(key, (0, 0))
+            by_master[key] = (count + 1, nbytes + size)
+            pairs.append((size, glyph, key))
+    total = len(data)
+
+    print(f"gvar: {total} bytes, {sum(n for _, _, n in by_glyph)} tuples")
+    print(f"Top {top} glyphs:")
+    for size, glyph, count in sorted(by_glyph, reverse=True)[:top]:
+        print(f"    {size:8} {size / total:6.1%}  {glyph} ({count} tuples)")
+    print(f"Top {top} masters:")
+    for key, (count, size) in sorted(by_master.items(), key=lambda t: -t[1][1])[:top]:
+        print(f"    {size:8} {size / total:6.1%}  {region_name(key, names)} ({count} glyphs)")
+    print(f"Top {top} glyphs in masters:")
+    for size, glyph, key in sorted(pairs, reverse=True)[:top]:
+        print(f"    {size:8} {size / total:6.1%}  {glyph} in {region_name(key, names)}")
+
+
+def is_negligible(var, tolerance):
+    return all(
+        abs(x) <= tolerance and abs(y) <= tolerance
+        for x, y in (c for c in var.coordinates if c is not None)
+    )
+
+
+def prune_tuples(font, tolerance=0):
+    """Drop the tuples whose deltas are all within tolerance, keeping
+    one per composite. Returns how many were dropped."""
+    gvar = font["gvar"]
+    glyf = font["glyf"]
+    pruned = 0
+    for glyph, variations in gvar.variations.items():
+        kept = [v for v in variations if not is_negligible(v, tolerance)]
+        if not kept and variations and glyf[glyph].isComposite():
+            var = variations[0]
+            kept = [TupleVariation(var.axes, [(0, 0)] + [None] * (len(var.coordinates) - 1))]
+        pruned += len(variations) - len(kept)
+        gvar.variations[glyph] = kept
+    return pruned
+
+
+def optimize_iup(font, tolerance):
+    """Rerun IUP on the tuples of simple glyphs, keeping the result where
+    it compiles smaller. Returns how many tuples changed."""
+    gvar = font["gvar"]
+    glyf = font["glyf"]
+    metrics = font["hmtx"].metrics
+    changed = 0
+    for glyph, variations in gvar.variations.items():
+        if not variations or glyf[glyph].isComposite():
+            continue
+        coords, control = glyf._getCoordinatesAndControls(glyph, metrics)
+        ends = control.endPts
+        for i, var in enumerate(variations):
+            deltas = var.coordinates
+            if None in deltas:
+                deltas = iup_delta(deltas, coords, ends)
+            optimized = [
+                d if d is None else (otRound(d[0]), otRound(d[1]))
+                for d in iup_delta_optimize(deltas, coords, ends, tolerance=tolerance)
+            ]
+            if all(d is None for d in optimized):
+                optimized = [(0, 0)] + [None] * (len(optimized) - 1)
+            new = TupleVariation(var.axes, optimized)
+            axis_tags = sorted(var.axes)
+            if sum(map(len, new.compile(axis_tags))) < sum(map(len, var.compile(axis_tags))):
+                variations[i] = new
+                changed += 1
+    return changed
+
+
+def advance_deltas(table, glyph_order):
+    """Get {glyph: [(region, delta)]} of the advance deltas of an HVAR
+    table, with each region as its (start, peak, end) per axis"""
+    store = table.VarStore
+    regions = [
+        tuple((a.StartCoord, a.PeakCoord, a.EndCoord) for a in region.VarRegionAxis)
+        for region in store.VarRegionList.Region
+    ]
+    res = {}
+    for gid, glyph in enumerate(glyph_order):
+        # Without an AdvWidthMap the glyph id is the index, direct mapping
+        index = table.AdvWidthMap.mapping[glyph] if table.AdvWidthMap else gid
+        if index == NO_VARIATION_INDEX:
+            res[glyph] = []
+            continue
+        data = store.VarData[index >> 16]
+        row = data.Item[index & 0xFFFF]
+        res[glyph] = sorted((regions[r], d) for r, d in zip(data.VarRegionIndex, row) if d)
+    return res
+
+
+def optimize_hvar(font):
+    """Reoptimize the HVAR variation store if that makes it smaller
+    without changing any advance"""
+    if "HVAR" not in font:
+        return False
+    data = font["HVAR"].compile(font)
+    hvar = newTable("HVAR")
+    hvar.decompile(data, font)
+    glyph_order = font.getGlyphOrder()
+    before = advance_deltas(hvar.table, glyph_order)
+    if hvar.table.AdvWidthMap is None:
+        # optimize() renumbers the indices, so direct mapping has to
+        # become an explicit map from each glyph to its glyph id first
+        hvar.table.AdvWidthMap = ot.VarIdxMap()
+        hvar.table.AdvWidthMap.mapping = {glyph: gid for gid, glyph in enumerate(glyph_order)}
+    varidx_map = hvar.table.VarStore.optimize()
+    for attr in ("AdvWidthMap", "LsbMap", "RsbMap"):
+        mapping = getattr(hvar.table, attr, None)
+        if mapping is not None:
+            mapping.mapping = {g: varidx_map[v] for g, v in mapping.mapping.items()}
+    if len(hvar.compile(font)) >= len(data) or advance_deltas(hvar.table, glyph_order) != before:
+        return False
+    font["HVAR"] = hvar
+    return True
+
+
+def table_sizes(font, tags=("gvar", "HVAR")):
+    buf = io.BytesIO()
+    font.save(buf, reorderTables=False)
+    saved = TTFont(buf, lazy=True)
+    return {tag: len(saved.reader[tag]) for tag in tags if tag in saved}, len(buf.getvalue())
+
+
+def optimize_font(font, tolerance=0, iup_tolerance=None):
+    """Shrink gvar and HVAR in place, returning a summary line"""
+    pruned = prune_tuples(font, tolerance)
+    summary = [f"pruned {pruned} tuples"]
+    if iup_tolerance is not None:
+        summary.append(f"reoptimized IUP of {optimize_iup(font, iup_tolerance)} tuples")
+    if optimize_hvar(font):
+        summary.append("reoptimized HVAR")
+    return ", ".join(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shrink gvar and HVAR and report what they cost")
+    parser.add_argument("font", help="variable ttf")
+    parser.add_argument("-o", "--out", help="output path, defaults to overwriting the font")
+    parser.add_argument("--tolerance", type=float, default=0, help="drop tuples with no delta bigger than this, in units")
+    parser.add_argument("--iup-tolerance", type=float, help="rerun IUP with this tolerance, varLib uses 0.5")
+    parser.add_argument("--top", type=int, default=20, help="lines per list of the report, 0 for none")
+    parser.add_argument("--designspace", default=DS_PATH, help="designspace to name the masters with")
+    parser.add_argument("--dry-run", action="store_true", help="only report, don't save")
+    args = parser.parse_args()
+
+    start = time.time()
+    font = TTFont(args.font)
+    if args.top:
+        cost_report(font, font.reader["gvar"], args.top, args.designspace)
+    before = {tag: len(font.reader[tag]) for tag in ("gvar", "HVAR") if tag in font}, os.path.getsize(args.font)
+
+    summary = optimize_font(font, args.tolerance, args.iup_tolerance)
+    after = table_sizes(font)
+    print(f"Optimized {args.font} in {time.time() - start:.1f}s: {summary}")
+    for tag in before[0]:
+        print(f"    {tag}: {before[0][tag]} -> {after[0][tag]} bytes ({after[0][tag] / before[0][tag] - 1:+.1%})")
+    print(f"    file: {before[1]} -> {after[1]} bytes ({after[1] / before[1] - 1:+.1%})")
+    if args.dry_run:
+        return
+    out = args.out or args.font
+    font.save(out + ".tmp")
+    os.replace(out + ".tmp", out)
+    print(f"Saving {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,604 @@
+"""
+packed, memory mapped cache of every ufo source
+
+Compiles the outlines, components, anchors, advances and unicodes of
+every glyph, and the kerning, groups and font info of every ufo in
+1A-drawings into one file, .cache/sources.pack. Glyphs are stored once
+per .glif hash, as rows of flat arrays (points, point types, point
+names, contour ends, components, anchors, unicodes) with an offset array
+per kind, so a glyph is a few slices. Opening the pack maps the file and
+reads a small JSON index, and a glyph's arrays are views into the map
+which are only read when used.
+
+Updating hashes the .glifs by mtime and size like check_compatibility.py,
+parses only the .glifs whose hash isn't in the pack yet, one process per
+ufo, and copies the others from the old pack. A ufo's kerning, groups
+and info are reread when one of its plists changed.
+
+Usage:
+    cd sources
+    python3 source_cache.py
+    python3 source_cache.py --ufo 1A-drawings/Mains/RobotoFlex_wght400.ufo --glyphs a Aacute
+
+    from source_cache import update_cache
+    pack = update_cache()
+    glyph = pack.master("1A-drawings/Mains/RobotoFlex_wght400.ufo")["a"]
+    glyph.width, glyph.points, glyph.components(), glyph.anchors()
+    glyph.draw(point_pen)
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fontTools.ufoLib.errors import GlifLibError
+from fontTools.ufoLib.glifLib import readGlyphFromString
+from build_designspace import SRC_DIR, scan_ufos
+from glyph_hashes import hash_file, hash_glifs, stamp
+import argparse
+import json
+import mmap
+import os
+import plistlib
+import struct
+import time
+import numpy as np
+
+
+PACK_PATH = os.path.join(".cache", "sources.pack")
+
+STAMPS_PATH = os.path.join(".cache", "sources.json")
+
+MAGIC = b"RFSRCPK1"
+
+HEADER = "<8sQ"
+
+ALIGN = 64
+
+FONT_FILES = ["fontinfo.plist", "groups.plist", "kerning.plist"]
+
+SEGMENT_TYPES = [None, "line", "curve", "qcurve", "move"]
+
+SEGMENT_CODES = {t: i for i, t in enumerate(SEGMENT_TYPES)}
+
+SMOOTH = 0x80
+
+# Arrays with a row range per glyph, indexed by <kind>_offsets
+KINDS = {
+    "points": [("points", np.float64, (2,)), ("point_types", np.uint8, ())],
+    "point_names": [("point_name_indices", np.int32, ()), ("point_name_ids", np.int32, ())],
+    "contours": [("contour_ends", np.int32, ())],
+    "components": [("component_bases", np.int32, ()), ("component_transforms", np.float64, (6,))],
+    "anchors": [("anchor_names", np.int32, ()), ("anchor_points", np.float64, (2,))],
+    "unicodes": [("unicodes", np.int32, ())],
+}
+
+# Arrays of names, interned into the pack's names
+NAME_ARRAYS = ["point_name_ids", "component_bases", "anchor_names"]
+
+
+class _Glyph:
+    width = 0
+    height = 0
+    unicodes = ()
+    anchors = ()
+
+
+class _Pen:
+    """Point pen recording into the pack's row format"""
+
+    def __init__(self):
+        self.points, self.types, self.ends = [], [], []
+        self.name_indices, self.names = [], []
+        self.bases, self.transforms = [], []
+
+    def beginPath(self, identifier=None, **kwargs):
+        pass
+
+    def endPath(self):
+        self.ends.append(len(self.points))
+
+    def addPoint(self, pt, segmentType=None, smooth=False, name=None, identifier=None, **kwargs):
+        if name is not None:
+            self.name_indices.append(len(self.points))
+            self.names.append(name)
+        self.points.append(pt)
+        self.types.append(SEGMENT_CODES[segmentType] | (SMOOTH if smooth else 0))
+
+    def addComponent(self, baseGlyphName, transformation, identifier=None, **kwargs):
+        self.bases.append(baseGlyphName)
+        self.transforms.append(tuple(transformation))
+
+
+def parse_glif(data):
+    """Get a glyph's rows as {array name: list} and its metrics, the way
+    they are packed, except names being strings"""
+    glyph = _Glyph()
+    pen = _Pen()
+    readGlyphFromString(data, glyph, pen, validate=False)
+    return {
+        "metrics": (glyph.width, glyph.height),
+        "points": pen.points,
+        "point_types": pen.types,
+        "point_name_indices": pen.name_indices,
+        "point_name_ids": pen.names,
+        "contour_ends": pen.ends,
+        "component_bases": pen.bases,
+        "component_transforms": pen.transforms,
+        "anchor_names": [a.get("name", "") for a in glyph.anchors],
+        "anchor_points": [(a["x"], a["y"]) for a in glyph.anchors],
+        "unicodes": list(glyph.unicodes),
+    }
+
+
+def read_glifs(paths):
+    """Parse .glif files, returning their rows in the same order"""
+    res = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            res.append(parse_glif(data))
+        except GlifLibError as e:
+            raise GlifLibError(f"{path}: {e}") from e
+    return res
+
+
+def read_plist(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return plistlib.load(f)
+
+
+def read_font_data(ufo_path):
+    """Get the font info, groups and flat kerning of a ufo"""
+    kerning = read_plist(os.path.join(ufo_path, "kerning.plist"))
+    return {
+        "info": read_plist(os.path.join(ufo_path, "fontinfo.plist")),
+        "groups": read_plist(os.path.join(ufo_path, "groups.plist")),
+        "kerning": [(l, r, v) for l, rights in kerning.items() for r, v in rights.items()],
+    }
+
+
+def align(n):
+    return -(-n // ALIGN) * ALIGN
+
+
+class Glyph:
+    """A glyph of one master, its arrays being views into the pack"""
+
+    def __init__(self, pack, name, record):
+        self.pack = pack
+        self.name = name
+        self.record = record
+
+    def _rows(self, kind, array):
+        offsets = self.pack.array(kind + "_offsets")
+        return self.pack.array(array)[offsets[self.record]:offsets[self.record + 1]]
+
+    @property
+    def sha(self):
+        return self.pack.array("shas")[self.record].tobytes().hex()
+
+    @property
+    def width(self):
+        return float(self.pack.array("metrics")[self.record, 0])
+
+    @property
+    def height(self):
+        return float(self.pack.array("metrics")[self.record, 1])
+
+    @property
+    def unicodes(self):
+        return self._rows("unicodes", "unicodes").tolist()
+
+    @property
+    def points(self):
+        """(points, 2) array of every contour point"""
+        return self._rows("points", "points")
+
+    @property
+    def point_types(self):
+        """Segment type codes, index SEGMENT_TYPES after masking out SMOOTH"""
+        return self._rows("points", "point_types")
+
+    @property
+    def contour_ends(self):
+        """Index after the last point of each contour"""
+        return self._rows("contours", "contour_ends")
+
+    def point_names(self):
+        """Get {point index: name} of the named points"""
+        names = self.pack.names
+        indices = self._rows("point_names", "point_name_indices").tolist()
+        ids = self._rows("point_names", "point_name_ids").tolist()
+        return {i: names[n] for i, n in zip(indices, ids)}
+
+    def contours(self):
+        """Get the (points, types) of each contour"""
+        starts = [0] + self.contour_ends[:-1].tolist()
+        points, types = self.points, self.point_types
+        return [(points[s:e], types[s:e]) for s, e in zip(starts, self.contour_ends.tolist())]
+
+    def components(self):
+        """Get (base, (xx, xy, yx, yy, dx, dy)) of each component"""
+        names = self.pack.names
+        bases = self._rows("components", "component_bases").tolist()
+        transforms = self._rows("components", "component_transforms").tolist()
+        return [(names[b], tuple(t)) for b, t in zip(bases, transforms)]
+
+    def anchors(self):
+        """Get (name, x, y) of each anchor"""
+        names = self.pack.names
+        anchor_names = self._rows("anchors", "anchor_names").tolist()
+        points = self._rows("anchors", "anchor_points").tolist()
+        return [(names[n], x, y) for n, (x, y) in zip(anchor_names, points)]
+
+    def draw(self, pen):
+        """Draw the glyph to a point pen"""
+        point_names = self.point_names()
+        index = 0
+        for points, types in self.contours():
+            pen.beginPath()
+            for (x, y), code in zip(points.tolist(), types.tolist()):
+                pen.addPoint(
+                    (x, y), SEGMENT_TYPES[code & ~SMOOTH], smooth=bool(code & SMOOTH), name=point_names.get(index)
+                )
+                index += 1
+            pen.endPath()
+        for base, transform in self.components():
+            pen.addComponent(base, transform)
+
+
+class Master:
+    """The glyphs, kerning, groups and info of one ufo of the pack"""
+
+    def __init__(self, pack, index, entry):
+        self.pack = pack
+        self.index = index
+        self.path = entry["path"]
+        self.info = entry["info"]
+        self._glyphs = None
+
+    def _array(self, name):
+        return self.pack.array(f"m{self.index}.{name}")
+
+    @property
+    def records(self):
+        """{glyph name: record}, in the ufo's contents.plist order"""
+        if self._glyphs is None:
+            names = self.pack.names
+            self._glyphs = dict(zip(
+                (names[i] for i in self._array("glyphs").tolist()),
+                self._array("records").tolist(),
+            ))
+        return self._glyphs
+
+    def keys(self):
+        return self.records.keys()
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, name):
+        return Glyph(self.pack, name, self.records[name])
+
+    @property
+    def groups(self):
+        """{group: [glyph names]}"""
+        names = self.pack.names
+        ends = self._array("group_ends").tolist()
+        members = self._array("group_members").tolist()
+        starts = [0] + ends[:-1]
+        return {
+            names[g]: [names[m] for m in members[s:e]]
+            for g, s, e in zip(self._array("group_names").tolist(), starts, ends)
+        }
+
+    @property
+    def kerning(self):
+        """{(left, right): value}, glyphs or groups on either side"""
+        names = self.pack.names
+        return {
+            (names[l], names[r]): v
+            for l, r, v in zip(
+                self._array("kern_left").tolist(),
+                self._array("kern_right").tolist(),
+                self._array("kern_values").tolist(),
+            )
+        }
+
+
+class SourceCache:
+    """A sources.pack, mapped read only. Use it in a with block, or
+    close() it, to unmap the file."""
+
+    def __init__(self, path=PACK_PATH):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, length = struct.unpack_from(HEADER, self._map)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} isn't a sources pack of this version")
+        start = struct.calcsize(HEADER)
+        self.index = json.loads(self._map[start:start + length])
+        self.data_start = align(start + length)
+        self.names = self.index["names"]
+        self._arrays = {}
+        self._masters = {entry["path"]: i for i, entry in enumerate(self.index["masters"])}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._arrays = {}
+        try:
+            self._map.close()
+        except BufferError:
+            pass  # arrays still in use keep the map open until they're freed
+        self._file.close()
+
+    def array(self, key):
+        """Get an array of the pack, a view into the map"""
+        if key not in self._arrays:
+            offset, dtype, shape = self.index["arrays"][key]
+            count = int(np.prod(shape))
+            self._arrays[key] = np.frombuffer(
+                self._map, dtype=dtype, count=count, offset=self.data_start + offset
+            ).reshape(shape)
+        return self._arrays[key]
+
+    @property
+    def masters(self):
+        return list(self._masters)
+
+    def master(self, path):
+        index = self._masters[path]
+        return Master(self, index, self.index["masters"][index])
+
+    def record_rows(self, record):
+        """Get the rows of a record the way parse_glif returns them"""
+        res = {"metrics": tuple(self.array("metrics")[record].tolist())}
+        for kind, arrays in KINDS.items():
+            offsets = self.array(kind + "_offsets")
+            start, end = offsets[record], offsets[record + 1]
+            for name, _, _ in arrays:
+                res[name] = self.array(name)[start:end].copy()
+        for name in NAME_ARRAYS:
+            res[name] = [self.names[i] for i in res[name].tolist()]
+        return res
+
+    def font_data(self, index):
+        """Get the info, groups and kerning of a master as read_font_data
+        returns them"""
+        master = self.master(self.masters[index])
+        return {
+            "info": master.info,
+            "groups": master.groups,
+            "kerning": [(l, r, v) for (l, r), v in master.kerning.items()],
+        }
+
+
+def write_pack(path, index, arrays):
+    """Write the index and arrays, each aligned to ALIGN bytes"""
+    layout = {}
+    offset = 0
+    for key, array in arrays.items():
+        offset = align(offset)
+        layout[key] = [offset, array.dtype.str, list(array.shape)]
+        offset += array.nbytes
+    index = dict(index, arrays=layout)
+    head = json.dumps(index, default=str).encode("utf-8")
+    data_start = align(struct.calcsize(HEADER) + len(head))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(struct.pack(HEADER, MAGIC, len(head)))
+        f.write(head)
+        for key, array in arrays.items():
+            f.seek(data_start + layout[key][0])
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(path + ".tmp", path)
+
+
+def pack_arrays(records, names):
+    """Concatenate the rows of each record into the pack's arrays"""
+    arrays = {
+        "shas": np.frombuffer(b"".join(bytes.fromhex(sha) for sha in records), dtype=np.uint8).reshape(-1, 20),
+        "metrics": np.array([r["metrics"] for r in records.values()], dtype=np.float64).reshape(-1, 2),
+    }
+    for kind, kind_arrays in KINDS.items():
+        sizes = [len(r[kind_arrays[0][0]]) for r in records.values()]
+        arrays[kind + "_offsets"] = np.cumsum([0] + sizes).astype(np.int64)
+        for name, dtype, shape in kind_arrays:
+            rows = []
+            for r in records.values():
+                values = r[name]
+                if name in NAME_ARRAYS:
+                    values = [names.setdefault(n, len(names)) for n in values]
+                rows.append(np.asarray(values, dtype=dtype).reshape((-1,) + shape))
+            arrays[name] = np.concatenate(rows) if rows else np.empty((0,) + shape, dtype=dtype)
+    return arrays
+
+
+def font_arrays(font, names):
+    """Intern the groups and kerning of a ufo into arrays"""
+    groups = font["groups"]
+    members = [names.setdefault(m, len(names)) for group in groups.values() for m in group]
+    return {
+        "group_names": np.array([names.setdefault(g, len(names)) for g in groups], dtype=np.int32),
+        "group_ends": np.cumsum([len(g) for g in groups.values()]).astype(np.int32),
+        "group_members": np.array(members, dtype=np.int32),
+        "kern_left": np.array([names.setdefault(l, len(names)) for l, _, _ in font["kerning"]], dtype=np.int32),
+        "kern_right": np.array([names.setdefault(r, len(names)) for _, r, _ in font["kerning"]], dtype=np.int32),
+        "kern_values": np.array([v for _, _, v in font["kerning"]], dtype=np.float64),
+    }
+
+
+def load_stamps(path=STAMPS_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as doc:
+        return json.load(doc)
+
+
+def save_stamps(stamps, path=STAMPS_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as doc:
+        doc.write(json.dumps(stamps))
+
+
+def font_stamps(ufo_path, known=None):
+    """Get {plist: [stamp, sha1]} of a ufo's plists, reusing the hashes in
+    known for files whose mtime and size are unchanged"""
+    known = known or {}
+    res = {}
+    for fn in FONT_FILES:
+        path = os.path.join(ufo_path, fn)
+        if not os.path.exists(path):
+            continue
+        st = stamp(path)
+        rec = known.get(fn)
+        res[fn] = rec if rec and rec[0] == st else [st, hash_file(path)]
+    return res
+
+
+def plist_hashes(font):
+    return {fn: rec[1] for fn, rec in font.items()}
+
+
+def contents(ufos, fonts):
+    """What the pack holds for the given hashes, without the stamps"""
+    return (
+        {p: [(n, rec[2]) for n, rec in ufo["glyphs"].items()] for p, ufo in ufos.items()},
+        {p: plist_hashes(font) for p, font in fonts.items()},
+    )
+
+
+def open_pack(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return SourceCache(path)
+    except ValueError:
+        return None
+
+
+def update_cache(ufo_paths=None, path=PACK_PATH, workers=None):
+    """Bring the pack up to date with the sources and open it. Only the
+    .glifs and plists which changed since the last update are read."""
+    ufo_paths = ufo_paths or list(scan_ufos(SRC_DIR))
+    stamps = load_stamps()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ufos = dict(zip(ufo_paths, pool.map(
+            lambda p: hash_glifs(p, stamps.get("ufos", {}).get(p)), ufo_paths
+        )))
+        fonts = dict(zip(ufo_paths, pool.map(
+            lambda p: font_stamps(p, stamps.get("fonts", {}).get(p)), ufo_paths
+        )))
+
+    old = open_pack(path)
+    if old and old.masters == ufo_paths and stamps.get("ufos") is not None:
+        if ufos == stamps["ufos"] and fonts == stamps["fonts"]:
+            return old
+        # Only the mtimes changed, e.g. after a checkout
+        if contents(ufos, fonts) == contents(stamps["ufos"], stamps["fonts"]):
+            save_stamps({"ufos": ufos, "fonts": fonts})
+            return old
+    old_records = {}
+    if old:
+        old_records = {sha.tobytes().hex(): i for i, sha in enumerate(old.array("shas"))}
+
+    todo = {}
+    for ufo_path, ufo in ufos.items():
+        for name, (glif_path, _, sha) in ufo["glyphs"].items():
+            if sha not in old_records:
+                todo.setdefault(sha, glif_path)
+    start = time.time()
+    parsed = {}
+    if todo:
+        by_ufo = {}
+        for sha, glif_path in todo.items():
+            by_ufo.setdefault(os.path.dirname(os.path.dirname(glif_path)), []).append((sha, glif_path))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(read_glifs, [[p for _, p in glifs] for glifs in by_ufo.values()])
+            for glifs, rows in zip(by_ufo.values(), results):
+                parsed.update(zip((sha for sha, _ in glifs), rows))
+
+    records = {}
+    for ufo in ufos.values():
+        for _, _, sha in ufo["glyphs"].values():
+            if sha not in records:
+                records[sha] = parsed[sha] if sha in parsed else old.record_rows(old_records[sha])
+
+    old_masters = {p: i for i, p in enumerate(old.masters)} if old else {}
+    old_fonts = stamps.get("fonts", {})
+    names = {}
+    record_ids = {sha: i for i, sha in enumerate(records)}
+    masters, arrays = [], pack_arrays(records, names)
+    reread = 0
+    for i, (ufo_path, ufo) in enumerate(ufos.items()):
+        if ufo_path in old_masters and plist_hashes(old_fonts.get(ufo_path, {})) == plist_hashes(fonts[ufo_path]):
+            font = old.font_data(old_masters[ufo_path])
+        else:
+            font = read_font_data(ufo_path)
+            reread += 1
+        masters.append({"path": ufo_path, "info": font["info"]})
+        glyph_names = list(ufo["glyphs"])
+        arrays[f"m{i}.glyphs"] = np.array([names.setdefault(n, len(names)) for n in glyph_names], dtype=np.int32)
+        arrays[f"m{i}.records"] = np.array([record_ids[ufo["glyphs"][n][2]] for n in glyph_names], dtype=np.int32)
+        for key, array in font_arrays(font, names).items():
+            arrays[f"m{i}.{key}"] = array
+
+    if old:
+        old.close()
+    write_pack(path, {"names": list(names), "masters": masters}, arrays)
+    save_stamps({"ufos": ufos, "fonts": fonts})
+    print(
+        f"Updated {path} in {time.time() - start:.1f}s: parsed {len(parsed)} of {len(records)} "
+        f".glifs, reread {reread} of {len(ufos)} ufos' plists, {os.path.getsize(path) / 1e6:.1f} MB"
+    )
+    return SourceCache(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update the packed cache of the ufo sources")
+    parser.add_argument("--ufo", help="ufo to print glyphs of")
+    parser.add_argument("--glyphs", nargs="+", default=[], help="glyphs to print")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    args = parser.parse_args()
+
+    start = time.time()
+    pack = update_cache(workers=args.workers)
+    print(f"Checked {len(pack.masters)} ufos in {time.time() - start:.2f}s")
+    pack.close()
+
+    start = time.time()
+    with SourceCache() as pack:
+        masters = [pack.master(p) for p in pack.masters]
+        opened = time.time() - start
+        points = sum(len(m[name].points) for m in masters for name in m)
+        kerning = sum(len(m.kerning) for m in masters)
+        print(
+            f"Opened in {opened * 1000:.1f}ms, read the {points} points of every glyph "
+            f"and {kerning} kerning pairs in {time.time() - start:.2f}s"
+        )
+        if args.ufo:
+            master = pack.master(args.ufo)
+            for name in args.glyphs:
+                glyph = master[name]
+                print(f"{name}: width {glyph.width:g}, {len(glyph.contour_ends)} contours, {len(glyph.points)} points")
+                for base, transform in glyph.components():
+                    print(f"    component {base} {transform}")
+                for anchor, x, y in glyph.anchors():
+                    print(f"    anchor {anchor} {x:g} {y:g}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+advance widths and side bearings of every glyph in every master
+
+Loads the width, left and right side bearing of each glyph of each
+designspace source into (glyphs x masters) numpy arrays, NaN where a
+sparse master lacks the glyph, so comparing masters is one array
+operation. Metrics are cached in .cache/spacing.json by the hash of the
+.glif and of the .glifs its components use, taken from the graph of
+component_graph.py, so only edited glyphs are redrawn.
+
+With no masters every master is compared to the default one. Otherwise
+the first master is the reference for the others. --write copies the
+reference widths into the other masters' .glifs, like tools/copyWidths.py
+does between two open fonts.
+
+Usage:
+    cd sources
+    python3 spacing_matrix.py
+    python3 spacing_matrix.py 1A-drawings/Mains/RobotoFlex_wght400.ufo 1A-drawings/Mains/RobotoFlex_GRAD150.ufo --margins
+    python3 spacing_matrix.py 1A-drawings/Mains/RobotoFlex_wght400.ufo 1A-drawings/Mains/RobotoFlex_GRAD*.ufo --write
+"""
+from concurrent.futures import ProcessPoolExecutor
+from fontTools.pens.boundsPen import BoundsPen
+from fontTools.pens.recordingPen import RecordingPen
+from fontTools.ufoLib.glifLib import GlyphSet
+from build_designspace import SRC_DIR, scan_ufos, build_designspace
+from component_graph import load_graph, nested_bases
+from glyph_hashes import hash_bytes
+import argparse
+import json
+import os
+import re
+import time
+import numpy as np
+
+
+CACHE_PATH = os.path.join(".cache", "spacing.json")
+
+METRICS = ["width", "lsb", "rsb"]
+
+ADVANCE_RE = re.compile(rb"<advance\b[^>]*?/>")
+
+WIDTH_RE = re.compile(rb'\swidth="[^"]*"')
+
+GLYPH_RE = re.compile(rb"<glyph\b[^>]*>")
+
+
+def metric_keys(graph, ufo_path):
+    """Get {glyph: key}, the key hashing the .glif and every .glif its
+    components use, since a composite's bounds change with its bases"""
+    glyphs = graph.ufos[ufo_path]["glyphs"]
+    bases = {name: graph.components[rec[2]] for name, rec in glyphs.items()}
+    closure = {}
+    keys = {}
+    for name, rec in glyphs.items():
+        nested = sorted(b for b in nested_bases(name, bases, closure) if b in glyphs)
+        if nested:
+            keys[name] = hash_bytes(" ".join([rec[2]] + [glyphs[b][2] for b in nested]).encode("utf-8"))
+        else:
+            keys[name] = rec[2]
+    return keys
+
+
+class RecordedGlyph(RecordingPen):
+
+    def draw(self, pen):
+        self.replay(pen)
+
+
+class ParsedGlyphs(dict):
+    """Parse each .glif of a layer once, however many composites use it.
+
+    glifLib glyphs reread their .glif on every draw, so each one is drawn
+    into a recording which composites replay.
+    """
+
+    def __init__(self, glyph_set):
+        self.glyph_set = glyph_set
+
+    def __missing__(self, name):
+        glyph = self.glyph_set[name]
+        recording = self[name] = RecordedGlyph()
+        glyph.draw(recording)
+        recording.width = getattr(glyph, "width", 0)
+        return recording
+
+
+def read_metrics(ufo_path, glyph_names):
+    """Draw the given glyphs of a ufo, returning [width, xMin, xMax] for
+    each, the bounds being None for empty glyphs"""
+    glyph_set = ParsedGlyphs(GlyphSet(os.path.join(ufo_path, "glyphs")))
+    res = []
+    for name in glyph_names:
+        glyph = glyph_set[name]
+        pen = BoundsPen(glyph_set)
+        glyph.draw(pen)
+        x_min, _, x_max, _ = pen.bounds or (None, None, None, None)
+        res.append([glyph.width, x_min, x_max])
+    return res
+
+
+def load_cache(path=CACHE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as doc:
+        return json.load(doc)
+
+
+def save_cache(cache, path=CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as doc:
+        doc.write(json.dumps(cache))
+
+
+def spacing_matrix(ufo_paths, workers=None):
+    """Get the glyph names and {metric: (glyphs x masters) array}"""
+    graph = load_graph(workers=workers)
+    cache = load_cache()
+    keys = {path: metric_keys(graph, path) for path in ufo_paths}
+
+    todo = {}
+    for path, glyph_keys in keys.items():
+        missing = [name for name, key in glyph_keys.items() if key not in cache]
+        if missing:
+            todo[path] = missing
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, metrics in zip(todo, pool.map(read_metrics, todo.keys(), todo.values())):
+                for name, m in zip(todo[path], metrics):
+                    cache[keys[path][name]] = m
+    used = {key for glyph_keys in keys.values() for key in glyph_keys.values()}
+    if todo or len(used) != len(cache):
+        cache = {key: m for key, m in cache.items() if key in used}
+        save_cache(cache)
+
+    glyph_names = sorted({name for glyph_keys in keys.values() for name in glyph_keys})
+    glyph_ids = {name: i for i, name in enumerate(glyph_names)}
+    raw = np.full((3, len(glyph_names), len(ufo_paths)), np.nan)
+    for j, path in enumerate(ufo_paths):
+        rows = [glyph_ids[name] for name in keys[path]]
+        raw[:, rows, j] = np.array(
+            [cache[key] for key in keys[path].values()], dtype=float
+        ).T
+    width, x_min, x_max = raw
+    return glyph_names, {"width": width, "lsb": x_min, "rsb": width - x_max}
+
+
+def diff_masters(arrays, reference, targets, metrics, tolerance=0):
+    """Get {metric: (glyph index, target index) pairs} differing from the
+    reference master by more than tolerance, where both have the glyph"""
+    res = {}
+    for metric in metrics:
+        array = arrays[metric]
+        delta = array[:, targets] - array[:, [reference]]
+        res[metric] = np.argwhere(np.abs(delta) > tolerance)
+    return res
+
+
+def format_number(value):
+    """Format a number the way ufoLib writes it to a .glif: integral values
+    as ints, others with every digit of their repr"""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def set_width(data, width):
+    """Set the advance width of raw .glif bytes"""
+    value = f' width="{format_number(width)}"'.encode("utf-8")
+    advance = ADVANCE_RE.search(data)
+    if advance is None:
+        glyph = GLYPH_RE.search(data)
+        indent = b"\n  "
+        return data[:glyph.end()] + indent + b"<advance" + value + b"/>" + data[glyph.end():]
+    tag = advance.group(0)
+    if WIDTH_RE.search(tag):
+        new_tag = WIDTH_RE.sub(lambda m: value, tag, count=1)
+    else:
+        new_tag = tag[:len(b"<advance")] + value + tag[len(b"<advance"):]
+    return data[:advance.start()] + new_tag + data[advance.end():]
+
+
+def write_widths(glif_paths, widths):
+    """Rewrite the advance of each .glif, leaving the rest of the file
+    untouched"""
+    for path, width in zip(glif_paths, widths):
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(set_width(data, width))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the spacing of masters")
+    parser.add_argument("masters", nargs="*", help="reference ufo then the ufos to compare, defaults to every source against the default")
+    parser.add_argument("--margins", action="store_true", help="compare side bearings too")
+    parser.add_argument("--tolerance", type=float, default=0, help="ignore differences up to this many units")
+    parser.add_argument("--write", action="store_true", help="copy the reference widths into the other masters")
+    parser.add_argument("-j", "--workers", type=int, help="number of worker processes")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.masters:
+        if len(args.masters) < 2:
+            parser.error("give a reference and at least one master to compare")
+        ufo_paths = [os.path.normpath(p) for p in args.masters]
+        unknown = set(ufo_paths) - set(scan_ufos(SRC_DIR, args.workers))
+        if unknown:
+            parser.error(f"not in {SRC_DIR}: {' '.join(sorted(unknown))}")
+        reference = 0
+    else:
+        ds = build_designspace(list(scan_ufos(SRC_DIR, args.workers)))
+        ufo_paths = [s.filename for s in ds.sources]
+        reference = ufo_paths.index(ds.findDefault().filename)
+    targets = [j for j in range(len(ufo_paths)) if j != reference]
+
+    glyph_names, arrays = spacing_matrix(ufo_paths, args.workers)
+    metrics = METRICS if args.margins else ["width"]
+    diffs = diff_masters(arrays, reference, targets, metrics, args.tolerance)
+
+    ref_path = ufo_paths[reference]
+    for metric, pairs in diffs.items():
+        for i, t in pairs:
+            j = targets[t]
+            print(f"{glyph_names[i]}: {metric} {arrays[metric][i, reference]:g} in {ref_path}, {arrays[metric][i, j]:g} in {ufo_paths[j]}")
+        print(f"{len(pairs)} {metric} differences")
+
+    if args.write:
+        graph = load_graph(workers=args.workers)
+        for t in sorted(set(diffs["width"][:, 1])):
+            j = targets[t]
+            rows = diffs["width"][diffs["width"][:, 1] == t, 0]
+            glyphs = graph.ufos[ufo_paths[j]]["glyphs"]
+            write_widths([glyphs[glyph_names[i]][0] for i in rows], arrays["width"][rows, reference])
+            print(f"Wrote {len(rows)} widths to {ufo_paths[j]}")
+    print(f"Compared {len(glyph_names)} glyphs in {len(ufo_paths)} masters in {time.time() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
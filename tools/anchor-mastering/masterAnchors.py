@@ -0,0 +1,230 @@
+"""
+run the anchor mastering scripts on many ufos, without a font editor
+
+Applies the same logic as 0-generateVietnameseCombs.py, 1-getYShifts.py
+and 2-copyAnchors.py to every target ufo, one process per ufo. The glyph
+lists are read from those scripts, so they stay the only place to edit
+them.
+
+Only glyphs whose .glif actually changes are written. With --dry-run
+nothing is written and the diff of every changed glyph is printed.
+
+Usage:
+    python3 tools/anchor-mastering/masterAnchors.py --steps combs,yshift,anchors \\
+        --source sources/1A-drawings/Trivars/RobotoFlex_opsz14_wght1000_wdth25.ufo \\
+        sources/1A-drawings/Mains/*.ufo --dry-run
+"""
+from fontParts.world import OpenFont
+from fontTools.ufoLib import plistlib
+from fontTools.ufoLib.glifLib import GlyphSet, writeGlyphToString
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import ast
+import difflib
+import os
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STEPS = ["combs", "yshift", "anchors"]
+
+
+def scriptLists(filename):
+    """Read the module level list and set literals of an editor script"""
+    with open(os.path.join(HERE, filename)) as f:
+        tree = ast.parse(f.read())
+    res = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, (ast.List, ast.Set)):
+            res[node.targets[0].id] = ast.literal_eval(node.value)
+    return res
+
+
+COMBS = scriptLists("0-generateVietnameseCombs.py")
+
+YSHIFTS = scriptLists("1-getYShifts.py")
+
+ANCHORS = scriptLists("2-copyAnchors.py")
+
+
+def generateVietnameseCombs(font):
+    """Same as 0-generateVietnameseCombs.py"""
+    for combs, prefix, suffix, anchorName, y in (
+        (COMBS["vietnamese"], "a", "comb", "_top", font.info.xHeight),
+        (COMBS["vietnameseCase"], "A", "comb.case", "top", font.info.capHeight),
+    ):
+        for comb in sorted(combs):
+            ref = (prefix + comb).replace(" ", "").replace(suffix, "")
+            # once the accented glyph is built from the comb, the comb
+            # can't be regenerated from it
+            if ref not in font or comb in [c.baseGlyph for c in font[ref].components]:
+                continue
+            glyph = font.newGlyph(comb, clear=True)
+            glyph.appendGlyph(font[ref])
+            glyph.width = 1024
+            glyph.appendAnchor(anchorName, (512, y))
+            glyph.decompose()
+            glyph.removeContour(0)
+            glyph.removeContour(0)
+
+
+def lookYShiftValues(font, accents):
+    """Same as in 1-getYShifts.py"""
+    shiftDict = {}
+    accentsToShiftDict = {}
+    for glyph in accents:
+        if glyph not in font or len(font[glyph].components) <= 1:
+            continue
+        char = font[glyph].name
+        accent = font[glyph].components[-1]
+        yShift = accent.offset[1]
+        if yShift in shiftDict.keys():
+            shiftDict[yShift] = shiftDict[yShift] + [char] + [accent.baseGlyph]
+            accentsToShiftDict[yShift] = [accent.baseGlyph] + shiftDict[yShift]
+        else:
+            shiftDict[yShift] = [char] + [accent.baseGlyph]
+    return accentsToShiftDict
+
+
+def shiftAccents(font):
+    """Same as 1-getYShifts.py"""
+    for shift, chars in lookYShiftValues(font, YSHIFTS["UCaccents"]).items():
+        if "stack" in str(chars[0]):
+            continue
+        font[chars[0]].moveBy((0.0, shift))
+
+    for shift, chars in lookYShiftValues(font, YSHIFTS["lcaccents"]).items():
+        if len(font[chars[0]].components) > 0:
+            strAccent = font[chars[0]].components[0].baseGlyph
+        else:
+            strAccent = font[chars[0]].name
+        font[strAccent].moveBy((0.0, shift))
+
+
+def copyAnchors(srcFont, dstFont, selectedGlyphs, yPositioning):
+    """Same as in 2-copyAnchors.py"""
+    yUC = dstFont.info.capHeight
+    for glyph in selectedGlyphs:
+        if glyph not in srcFont or glyph not in dstFont:
+            continue
+        srcGlyph = srcFont[glyph]
+        if not len(srcGlyph.anchors):
+            continue
+        dstGlyph = dstFont[glyph]
+        dstGlyph.clearAnchors()
+        for anchor in srcGlyph.anchors:
+            if anchor.name == 'top':
+                if 'comb' in dstGlyph.name:
+                    dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, abs(dstGlyph.topMargin)))
+                else:
+                    dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, yPositioning))
+            elif anchor.name == '_top' or anchor.name == '_GRK_top':
+                dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, yPositioning))
+            elif anchor.name == 'bottom':
+                if 'comb' in dstGlyph.name:
+                    dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, dstGlyph.bottomMargin))
+                else:
+                    dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, anchor.y))
+            elif anchor.name == '_bottom':
+                dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, anchor.y))
+            elif anchor.name == 'center':
+                dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, yUC / 2))
+            elif anchor.name == 'ogonek':
+                dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width - dstGlyph.rightMargin - 10), anchor.y))
+            elif anchor.name == '_ogonek':
+                dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width) / 2, anchor.y))
+            elif anchor.name == 'topright':
+                dstGlyph.appendAnchor(anchor.name, ((dstGlyph.width - dstGlyph.rightMargin), yPositioning))
+            elif anchor.name == '_topright':
+                dstGlyph.appendAnchor(anchor.name, ((dstGlyph.leftMargin / 2), yPositioning))
+            else:
+                dstGlyph.appendAnchor(anchor.name, ((anchor.x) * 2, anchor.y))
+
+
+def copyAllAnchors(srcFont, dstFont):
+    """Same as 2-copyAnchors.py"""
+    copyAnchors(srcFont, dstFont, ANCHORS["selectedGlyphsUC"], dstFont.info.capHeight)
+    copyAnchors(srcFont, dstFont, ANCHORS["selectedGlyphslc"], dstFont.info.xHeight)
+    copyAnchors(srcFont, dstFont, ANCHORS["selectedGlyphsAccentsUC"], dstFont.info.capHeight)
+    copyAnchors(srcFont, dstFont, ANCHORS["selectedGlyphsAccentslc"], dstFont.info.xHeight)
+
+
+def glifString(glyph):
+    glyph = glyph.naked()
+    return writeGlyphToString(glyph.name, glyph, glyph.drawPoints, formatVersion=2)
+
+
+def processFont(path, steps, sourcePath=None, dryRun=False):
+    """Run the steps on one ufo, returning the diffs of the changed glyphs"""
+    font = OpenFont(path, showInterface=False)
+    before = {glyph.name: glifString(glyph) for glyph in font}
+    if "combs" in steps:
+        generateVietnameseCombs(font)
+    if "yshift" in steps:
+        shiftAccents(font)
+    if "anchors" in steps:
+        copyAllAnchors(OpenFont(sourcePath, showInterface=False), font)
+
+    changed = {}
+    diffs = []
+    for name in sorted(font.keys()):
+        glyph = font[name]
+        after = glifString(glyph)
+        old = before.get(glyph.name, "")
+        if after != old:
+            changed[glyph.name] = glyph
+            diffs.append("".join(difflib.unified_diff(
+                old.splitlines(True), after.splitlines(True),
+                f"{path}/{glyph.name}", f"{path}/{glyph.name}",
+            )))
+    if changed and not dryRun:
+        glyphSet = GlyphSet(os.path.join(path, "glyphs"), ufoFormatVersion=3)
+        for name, glyph in changed.items():
+            naked = glyph.naked()
+            glyphSet.writeGlyph(name, naked, naked.drawPoints, formatVersion=2)
+        glyphSet.writeContents()
+        added = [name for name in changed if name not in before]
+        if added:
+            libPath = os.path.join(path, "lib.plist")
+            with open(libPath, "rb") as f:
+                lib = plistlib.load(f)
+            lib["public.glyphOrder"] = lib.get("public.glyphOrder", []) + added
+            with open(libPath, "wb") as f:
+                plistlib.dump(lib, f)
+    return path, sorted(changed), diffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the anchor mastering scripts on many ufos")
+    parser.add_argument("fonts", nargs="+", help="target ufos")
+    parser.add_argument("--steps", required=True, help="comma separated scripts to run, always in this order: combs (0), yshift (1), anchors (2)")
+    parser.add_argument("--source", help="ufo to copy the anchors from, needed by the anchors step")
+    parser.add_argument("--dry-run", action="store_true", help="print the diff of each changed glyph instead of saving")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes")
+    args = parser.parse_args()
+    args.steps = args.steps.split(",")
+    unknown = set(args.steps) - set(STEPS)
+    if unknown:
+        parser.error(f"unknown steps: {' '.join(sorted(unknown))}")
+    if "anchors" in args.steps and not args.source:
+        parser.error("the anchors step needs --source")
+
+    fonts = [os.path.normpath(f) for f in args.fonts]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = pool.map(
+            processFont,
+            fonts,
+            [args.steps] * len(fonts),
+            [args.source] * len(fonts),
+            [args.dry_run] * len(fonts),
+        )
+        for path, changed, diffs in results:
+            if args.dry_run:
+                for diff in diffs:
+                    print(diff, end="")
+            verb = "Would change" if args.dry_run else "Changed"
+            print(f"{verb} {len(changed)} glyphs in {path}: {' '.join(changed)}")
+
+
+if __name__ == "__main__":
+    main()
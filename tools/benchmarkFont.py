@@ -0,0 +1,205 @@
+"""
+benchmark shaping and rasterizing the variable font across its axes
+
+Shapes a sample text with HarfBuzz and renders its glyphs with FreeType
+at a grid of locations: every combination of the min, default and max of
+wght, wdth, opsz, GRAD and slnt, plus each parametric axis at its min and
+max. Each measurement is the best of several sweeps of the grid, to keep
+noise out.
+
+Results are written as json named after the font's hash, so the results
+of two builds can be compared with --compare, which lists the locations
+that got slower than --threshold and exits with an error if any did.
+
+Usage:
+    python3 tools/benchmarkFont.py
+    python3 tools/benchmarkFont.py --compare out/benchmark/1f2e3d4c5b6a.json
+"""
+from fontTools.ttLib import TTFont
+from makeInstances import find_variable_font, format_value
+import argparse
+import freetype
+import hashlib
+import itertools
+import json
+import os
+import statistics
+import time
+import uharfbuzz as hb
+
+
+REGISTERED_AXES = ["wght", "wdth", "opsz", "GRAD", "slnt"]
+
+SAMPLE_TEXT = (
+    "The quick brown fox jumps over the lazy dog. Sphinx of black quartz, judge my vow! "
+    "HAMBURGEFONSTIV hamburgefonstiv 0123456789 $12.50 ¢99 ₩100 ₡7 ₦3 "
+    "Ångström, façade, naïve café, Đà Nẵng, Œuvre, Straße, Łódź, Ţară. "
+    "«Quotes» “and” ‘punctuation’ — (brackets) [100%] {#@&*}"
+)
+
+
+def sample_locations(axes):
+    """Get the {tag: value} locations to measure, the grid of the
+    registered axes then the parametric axes one at a time"""
+    defaults = {a.axisTag: a.defaultValue for a in axes}
+    registered = [a for a in axes if a.axisTag in REGISTERED_AXES]
+    values = [sorted({a.minValue, a.defaultValue, a.maxValue}) for a in registered]
+    locations = []
+    for combo in itertools.product(*values):
+        location = dict(defaults)
+        location.update(zip((a.axisTag for a in registered), combo))
+        locations.append(location)
+    for axis in axes:
+        if axis.axisTag in REGISTERED_AXES:
+            continue
+        for value in (axis.minValue, axis.maxValue):
+            location = dict(defaults)
+            location[axis.axisTag] = value
+            locations.append(location)
+    return locations
+
+
+def location_name(location, defaults):
+    """{wght: 700, wdth: 100...} --> wght700, only the non default axes"""
+    name = "-".join(
+        f"{tag}{format_value(v)}" for tag, v in location.items() if v != defaults[tag]
+    )
+    return name or "default"
+
+
+def shape(font, text):
+    buf = hb.Buffer()
+    buf.add_str(text)
+    buf.guess_segment_properties()
+    hb.shape(font, buf, {})
+    return buf
+
+
+def bench_shaping(font, text, min_time):
+    """Get the throughput in glyphs/s of shaping the text for at least
+    min_time seconds"""
+    glyph_count = len(shape(font, text).glyph_infos)
+    rounds = 0
+    start = time.perf_counter()
+    while True:
+        shape(font, text)
+        rounds += 1
+        seconds = time.perf_counter() - start
+        if seconds >= min_time:
+            return glyph_count * rounds / seconds
+
+
+def bench_raster(face, gids, min_time):
+    """Get the time per glyph in microseconds of rendering the glyphs for
+    at least min_time seconds"""
+    rendered = 0
+    start = time.perf_counter()
+    while True:
+        for gid in gids:
+            face.load_glyph(gid, freetype.FT_LOAD_RENDER)
+        rendered += len(gids)
+        seconds = time.perf_counter() - start
+        if seconds >= min_time:
+            return seconds / rendered * 1e6
+
+
+def run(font_path, text, size, min_time, repeat):
+    """Measure every location repeat times, keeping the best of each.
+
+    The whole grid is swept once per repeat, rather than each location
+    measured repeatedly in a row, so a moment of load on the machine
+    only spoils one of the measurements of a few locations.
+    """
+    with open(font_path, "rb") as f:
+        data = f.read()
+    axes = TTFont(font_path, lazy=True)["fvar"].axes
+    defaults = {a.axisTag: a.defaultValue for a in axes}
+    locations = sample_locations(axes)
+
+    hb_font = hb.Font(hb.Face(hb.Blob(data)))
+    ft_face = freetype.Face(font_path)
+    ft_face.set_char_size(size * 64)
+    gids = sorted({info.codepoint for info in shape(hb_font, text).glyph_infos})
+
+    shaping = [0] * len(locations)
+    raster = [float("inf")] * len(locations)
+    for _ in range(repeat):
+        for i, location in enumerate(locations):
+            hb_font.set_variations(location)
+            ft_face.set_var_design_coords([location[a.axisTag] for a in axes])
+            shaping[i] = max(shaping[i], bench_shaping(hb_font, text, min_time))
+            raster[i] = min(raster[i], bench_raster(ft_face, gids, min_time))
+
+    results = []
+    for location, glyphs_per_s, us_per_glyph in zip(locations, shaping, raster):
+        name = location_name(location, defaults)
+        results.append({
+            "location": name,
+            "shape_glyphs_per_s": round(glyphs_per_s),
+            "raster_us_per_glyph": round(us_per_glyph, 3),
+        })
+        print(f"{name:40} {glyphs_per_s:12.0f} glyphs/s {us_per_glyph:9.2f} us/glyph")
+    return {
+        "font": font_path,
+        "sha1": hashlib.sha1(data).hexdigest(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {"text": text, "size": size, "min_time": min_time, "repeat": repeat},
+        "summary": {
+            "shape_glyphs_per_s": round(statistics.median(shaping)),
+            "raster_us_per_glyph": round(statistics.median(raster), 3),
+        },
+        "locations": results,
+    }
+
+
+def compare(base, new, threshold):
+    """Print the locations slower in new than in base by more than
+    threshold, returning how many there are"""
+    base_locations = {r["location"]: r for r in base["locations"]}
+    slower = 0
+    for r in new["locations"]:
+        old = base_locations.get(r["location"])
+        if old is None:
+            continue
+        shaping = old["shape_glyphs_per_s"] / r["shape_glyphs_per_s"] - 1
+        raster = r["raster_us_per_glyph"] / old["raster_us_per_glyph"] - 1
+        if shaping > threshold or raster > threshold:
+            print(f"Slower at {r['location']}: shaping {shaping:+.1%}, rasterizing {raster:+.1%}")
+            slower += 1
+    for key in ("shape_glyphs_per_s", "raster_us_per_glyph"):
+        print(f"Median {key}: {base['summary'][key]} -> {new['summary'][key]}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark shaping and rasterizing the variable font")
+    parser.add_argument("-f", "--font", help="variable font, defaults to the one in fonts/")
+    parser.add_argument("-o", "--out", default=os.path.join("out", "benchmark"), help="output directory")
+    parser.add_argument("--text", default=SAMPLE_TEXT, help="text to shape and render")
+    parser.add_argument("--size", type=int, default=16, help="rendering size in pixels per em")
+    parser.add_argument("--min-time", type=float, default=0.02, help="seconds each run lasts at least")
+    parser.add_argument("--repeat", type=int, default=5, help="sweeps of the grid, the best measurement is kept")
+    parser.add_argument("--compare", metavar="JSON", help="results of an earlier build to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown to report, 0.1 is 10%%")
+    args = parser.parse_args()
+
+    font_path = args.font or find_variable_font()
+    if not font_path:
+        parser.error("no variable font in fonts/, run make build first")
+    start = time.time()
+    results = run(font_path, args.text, args.size, args.min_time, args.repeat)
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, results["sha1"][:12] + ".json")
+    with open(out_path, "w") as doc:
+        json.dump(results, doc, indent=2, ensure_ascii=False)
+    print(f"Benchmarked {len(results['locations'])} locations in {time.time() - start:.1f}s, saved {out_path}")
+
+    if args.compare:
+        with open(args.compare) as doc:
+            slower = compare(json.load(doc), results, args.threshold)
+        if slower:
+            raise SystemExit(f"{slower} locations got slower than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,12 +16,10 @@ f2k = set(f2.keys())
 
 print ( '=====' )
 print ( 'SPACING DIFF:' )
-gnames = f1.keys() + f2.keys()
+# for every master at once, without an editor: sources/spacing_matrix.py
+gnames = f1k & f2k
 for gname in sorted(gnames):
     results = []
-    if not gname in f1 or not gname in f2:
-        #print '\t\t - %s not present in both fonts.' % gname
-        continue
     if f1[gname].width != f2[gname].width:
         results.append('setwidth difference: %s, %s' % (f1[gname].width, f2[gname].width))
         f2[gname].width = f1[gname].width
@@ -0,0 +1,140 @@
+"""
+make static instances of the variable font
+
+Takes a list and/or a grid of locations and writes one static font per
+location, named the same way as updateNameIDs.py names a hand made
+instance (nameIDs 1, 2, 4, 6, 16 and 17), with the OS/2 weight and width
+classes of its wght and wdth.
+
+Every worker process mmaps the variable font read-only and opens it
+lazily, so they all share the same pages of the page cache and only
+copy out the tables the instancer needs.
+
+Usage:
+    python3 tools/makeInstances.py wght400-wdth100-opsz14-GRAD0 wght700-wdth25
+    python3 tools/makeInstances.py --grid wght=100,400,1000 wdth=25,100,151 opsz=8,14,144
+    python3 tools/makeInstances.py --file locations.txt -o fonts/instances
+"""
+from fontTools.misc.fixedTools import otRound
+from fontTools.ttLib import TTFont
+from fontTools.varLib.instancer import instantiateVariableFont
+from fontTools.varLib.models import piecewiseLinearMap
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from updateNameIDs import FAMILY_NAME, location_names, rename
+import argparse
+import itertools
+import mmap
+import os
+import re
+import time
+
+
+LOCATION_RE = re.compile(r"([A-Za-z]{4})(-?\d+(?:\.\d+)?)")
+
+# wdth percentages of the OS/2 usWidthClass values 1 to 9
+WIDTH_CLASSES = {50: 1, 62.5: 2, 75: 3, 87.5: 4, 100: 5, 112.5: 6, 125: 7, 150: 8, 200: 9}
+
+_font_file = None
+
+
+def find_variable_font(fonts_dir="fonts"):
+    """Get the RobotoFlex[axes].ttf built by make build"""
+    paths = glob(os.path.join(fonts_dir, "**", "RobotoFlex*.ttf"), recursive=True)
+    paths = sorted(p for p in paths if "[" in os.path.basename(p))
+    return paths[0] if paths else None
+
+
+def parse_location(s):
+    """wght700-wdth25 --> {wght: 700, wdth: 25}"""
+    return {tag: float(v) for tag, v in LOCATION_RE.findall(s)}
+
+
+def format_value(v):
+    return str(int(v)) if float(v).is_integer() else str(v)
+
+
+def grid_locations(axes):
+    """["wght=100,400", "wdth=25,100"] --> wght100-wdth25, wght100-wdth100..."""
+    values = []
+    for axis in axes:
+        tag, vals = axis.split("=")
+        values.append([f"{tag}{format_value(float(v))}" for v in vals.split(",")])
+    return ["-".join(combo) for combo in itertools.product(*values)]
+
+
+def set_classes(font, location):
+    """Set the OS/2 weight and width classes of an instance at location"""
+    os2 = font["OS/2"]
+    os2.usWeightClass = otRound(max(1, min(location["wght"], 1000)))
+    os2.usWidthClass = otRound(piecewiseLinearMap(max(50, min(location["wdth"], 200)), WIDTH_CLASSES))
+
+
+def open_font(path):
+    """Map the variable font into this worker's memory"""
+    global _font_file
+    with open(path, "rb") as f:
+        _font_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def make_instance(location, defaults, out_path):
+    start = time.time()
+    _font_file.seek(0)
+    # Lazily, so only the tables the instancer reads are copied out of the
+    # shared map instead of the whole file
+    font = TTFont(_font_file, lazy=True)
+    limits = dict(defaults)
+    limits.update(parse_location(location))
+    instantiateVariableFont(font, limits, inplace=True)
+    set_classes(font, limits)
+    rename(font["name"], location_names(location))
+    # A lazy font checks its reader's file name before saving to a path,
+    # which the map doesn't have
+    with open(out_path, "wb") as f:
+        font.save(f)
+    return out_path, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Make static instances of the variable font")
+    parser.add_argument("locations", nargs="*", help="e.g. wght400-wdth100-opsz14-GRAD0, missing axes are at default")
+    parser.add_argument("--grid", nargs="+", metavar="TAG=V1,V2", help="make every combination of these axis values")
+    parser.add_argument("--file", help="text file with one location per line")
+    parser.add_argument("-f", "--font", help="variable font, defaults to the one in fonts/")
+    parser.add_argument("-o", "--out", default=os.path.join("fonts", "instances"), help="output directory")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes, defaults to the number of cpus")
+    args = parser.parse_args()
+
+    locations = list(args.locations)
+    if args.file:
+        with open(args.file) as f:
+            locations += [l.strip() for l in f if l.strip()]
+    if args.grid:
+        locations += grid_locations(args.grid)
+    if not locations:
+        parser.error("no locations given")
+
+    font_path = args.font or find_variable_font()
+    if not font_path:
+        parser.error("no variable font in fonts/, run make build first")
+    fvar = TTFont(font_path, lazy=True)["fvar"]
+    defaults = {a.axisTag: a.defaultValue for a in fvar.axes}
+    unknown = {tag for l in locations for tag in parse_location(l)} - set(defaults)
+    if unknown:
+        parser.error(f"unknown axes: {' '.join(sorted(unknown))}")
+
+    os.makedirs(args.out, exist_ok=True)
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=open_font, initargs=(font_path,)) as pool:
+        futures = [
+            pool.submit(make_instance, l, defaults, os.path.join(args.out, f"{FAMILY_NAME}-{l}.ttf"))
+            for l in locations
+        ]
+        for future in as_completed(futures):
+            path, seconds = future.result()
+            print(f"{seconds:5.1f}s  {path}")
+    print(f"Made {len(locations)} instances of {font_path} in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
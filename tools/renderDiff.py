@@ -0,0 +1,232 @@
+"""
+find the glyphs which render differently in two builds of the font
+
+Rasterizes every glyph of both variable fonts with FreeType at a set of
+locations and compares hashes of the bitmaps, so only glyphs whose
+pixels changed are reported. For each location with changes a sheet of
+the old, new and differing pixels of those glyphs is written.
+
+Renders are cached in .cache/renders by the hash of the font, the size
+and the location: a hash per glyph in a .json, the bitmaps in a .npz.
+The new build of one comparison is the old build of the next, so usually
+only one font is rendered. Missing renders are made in parallel, one
+process per font and location.
+
+Usage:
+    python3 tools/renderDiff.py old/RobotoFlex[...].ttf
+    python3 tools/renderDiff.py old.ttf wght1000-wdth25 --size 128 -f new.ttf
+    python3 tools/renderDiff.py old.ttf --grid wght=100,1000 opsz=8,144 -o out/render-diff
+"""
+from fontTools.ttLib import TTFont
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from makeInstances import find_variable_font, format_value, grid_locations, parse_location
+from PIL import Image, ImageDraw
+import argparse
+import freetype
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+
+CACHE_DIR = os.path.join(".cache", "renders")
+
+DEFAULT_LOCATIONS = [
+    "wght400", "wght100", "wght1000", "wdth25", "wdth151", "opsz8", "opsz144",
+]
+
+LABEL_WIDTH = 160
+
+
+def font_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def location_key(location, defaults):
+    """wdth25-wght700 and wght700-wdth25-GRAD0 --> wght700-wdth25, the
+    non default axes in fvar order, so both share a cache entry"""
+    coords = parse_location(location)
+    name = "-".join(
+        f"{tag}{format_value(coords[tag])}"
+        for tag in defaults if tag in coords and coords[tag] != defaults[tag]
+    )
+    return name or "default"
+
+
+def cache_paths(sha, size, key):
+    base = os.path.join(CACHE_DIR, sha[:16], str(size), key)
+    return base + ".json", base + ".npz"
+
+
+def render(font_path, location, defaults, size):
+    """Get {glyph: hash} and {glyph: (left, top, bitmap)} of every glyph
+    at location, rendered at size pixels per em"""
+    glyph_order = TTFont(font_path, lazy=True).getGlyphOrder()
+    face = freetype.Face(font_path)
+    face.set_char_size(size * 64)
+    coords = dict(defaults)
+    coords.update(parse_location(location))
+    face.set_var_design_coords(list(coords.values()))
+    hashes, bitmaps = {}, {}
+    for gid, name in enumerate(glyph_order):
+        face.load_glyph(gid, freetype.FT_LOAD_RENDER | freetype.FT_LOAD_NO_HINTING)
+        slot = face.glyph
+        bitmap = slot.bitmap
+        pixels = np.array(bitmap.buffer, dtype=np.uint8).reshape(bitmap.rows, bitmap.width)
+        left, top = slot.bitmap_left, slot.bitmap_top
+        hashes[name] = hashlib.sha1(
+            f"{left} {top} {slot.advance.x} {pixels.shape}".encode("utf-8") + pixels.tobytes()
+        ).hexdigest()[:16]
+        bitmaps[name] = (left, top, pixels)
+    return hashes, bitmaps
+
+
+def cache_renders(font_path, sha, location, defaults, size):
+    """Render a font at a location into the cache"""
+    start = time.time()
+    hashes, bitmaps = render(font_path, location, defaults, size)
+    json_path, npz_path = cache_paths(sha, size, location_key(location, defaults))
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+    arrays = {}
+    for i, (left, top, pixels) in enumerate(bitmaps.values()):
+        arrays[f"{i}"] = pixels
+        arrays[f"{i}.origin"] = np.array([left, top])
+    # Written to a file object, a path would get .npz appended
+    with open(npz_path + ".tmp", "wb") as doc:
+        np.savez_compressed(doc, **arrays)
+    os.replace(npz_path + ".tmp", npz_path)
+    with open(json_path + ".tmp", "w") as doc:
+        json.dump(hashes, doc)
+    os.replace(json_path + ".tmp", json_path)
+    return font_path, location, time.time() - start
+
+
+def load_hashes(sha, size, key):
+    with open(cache_paths(sha, size, key)[0]) as doc:
+        return json.load(doc)
+
+
+def load_bitmaps(sha, size, key, glyphs):
+    """Get {glyph: (left, top, bitmap)} of the given glyphs from the cache"""
+    json_path, npz_path = cache_paths(sha, size, key)
+    ids = {name: i for i, name in enumerate(load_hashes(sha, size, key))}
+    with np.load(npz_path) as arrays:
+        res = {}
+        for name in glyphs:
+            left, top = arrays[f"{ids[name]}.origin"]
+            res[name] = (left, top, arrays[f"{ids[name]}"])
+        return res
+
+
+def place(bitmaps, size):
+    """Draw (left, top, bitmap)s on canvases of the same size, aligned
+    on their origin"""
+    left = min(b[0] for b in bitmaps)
+    top = max(b[1] for b in bitmaps)
+    width = max(max(b[0] + b[2].shape[1] for b in bitmaps) - left, size // 4)
+    height = max(max(b[2].shape[0] + top - b[1] for b in bitmaps), size // 4)
+    res = []
+    for x, y, pixels in bitmaps:
+        canvas = np.zeros((height, width), dtype=np.uint8)
+        canvas[top - y:top - y + pixels.shape[0], x - left:x - left + pixels.shape[1]] = pixels
+        res.append(canvas)
+    return res
+
+
+def diff_sheet(old, new, glyphs, size):
+    """Get a grayscale image with a row per glyph: old, new, the pixels
+    that differ and the glyph name"""
+    rows = []
+    for name in glyphs:
+        a, b = place([old[name], new[name]], size)
+        diff = np.abs(a.astype(np.int16) - b.astype(np.int16)).astype(np.uint8)
+        gap = np.zeros((a.shape[0], size // 8), dtype=np.uint8)
+        rows.append(np.hstack([a, gap, b, gap, diff, gap]))
+    width = max(r.shape[1] for r in rows)
+    margin = np.zeros((size // 8, width), dtype=np.uint8)
+    sheet, tops = [], []
+    y = 0
+    for row in rows:
+        sheet += [np.pad(row, ((0, 0), (0, width - row.shape[1]))), margin]
+        tops.append(y)
+        y += row.shape[0] + margin.shape[0]
+    image = Image.new("L", (width + LABEL_WIDTH, y), 255)
+    image.paste(Image.fromarray(255 - np.vstack(sheet)), (0, 0))
+    draw = ImageDraw.Draw(image)
+    for name, top in zip(glyphs, tops):
+        draw.text((width, top), name, fill=0)
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the glyphs which render differently in two builds")
+    parser.add_argument("old", help="variable font of the earlier build")
+    parser.add_argument("locations", nargs="*", help=f"e.g. wght700-wdth25, defaults to {' '.join(DEFAULT_LOCATIONS)}")
+    parser.add_argument("--grid", nargs="+", metavar="TAG=V1,V2", help="compare every combination of these axis values")
+    parser.add_argument("-f", "--font", help="variable font of the new build, defaults to the one in fonts/")
+    parser.add_argument("--size", type=int, default=64, help="rendering size in pixels per em")
+    parser.add_argument("-o", "--out", default=os.path.join("out", "render-diff"), help="directory of the diff sheets")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes, defaults to the number of cpus")
+    args = parser.parse_intermixed_args()
+
+    new_path = args.font or find_variable_font()
+    if not new_path:
+        parser.error("no variable font in fonts/, run make build first")
+    locations = list(args.locations)
+    if args.grid:
+        locations += grid_locations(args.grid)
+    locations = locations or DEFAULT_LOCATIONS
+
+    start = time.time()
+    fonts = {}
+    for path in (args.old, new_path):
+        fvar = TTFont(path, lazy=True)["fvar"]
+        defaults = {a.axisTag: a.defaultValue for a in fvar.axes}
+        unknown = {tag for l in locations for tag in parse_location(l)} - set(defaults)
+        if unknown:
+            parser.error(f"unknown axes in {path}: {' '.join(sorted(unknown))}")
+        fonts[path] = (font_hash(path), defaults)
+
+    # Renders are keyed by sha, so two copies of a font are rendered once
+    renders = {}
+    for path, (sha, defaults) in fonts.items():
+        for location in locations:
+            renders.setdefault((sha, location_key(location, defaults)), (path, sha, location, defaults))
+    todo = [task for (sha, key), task in renders.items() if not os.path.exists(cache_paths(sha, args.size, key)[0])]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(cache_renders, *task, args.size) for task in todo]
+        for future in as_completed(futures):
+            path, location, seconds = future.result()
+            print(f"{seconds:5.1f}s  rendered {path} at {location}")
+    print(f"Rendered {len(todo)} and reused {len(renders) - len(todo)} font locations")
+
+    (old_sha, old_defaults), (new_sha, new_defaults) = fonts[args.old], fonts[new_path]
+    changed = {}
+    for location in locations:
+        old_key, new_key = location_key(location, old_defaults), location_key(location, new_defaults)
+        old, new = load_hashes(old_sha, args.size, old_key), load_hashes(new_sha, args.size, new_key)
+        glyphs = [name for name in new if name in old and old[name] != new[name]]
+        for name in sorted(set(old) ^ set(new)):
+            print(f"{name}: only in {args.old if name in old else new_path}")
+        if not glyphs:
+            continue
+        for name in glyphs:
+            changed.setdefault(name, []).append(new_key)
+        sheet = diff_sheet(
+            load_bitmaps(old_sha, args.size, old_key, glyphs),
+            load_bitmaps(new_sha, args.size, new_key, glyphs),
+            glyphs,
+            args.size,
+        )
+        os.makedirs(args.out, exist_ok=True)
+        sheet.save(os.path.join(args.out, f"{new_key}.png"))
+
+    for name, keys in changed.items():
+        print(f"{name}: {' '.join(keys)}")
+    print(f"{len(changed)} glyphs changed at {len({k for keys in changed.values() for k in keys})} of {len(locations)} locations in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+run fontbakery check-googlefonts in shards, reusing the results of
+unchanged fonts
+
+The results of each check are cached in .cache/fontbakery by the
+fontbakery version, the check id and the sha1 of the font they are about,
+or of all the fonts for the family checks. Only the checks with a result
+missing are run, split into shards which are separate fontbakery
+processes running in parallel. fontbakery selects checks by substring,
+so a shard excludes the checks whose ids contain one of its own. Cached
+and new results are merged in profile order into the document
+fontbakery's JSON reporter would have written, and rendered by its own
+reporters, so the JSON, HTML, Markdown and badges are the same as those
+of a single run.
+
+Checks which ERROR are reported but not cached, they are often network
+hiccups or missing tools. A check which doesn't look at the fonts, e.g.
+the latest fontbakery version, is cached like the others, --rerun
+ignores the cache.
+
+Like fontbakery, exits with 1 if a check FAILed or ERRORed.
+
+Usage:
+    python3 tools/runFontbakery.py fonts/ttf/*.ttf
+    python3 tools/runFontbakery.py -l WARN --succinct --html out/fontbakery/fontbakery-report.html --badges out/badges fonts/ttf/*.ttf
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fontbakery import __version__ as FONTBAKERY_VERSION
+from fontbakery.checkrunner import DEBUG, PASS, SKIP, INFO, WARN, FAIL, ERROR
+from fontbakery.profiles.googlefonts import profile
+from fontbakery.reporters.badge import BadgeReporter
+from fontbakery.reporters.ghmarkdown import GHMarkdownReporter
+from fontbakery.reporters.html import HTMLReporter
+from fontbakery.reporters.serialize import SerializeReporter
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+
+CACHE_DIR = os.path.join(".cache", "fontbakery")
+
+LOG_LEVELS = {s.name: s for s in (DEBUG, PASS, SKIP, INFO, WARN, FAIL, ERROR)}
+
+CHECK_ID = re.compile(r"<FontBakeryCheck:(.*)>")
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def profile_check_ids():
+    """Get the ids of the googlefonts checks, in the order fontbakery
+    runs them"""
+    return [check.id for section in profile._sections.values() for check in section._checks]
+
+
+def load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as doc:
+        return json.load(doc)
+
+
+def save_cache(path, results):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as doc:
+        json.dump(results, doc)
+    os.replace(path + ".tmp", path)
+
+
+def is_cached(check_id, shas, family_sha, results):
+    """A check is cached when every font has its results, and the family
+    too unless it gave results per font"""
+    per_font = [results.get(f"{sha}:{check_id}") for sha in shas]
+    if any(r is None for r in per_font):
+        return False
+    return f"{family_sha}:{check_id}" in results or any(per_font)
+
+
+def font_index(entry):
+    """Get the index of the font a check result is about, None for a
+    family check"""
+    return dict(entry["key"][2]).get("font")
+
+
+def cache_results(doc, check_ids, shas, family_sha, results):
+    """Add the results of a shard's JSON report to the cache. Returns the
+    keys of the checks which ERRORed, which shouldn't be saved."""
+    errored = set()
+    by_check = {}
+    for section in doc["sections"]:
+        for entry in section["checks"]:
+            by_check.setdefault(CHECK_ID.match(entry["key"][1])[1], []).append(entry)
+    for check_id in check_ids:
+        entries = by_check.get(check_id, [])
+        keys = [f"{sha}:{check_id}" for sha in shas + [family_sha]]
+        if any(e["result"] == ERROR.name for e in entries):
+            errored.update(keys)
+        per_font = [[] for _ in shas]
+        family = []
+        for entry in entries:
+            index = font_index(entry)
+            (family if index is None else per_font[index]).append(entry)
+        for key, font_entries in zip(keys, per_font):
+            results[key] = font_entries
+        if family or not any(per_font):
+            results[keys[-1]] = family
+    return errored
+
+
+def excluded_checks(check_ids, all_check_ids):
+    """Get the checks -c would select besides check_ids, as it matches
+    substrings, which no check of check_ids contains"""
+    return [
+        other for other in all_check_ids
+        if other not in check_ids
+        and any(c in other for c in check_ids)
+        and not any(other in c for c in check_ids)
+    ]
+
+
+def run_shard(check_ids, fonts, all_check_ids):
+    """Run fontbakery on the fonts with only the given checks, returning
+    its JSON report"""
+    start = time.time()
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, "report.json")
+        command = ["fontbakery", "check-googlefonts", "-n", "-C", "-l", "ERROR", "--json", report]
+        for check_id in check_ids:
+            command += ["-c", check_id]
+        for check_id in excluded_checks(check_ids, all_check_ids):
+            command += ["-x", check_id]
+        subprocess.run(command + fonts, stdout=subprocess.DEVNULL)
+        if not os.path.exists(report):
+            raise RuntimeError(f"fontbakery didn't write a report for {' '.join(check_ids)}")
+        with open(report) as doc:
+            return check_ids, json.load(doc), time.time() - start
+
+
+def merged_doc(check_ids, fonts, shas, family_sha, results):
+    """Build the document fontbakery's SerializeReporter would have, from
+    the cached results of every check"""
+    sections = {}
+    for check_id in check_ids:
+        entries = list(results.get(f"{family_sha}:{check_id}", []))
+        for index, (font, sha) in enumerate(zip(fonts, shas)):
+            for entry in results.get(f"{sha}:{check_id}", []):
+                section, check, _ = entry["key"]
+                entries.append(dict(entry, key=[section, check, [["font", index]]], filename=font))
+        for entry in entries:
+            section = sections.setdefault(entry["key"][0], {"key": [entry["key"][0], None, []], "checks": []})
+            section["checks"].append(entry)
+    for section in sections.values():
+        section["result"] = Counter(e["result"] for e in section["checks"])
+    return {
+        "result": sum((s["result"] for s in sections.values()), Counter()),
+        "sections": list(sections.values()),
+    }
+
+
+class MergedDoc(SerializeReporter):
+    """Mixed in after one of fontbakery's reporters, makes getdoc() return
+    the merged doc instead of the results of a run"""
+    merged_doc = None
+
+    def getdoc(self):
+        return self.merged_doc
+
+
+def write_report(reporter_class, doc, loglevels, output_file):
+    """Write doc with one of fontbakery's reporters, as if it had run"""
+    reporter = type(reporter_class.__name__, (reporter_class, MergedDoc), {})(loglevels=loglevels, output_file=output_file)
+    reporter.merged_doc = doc
+    reporter.write()
+
+
+def write_json(doc, output_file):
+    """Write doc the way fontbakery's JSON reporter does"""
+    with open(output_file, "w") as fh:
+        json.dump(doc, fh, sort_keys=True, indent=4)
+    print(f'A report in JSON format has been saved to "{output_file}"')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fontbakery check-googlefonts in parallel, reusing cached results")
+    parser.add_argument("fonts", nargs="+", help="fonts to check")
+    parser.add_argument("-l", "--loglevel", dest="loglevels", action="append", choices=LOG_LEVELS, help="report checks with a result of this status or higher, defaults to WARN")
+    parser.add_argument("--succinct", action="store_true", help="only list the reported checks, without their messages")
+    parser.add_argument("--json", help="write a JSON report to this file")
+    parser.add_argument("--html", help="write an HTML report to this file")
+    parser.add_argument("--ghmarkdown", help="write a GitHub Markdown report to this file")
+    parser.add_argument("--badges", help="write shields.io badges to this directory")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of fontbakery processes, defaults to the number of cpus")
+    parser.add_argument("--shards", type=int, help="number of shards to split the checks into, defaults to twice the jobs")
+    parser.add_argument("--rerun", action="store_true", help="ignore the cached results")
+    args = parser.parse_args()
+
+    start = time.time()
+    loglevels = [min(LOG_LEVELS[l] for l in args.loglevels or ["WARN"])]
+    cache_path = os.path.join(CACHE_DIR, f"fontbakery-{FONTBAKERY_VERSION}.json")
+    results = {} if args.rerun else load_cache(cache_path)
+    shas = [file_hash(font) for font in args.fonts]
+    family_sha = hashlib.sha1(" ".join(shas).encode("utf-8")).hexdigest()
+
+    check_ids = profile_check_ids()
+    todo = [c for c in check_ids if not is_cached(c, shas, family_sha, results)]
+    count = args.shards or 2 * args.jobs
+    shards = [todo[i::count] for i in range(count)]
+    errored = set()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_shard, shard, args.fonts, check_ids) for shard in shards if shard]
+        for future in as_completed(futures):
+            shard, doc, seconds = future.result()
+            errored |= cache_results(doc, shard, shas, family_sha, results)
+            print(f"{seconds:6.1f}s  ran {len(shard)} checks")
+    # Only keep the results of these fonts, older ones won't be asked for again
+    keys = {f"{sha}:{c}" for sha in shas + [family_sha] for c in check_ids} - errored
+    save_cache(cache_path, {k: v for k, v in results.items() if k in keys})
+    print(f"Ran {len(todo)} and reused {len(check_ids) - len(todo)} of {len(check_ids)} checks on {len(args.fonts)} fonts in {time.time() - start:.1f}s")
+
+    doc = merged_doc(check_ids, args.fonts, shas, family_sha, results)
+    for section in doc["sections"]:
+        for entry in section["checks"]:
+            if LOG_LEVELS[entry["result"]] >= loglevels[0]:
+                font = os.path.basename(entry.get("filename", "family"))
+                print(f"{entry['result']:5}  {CHECK_ID.match(entry['key'][1])[1]}  {font}")
+                if not args.succinct:
+                    for log in entry["logs"]:
+                        if LOG_LEVELS[log["status"]] >= loglevels[0]:
+                            print(f"       {log['status']}: {log['message']}")
+    print(" ".join(f"{status}: {doc['result'][status]}" for status in LOG_LEVELS if status != "DEBUG"))
+
+    if args.json:
+        write_json(doc, args.json)
+    for reporter_class, output_file in ((HTMLReporter, args.html), (GHMarkdownReporter, args.ghmarkdown), (BadgeReporter, args.badges)):
+        if output_file:
+            write_report(reporter_class, doc, loglevels, output_file)
+    return 1 if doc["result"][FAIL.name] or doc["result"][ERROR.name] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,11 +1,30 @@
 from __future__ import print_function, division, unicode_literals
-import glob, json, io, re, os, sys
+import glob, json, io, re, os, sys, hashlib
 from fontTools.ttLib import TTFont
 from datetime import datetime, timedelta
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fontTools import subset
+from fontTools.varLib.instancer import instantiateVariableFont
+from fontTools.ttLib.sfnt import SFNTReader
+# the build trace, see sources/build_trace.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'sources'))
+from build_trace import span
 
 infiles = "fonts/*.?tf"
 outdir = "videoproof/fonts"
+flavors = ["woff", "woff2"]
+# input font hash -> outputs, so identical fonts are never recompressed
+cachefile = ".cache/webfonts.json"
+# trimmed woff2 for pages that only need some scripts and axes, written
+# as <font>-<name>.woff2. Axes given a [min, max] are limited to that
+# range, a number pins the axis and any other axis is pinned at default.
+subsets = OrderedDict([
+    ('latin', {
+        'unicodes': 'U+0000-00FF,U+0131,U+0152-0153,U+02BB-02BC,U+02C6,U+02DA,U+02DC,U+0304,U+0308,U+0329,U+2000-206F,U+2074,U+20AC,U+2122,U+2191,U+2193,U+2212,U+2215,U+FEFF,U+FFFD',
+        'axes': {'wght': [100, 1000], 'wdth': [25, 151], 'opsz': [8, 144]},
+    }),
+])
 fileAxes = {}
 
 def getName(ttf, nameid):
@@ -34,27 +53,178 @@ def getVarAxes(ttf):
                 })
     return axes
 
-for fontfile in glob.glob(infiles):
-    fontfilebase = os.path.basename(fontfile)[:-4]
-    outbase = os.path.join(outdir, fontfilebase)
+def fileHash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
 
-    ttf = TTFont(fontfile, recalcBBoxes=False)
+def loadCache():
+    if not os.path.exists(cachefile):
+        return {}
+    with io.open(cachefile, 'r', encoding='utf-8') as f:
+        return json.load(f)
 
-    #list axes
-    fileAxes[fontfilebase] = getVarAxes(ttf)
+def saveCache(cache):
+    os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+    with io.open(cachefile, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
 
+def subsetFont(ttf, settings):
+    options = subset.Options()
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.name_languages = ['*']
+    options.notdef_outline = True
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=subset.parse_unicodes(settings['unicodes']))
+    subsetter.subset(ttf)
+    if 'fvar' in ttf:
+        limits = {a.axisTag: None for a in ttf['fvar'].axes}
+        for tag, value in settings['axes'].items():
+            if tag in limits:
+                limits[tag] = tuple(value) if isinstance(value, list) else value
+        instantiateVariableFont(ttf, limits, inplace=True)
+
+def packFont(fontfile, outfile, flavor, settings=None):
+    # lazy: only tables we touch get decompiled, the rest is copied raw.
+    # Subsetting rewrites most tables anyway.
+    lazy = True if settings is None else None
+    ttf = TTFont(fontfile, recalcBBoxes=False, recalcTimestamp=False, lazy=lazy)
     if 'DSIG' in ttf:
         del(ttf['DSIG'])
+    axes = None
+    name = os.path.basename(outfile)
+    if settings is not None:
+        with span('subset web font', font=name):
+            subsetFont(ttf, settings)
+            axes = getVarAxes(ttf)
+    ttf.flavor = flavor
+    with span('compress web font', font=name, flavor=flavor):
+        data = io.BytesIO()
+        ttf.save(data)
+    with span('write web font', font=name):
+        with open(outfile, 'wb') as f:
+            f.write(data.getvalue())
+    return {'sha1': fileHash(outfile), 'size': os.path.getsize(outfile), 'tables': tableOffsets(outfile), 'axes': axes}
+
+def tableOffsets(path):
+    # [offset, length] of each table in the file, for range requests.
+    # woff2 tables live in one brotli stream, so they have none.
+    with open(path, 'rb') as f:
+        reader = SFNTReader(f)
+        if reader.flavor == 'woff2':
+            return None
+        return OrderedDict((tag, [e.offset, e.length]) for tag, e in sorted(reader.tables.items(), key=lambda t: t[1].offset))
+
+def manifestEntry(fontfilebase, flavor, output):
+    return OrderedDict([
+        ('font', fontfilebase),
+        ('flavor', flavor),
+        ('size', output['size']),
+        ('sha1', output['sha1']),
+        ('axes', output['axes'] if output['axes'] is not None else fileAxes[fontfilebase]),
+        ('tables', output['tables']),
+    ])
+
+class ManifestWriter(object):
+    """Writes manifest.json and the one line per entry manifest.jsonl in
+    the order the entries were reserved, flushing each entry as soon as
+    its font and the ones before it are done"""
+
+    def __init__(self, outdir):
+        self.pretty = io.open(os.path.join(outdir, 'manifest.json'), 'w', encoding='utf-8')
+        self.lines = io.open(os.path.join(outdir, 'manifest.jsonl'), 'w', encoding='utf-8')
+        self.pretty.write('{')
+        self.count = 0
+        self.reserved = 0
+        self.pending = {}
+
+    def reserve(self):
+        self.reserved += 1
+        return self.reserved - 1
+
+    def add(self, slot, filename, entry):
+        self.pending[slot] = (filename, entry)
+        while self.count in self.pending:
+            self.write(*self.pending.pop(self.count))
+
+    def write(self, filename, entry):
+        entry = OrderedDict([('file', filename)] + list(entry.items()))
+        self.pretty.write((',' if self.count else '') + '\n  ' + json.dumps(filename) + ': ')
+        self.pretty.write(json.dumps(entry, indent=2, ensure_ascii=False).replace('\n', '\n  '))
+        self.lines.write(json.dumps(entry, separators=(',', ':'), ensure_ascii=False) + '\n')
+        self.pretty.flush()
+        self.lines.flush()
+        self.count += 1
+
+    def close(self):
+        self.pretty.write('\n}\n')
+        self.pretty.close()
+        self.lines.close()
+
+def settingsHash(settings):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+if __name__ == '__main__':
+    os.makedirs(outdir, exist_ok=True)
+    cache = loadCache()
+    newCache = {}
+    jobs = []
+    manifest = ManifestWriter(outdir)
+    for fontfile in sorted(glob.glob(infiles)):
+        fontfilebase = os.path.basename(fontfile)[:-4]
+        outbase = os.path.join(outdir, fontfilebase)
+        srchash = fileHash(fontfile)
+        cached = cache.get(fontfilebase, {})
+
+        if cached.get('sha1') == srchash:
+            fileAxes[fontfilebase] = cached['axes']
+        else:
+            #list axes, lazily reading only fvar, STAT and name
+            ttf = TTFont(fontfile, lazy=True)
+            fileAxes[fontfilebase] = getVarAxes(ttf)
+            ttf.close()
+            cached = {}
+        newCache[fontfilebase] = {'sha1': srchash, 'axes': fileAxes[fontfilebase], 'outputs': {}}
+
+        outputs = [(flavor, outbase + "." + flavor, flavor, None) for flavor in flavors]
+        for name, settings in subsets.items():
+            fileAxes[fontfilebase + "-" + name] = None
+            key = name + ".woff2@" + settingsHash(settings)
+            outputs.append((key, outbase + "-" + name + ".woff2", "woff2", settings))
+
+        for key, outfile, flavor, settings in outputs:
+            output = cached.get('outputs', {}).get(key)
+            if output and 'tables' in output and os.path.exists(outfile) and fileHash(outfile) == output['sha1']:
+                print("Unchanged", outfile)
+                newCache[fontfilebase]['outputs'][key] = output
+                if settings is not None:
+                    fileAxes[os.path.basename(outfile)[:-6]] = output['axes']
+                manifest.add(manifest.reserve(), os.path.basename(outfile), manifestEntry(fontfilebase, flavor, output))
+            else:
+                jobs.append((manifest.reserve(), fontfilebase, key, (fontfile, outfile, flavor, settings)))
 
-    wofffile = outbase + ".woff"
-    ttf.flavor = 'woff'
-    ttf.save(wofffile)
+    # the 13 axis variable font dominates, so each output is its own job
+    with ProcessPoolExecutor() as pool:
+        futures = {pool.submit(packFont, *args): (slot, base, key, args) for slot, base, key, args in jobs}
+        for future in as_completed(futures):
+            slot, fontfilebase, key, (fontfile, outfile, flavor, settings) = futures[future]
+            output = future.result()
+            print("Saved", outfile)
+            newCache[fontfilebase]['outputs'][key] = output
+            if settings is not None:
+                fileAxes[os.path.basename(outfile)[:-6]] = output['axes']
+            manifest.add(slot, os.path.basename(outfile), manifestEntry(fontfilebase, flavor, output))
+    manifest.close()
+    saveCache(newCache)
 
-#using binary here because json.dumps returns raw bytes
-with io.open(os.path.join(outdir, 'axes.json'), 'wb') as axesfile:
-    jsonbytes = json.dumps(fileAxes, indent=2, ensure_ascii=False)
-    if not isinstance(jsonbytes, bytes):
-        jsonbytes = jsonbytes.encode('utf-8')
-    axesfile.write(jsonbytes)
+    #using binary here because json.dumps returns raw bytes
+    with span('write axes'):
+        with io.open(os.path.join(outdir, 'axes.json'), 'wb') as axesfile:
+            jsonbytes = json.dumps(fileAxes, indent=2, ensure_ascii=False)
+            if not isinstance(jsonbytes, bytes):
+                jsonbytes = jsonbytes.encode('utf-8')
+            axesfile.write(jsonbytes)
+        with io.open(os.path.join(outdir, 'axes.min.json'), 'wb') as axesfile:
+            axesfile.write(json.dumps(fileAxes, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
 
-sys.exit(0)
+    sys.exit(0)
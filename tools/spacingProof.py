@@ -0,0 +1,213 @@
+"""
+spacing proofs of the variable font, without DrawBot
+
+Builds the strings of docs/proof-RobotoFlex/printSpacing.py from the
+font's cmap instead of a hand kept list: every character between control
+letters, HH for capitals, figures, marks and symbols, nn, αηιμυ or нн for
+lowercase Latin, Greek or Cyrillic. The strings are shaped with HarfBuzz,
+laid out in lines and pages and drawn with Skia, one multi-page PDF per
+location. Locations are taken like tools/makeInstances.py takes them and
+are proofed in parallel, one process each.
+
+Usage:
+    python3 tools/spacingProof.py
+    python3 tools/spacingProof.py wght700-wdth25 wght100-opsz144 --size 36
+    python3 tools/spacingProof.py --grid wght=100,400,1000 wdth=25,100,151 opsz=8,14,144 -o out/proof/spacing
+"""
+from fontTools.ttLib import TTFont
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from makeInstances import find_variable_font, grid_locations, parse_location
+from updateNameIDs import FAMILY_NAME
+import argparse
+import os
+import time
+import unicodedata
+import skia
+import uharfbuzz as hb
+
+
+DEFAULT_LOCATION = "wght400-wdth100-opsz14"
+
+PAGE_SIZE = (18 * 72, 12 * 72)  # the 18x12 inch sheets of docs/proof-RobotoFlex
+
+MARGIN = 54
+
+CONTROLS = {
+    "LATIN": "nn",
+    "GREEK": "αηιμυ",
+    "CYRILLIC": "нн",
+}
+
+UPPER_CONTROL = "HH"
+
+SKIPPED_CATEGORIES = {"Cc", "Cf", "Co", "Cs", "Zs", "Zl", "Zp"}
+
+
+def spacing_strings(font):
+    """Get the control strings of every character of the font, in glyph
+    order: HH!HH HH#HH... nnann nnbnn..."""
+    cmap = font.getBestCmap()
+    chars = {chr(c) for c in cmap}
+    unicodes = {}
+    for codepoint, glyph in sorted(cmap.items()):
+        unicodes.setdefault(glyph, codepoint)
+    res = []
+    for glyph in font.getGlyphOrder():
+        if glyph not in unicodes:
+            continue
+        char = chr(unicodes[glyph])
+        if unicodedata.category(char) in SKIPPED_CATEGORIES:
+            continue
+        control = UPPER_CONTROL
+        if unicodedata.category(char) == "Ll":
+            script = unicodedata.name(char, "").split(" ")[0]
+            control = CONTROLS.get(script, control)
+        if not set(control) <= chars:
+            control = UPPER_CONTROL
+        res.append(control + char + control)
+    return res
+
+
+def tag_to_int(tag):
+    return int.from_bytes(tag.encode("ascii"), "big")
+
+
+def skia_font(typeface, location, size):
+    """Get a skia font of the typeface at a {tag: value} location"""
+    coordinate = skia.FontArguments.VariationPosition.Coordinate
+    coords = skia.FontArguments.VariationPosition.Coordinates(
+        [coordinate(tag_to_int(tag), value) for tag, value in location.items()]
+    )
+    args = skia.FontArguments()
+    args.setVariationDesignPosition(skia.FontArguments.VariationPosition(coords))
+    font = skia.Font(typeface.makeClone(args), size)
+    font.setHinting(skia.FontHinting.kNone)
+    font.setSubpixel(True)
+    return font
+
+
+def shape(hb_font, text, scale):
+    """Get the glyph ids, (x, y) offsets and advance of a string at
+    scale"""
+    buf = hb.Buffer()
+    buf.add_str(text)
+    buf.guess_segment_properties()
+    hb.shape(hb_font, buf, {})
+    gids, offsets = [], []
+    x = 0
+    for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+        gids.append(info.codepoint)
+        offsets.append((x + pos.x_offset * scale, -pos.y_offset * scale))
+        x += pos.x_advance * scale
+    return gids, offsets, x
+
+
+def layout(words, space, line_width, lines_per_page):
+    """Break shaped words into pages of lines of (word, x) that fit
+    line_width"""
+    pages, lines, line = [], [], []
+    x = 0
+    for word in words:
+        advance = word[2]
+        if line and x + advance > line_width:
+            lines.append(line)
+            line, x = [], 0
+            if len(lines) == lines_per_page:
+                pages.append(lines)
+                lines = []
+        line.append((word, x))
+        x += advance + space
+    if line:
+        lines.append(line)
+    if lines:
+        pages.append(lines)
+    return pages
+
+
+def draw_line(canvas, font, line, y, paint):
+    gids, positions = [], []
+    for (word_gids, offsets, _), x in line:
+        gids += word_gids
+        positions += [(MARGIN + x + dx, y + dy) for dx, dy in offsets]
+    builder = skia.TextBlobBuilder()
+    builder.allocRunPos(font, gids, positions)
+    canvas.drawTextBlob(builder.make(), 0, 0, paint)
+
+
+def make_proof(font_path, location, defaults, size, out_path):
+    """Write the spacing proof PDF of one location"""
+    start = time.time()
+    with open(font_path, "rb") as f:
+        data = f.read()
+    font = TTFont(font_path, lazy=True)
+    coords = dict(defaults)
+    coords.update(parse_location(location))
+
+    hb_font = hb.Font(hb.Face(hb.Blob(data)))
+    hb_font.set_variations(coords)
+    scale = size / font["head"].unitsPerEm
+    words = [shape(hb_font, s, scale) for s in spacing_strings(font)]
+    space = shape(hb_font, " ", scale)[2]
+
+    typeface = skia.Typeface.MakeFromData(skia.Data.MakeWithCopy(data))
+    text_font = skia_font(typeface, coords, size)
+    caption_font = skia_font(typeface, defaults, 10)
+    width, height = PAGE_SIZE
+    leading = size * 1.6
+    top = MARGIN + 24 + size
+    lines_per_page = int((height - top - MARGIN) // leading) + 1
+    pages = layout(words, space, width - 2 * MARGIN, lines_per_page)
+
+    paint = skia.Paint(AntiAlias=True, Color=skia.ColorBLACK)
+    caption = f"{FAMILY_NAME} {location} at {size:g}pt, {font_path}"
+    stream = skia.FILEWStream(out_path)
+    with skia.PDF.MakeDocument(stream, Title=f"{FAMILY_NAME} spacing {location}") as document:
+        for number, lines in enumerate(pages, 1):
+            with document.page(width, height) as canvas:
+                canvas.drawString(f"{caption}, page {number}/{len(pages)}", MARGIN, MARGIN, caption_font, paint)
+                for i, line in enumerate(lines):
+                    draw_line(canvas, text_font, line, top + i * leading, paint)
+    stream.flush()
+    return out_path, len(pages), time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Make spacing proofs of the variable font")
+    parser.add_argument("locations", nargs="*", help=f"e.g. wght700-wdth25, missing axes are at default, defaults to {DEFAULT_LOCATION}")
+    parser.add_argument("--grid", nargs="+", metavar="TAG=V1,V2", help="proof every combination of these axis values")
+    parser.add_argument("-f", "--font", help="variable font, defaults to the one in fonts/")
+    parser.add_argument("-o", "--out", default=os.path.join("out", "proof", "spacing"), help="output directory")
+    parser.add_argument("--size", type=float, default=24, help="font size in points")
+    parser.add_argument("-j", "--jobs", type=int, help="number of worker processes, defaults to the number of cpus")
+    args = parser.parse_args()
+
+    locations = list(args.locations)
+    if args.grid:
+        locations += grid_locations(args.grid)
+    if not locations:
+        locations = [DEFAULT_LOCATION]
+
+    font_path = args.font or find_variable_font()
+    if not font_path:
+        parser.error("no variable font in fonts/, run make build first")
+    fvar = TTFont(font_path, lazy=True)["fvar"]
+    defaults = {a.axisTag: a.defaultValue for a in fvar.axes}
+    unknown = {tag for l in locations for tag in parse_location(l)} - set(defaults)
+    if unknown:
+        parser.error(f"unknown axes: {' '.join(sorted(unknown))}")
+
+    os.makedirs(args.out, exist_ok=True)
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [
+            pool.submit(make_proof, font_path, l, defaults, args.size, os.path.join(args.out, f"{FAMILY_NAME}-{l}-spacing.pdf"))
+            for l in locations
+        ]
+        for future in as_completed(futures):
+            path, pages, seconds = future.result()
+            print(f"{seconds:5.1f}s  {path} ({pages} pages)")
+    print(f"Proofed {len(locations)} locations of {font_path} in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
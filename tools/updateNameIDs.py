@@ -1,29 +1,134 @@
+"""
+rename a static instance after its location
+
+Sets nameIDs 1, 2, 4, 6, 16 and 17 from a location such as
+wght400-wdth100-opsz14-GRAD0, either in a .ttx dump (written to out.xml)
+or directly in the binary of one or more .ttf files. The binary mode
+only decompiles the name table; every other table is copied as is and
+only the name checksum and head.checkSumAdjustment are recomputed.
+
+Usage:
+    python3 tools/updateNameIDs.py -l wght400-wdth100-opsz14-GRAD0 -p wght400-wdth100-opsz14-GRAD0.ttx
+    python3 tools/updateNameIDs.py --ttf fonts/instances/*.ttf
+    python3 tools/updateNameIDs.py --ttf a.ttf b.ttf -l wght700 wght900-wdth25
+"""
 import xml.etree.ElementTree as ET
+from fontTools.ttLib import newTable
+from fontTools.ttLib.sfnt import calcChecksum
 import argparse
+import os
+import struct
+import time
+
+
+FAMILY_NAME = "RobotoFlex"
+
+DEFAULT_LOCATION = "wght400-wdth100-opsz14-GRAD0"
+
+SFNT_VERSIONS = (b"\x00\x01\x00\x00", b"true", b"OTTO")
+
+
+def location_names(location):
+    """Get the {nameID: string} of an instance at location"""
+    return {
+        1: f"{FAMILY_NAME} {location}",
+        2: location,
+        4: f"{FAMILY_NAME} {location}",
+        6: f"{FAMILY_NAME}-{location}",
+        16: FAMILY_NAME,
+        17: location,
+    }
+
+
+def location_from_path(path):
+    """RobotoFlex-wght700-wdth25.ttf --> wght700-wdth25"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem.split("-", 1)[1] if stem.startswith(FAMILY_NAME + "-") else stem
+
+
+def rename(name_table, names):
+    """Replace the strings of every record with these nameIDs"""
+    for record in name_table.names:
+        if record.nameID in names:
+            record.string = names[record.nameID]
+    for name_id, string in names.items():
+        if not name_table.getName(name_id, 3, 1, 0x409):
+            name_table.setName(string, name_id, 3, 1, 0x409)
+
+
+def update_ttx(ttx_path, location, out_path="out.xml"):
+    tree = ET.parse(str(ttx_path))
+    for name_id, string in location_names(location).items():
+        for namerecord in tree.findall(f'.*/namerecord[@nameID="{name_id}"]'):
+            print (namerecord)
+            namerecord.text = string
+    tree.write(out_path, encoding="UTF-8", xml_declaration=True)
+
+
+def update_ttf(path, location):
+    """Rewrite the name table of a .ttf in place"""
+    with open(path, "rb") as f:
+        data = f.read()
+    sfnt_version, num_tables = struct.unpack(">4sH", data[:6])
+    if sfnt_version not in SFNT_VERSIONS:
+        raise ValueError(f"{path} is not a TrueType or OpenType font")
+    directory = {}
+    for i in range(num_tables):
+        tag, checksum, offset, length = struct.unpack(">4sLLL", data[12 + 16 * i:28 + 16 * i])
+        directory[tag] = [checksum, offset, length]
+
+    name_table = newTable("name")
+    _, offset, length = directory[b"name"]
+    name_table.decompile(data[offset:offset + length], None)
+    rename(name_table, location_names(location))
+    name_data = name_table.compile(None)
+
+    # Keep the tables in their original order, with the new name data
+    header_size = 12 + 16 * num_tables
+    out = bytearray(data[:header_size])
+    for tag, entry in sorted(directory.items(), key=lambda t: t[1][1]):
+        checksum, offset, length = entry
+        table = name_data if tag == b"name" else data[offset:offset + length]
+        entry[1], entry[2] = len(out), len(table)
+        if tag == b"name":
+            entry[0] = calcChecksum(table)
+        out += table
+        out += b"\0" * (-len(out) % 4)
+    for i, (tag, (checksum, offset, length)) in enumerate(sorted(directory.items())):
+        struct.pack_into(">4sLLL", out, 12 + 16 * i, tag, checksum, offset, length)
+
+    head_offset = directory[b"head"][1]
+    struct.pack_into(">L", out, head_offset + 8, 0)
+    adjustment = (0xB1B0AFBA - calcChecksum(bytes(out))) & 0xFFFFFFFF
+    struct.pack_into(">L", out, head_offset + 8, adjustment)
 
-parser = argparse.ArgumentParser(description='A program to catch current location')
-parser.add_argument("-l", "--location", help="location coordinates", default="wght400-wdth100-opsz14-GRAD0")
-parser.add_argument("-p", "--ttxpath", help="location of ttx to update", default="wght400-wdth100-opsz14-GRAD0.ttx")
-args = parser.parse_args()
-print(args.location)
+    with open(path + ".tmp", "wb") as f:
+        f.write(out)
+    os.replace(path + ".tmp", path)
 
-tree = ET.parse(str(args.ttxpath))
 
-for namerecord in tree.findall('.*/namerecord[@nameID="1"]'):
-    print (namerecord)
-    namerecord.text = 'RobotoFlex ' + args.location
-    
-for namerecord in tree.findall('.*/namerecord[@nameID="2"]'):
-    print (namerecord)
-    namerecord.text = args.location
+def main():
+    parser = argparse.ArgumentParser(description='A program to catch current location')
+    parser.add_argument("-l", "--location", nargs="+", help=f"location coordinates, defaults to {DEFAULT_LOCATION} for a ttx and to the font filename for a ttf")
+    parser.add_argument("-p", "--ttxpath", help="location of ttx to update", default=f"{DEFAULT_LOCATION}.ttx")
+    parser.add_argument("--ttf", nargs="+", help="fonts to rename in place instead of a ttx")
+    args = parser.parse_args()
 
-for namerecord in tree.findall('.*/namerecord[@nameID="4"]'):
-    print (namerecord)
-    namerecord.text = 'RobotoFlex ' + args.location
+    if not args.ttf:
+        location = args.location[0] if args.location else DEFAULT_LOCATION
+        print(location)
+        update_ttx(args.ttxpath, location)
+        return
 
-for namerecord in tree.findall('.*/namerecord[@nameID="6"]'):
-    print (namerecord)
-    namerecord.text = 'RobotoFlex-' + args.location
+    locations = args.location or [location_from_path(p) for p in args.ttf]
+    if len(locations) != len(args.ttf):
+        parser.error("give one location per font")
+    start = time.time()
+    for path, location in zip(args.ttf, locations):
+        update_ttf(path, location)
+        print(f"{location}  {path}")
+    print(f"Renamed {len(args.ttf)} fonts in {time.time() - start:.2f}s")
 
-tree.write('out.xml', encoding="UTF-8", xml_declaration=True)
 
+if __name__ == "__main__":
+    main()